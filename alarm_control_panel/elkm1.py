@@ -6,6 +6,8 @@ Each non-Empty Area will be created as a separate Alarm panel in HASS.
 import asyncio
 import logging
 import time
+from collections import deque
+from itertools import islice
 from typing import Callable  # noqa
 
 from homeassistant.helpers.typing import ConfigType
@@ -18,6 +20,11 @@ from homeassistant.const import (
     )
 
 from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.restore_state import async_get_last_state
+
+from custom_components.elkm1 import (
+    DEFAULT_ACK_TIMEOUT, ElkDeviceBase, HISTORY_SIZE, _async_arm as async_arm)
 
 DEPENDENCIES = ['elkm1']
 
@@ -42,6 +49,7 @@ def async_setup_platform(hass, config: ConfigType,
     elk = hass.data['elkm1']['connection']
     elk_config = hass.data['elkm1']['config']
     discovered_devices = hass.data['elkm1']['discovered_devices']
+    entities = hass.data['elkm1']['entities']
 
     from elkm1.areas import Area as ElkArea
     from elkm1.keypads import Keypad as ElkKeypad
@@ -66,12 +74,13 @@ def async_setup_platform(hass, config: ConfigType,
         _LOGGER.debug('Loading Elk area %s: %s',
                       element[0].__class__.__name__, element[0].name)
         discovered_devices[element_name] = device
+        entities[device.entity_id] = device
         devices.append(device)
 
     async_add_devices(devices, True)
     return True
 
-class ElkAreaDevice(alarm.AlarmControlPanel):
+class ElkAreaDevice(ElkDeviceBase, alarm.AlarmControlPanel):
     """Representation of an Area / Partition within the Elk M1 alarm panel."""
 
     def __init__(self, area, elk, hass, show_override):
@@ -100,6 +109,30 @@ class ElkAreaDevice(alarm.AlarmControlPanel):
         self._sync_done = False
         self._armed_status = None
         self._show_override = show_override
+        self._restored_attributes = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._history_pending = False
+
+    @asyncio.coroutine
+    def async_added_to_hass(self):
+        """Restore our access history, and state until the panel confirms it."""
+        yield from super().async_added_to_hass()
+        state = yield from async_get_last_state(self.hass, self.entity_id)
+        if state is None:
+            return
+        # History we keep ourselves survives restarts regardless
+        attrs = state.attributes
+        self._last_armed_at = attrs.get('Last Armed At', 0)
+        self._last_disarmed_at = attrs.get('Last Disarmed At', 0)
+        self._last_user_at = attrs.get('Last User At', 0)
+        self._last_user_num = attrs.get('Last User Number')
+        self._last_user_name = attrs.get('Last User Name')
+        self._last_keypad_num = attrs.get('Last Keypad Number')
+        self._last_keypad_name = attrs.get('Last Keypad Name')
+
+    def _sync_key(self):
+        """Area status covers every area."""
+        return ('AS', None)
 
     def _sensor_event(self, event):
         event_data = event.data
@@ -122,7 +155,8 @@ class ElkAreaDevice(alarm.AlarmControlPanel):
             if event_data['type'] == 'keypad' and number in self._keypads:
                     self._keypads.remove(number)
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @property
     def name(self):
@@ -149,6 +183,10 @@ class ElkAreaDevice(alarm.AlarmControlPanel):
         """Return the state attributes of the sensor."""
         from elkm1.const import ArmedStatus, ArmUpState, AlarmState
         from elkm1.util import pretty_const
+        if self._stale:
+            attrs = dict(self._restored_attributes)
+            attrs['stale'] = True
+            return attrs
         if self._show_override is None:
             hidden = self._hidden
         else:
@@ -191,12 +229,52 @@ class ElkAreaDevice(alarm.AlarmControlPanel):
                     self._last_armed_at = time.time()
             else:
                 self._sync_done = True
+        if attribute in ['armed_status', 'arm_up_state', 'alarm_state'] and \
+                self.hass and not self._history_pending:
+            # One entry for all statuses of an area status message
+            self._history_pending = True
+            self.hass.loop.call_soon(self._record_history)
+        if attribute != 'name':
+            self._confirm()
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
+
+    def _record_history(self):
+        """Add the area's arm status to its history."""
+        self._history_pending = False
+        status = (self._element.armed_status, self._element.arm_up_state,
+                  self._element.alarm_state)
+        if self._history and self._history[-1][1:] == status:
+            return
+        self._history.append((time.time(),) + status)
+
+    def history(self, count):
+        """Return the last count arm transitions, newest first."""
+        from elkm1.const import ArmUpState
+        from elkm1.util import pretty_const
+
+        def _pretty(enum, value):
+            return None if value is None else pretty_const(enum(value).name)
+        return [{'at': at,
+                 'armed_status': _pretty(ArmedStatus, armed),
+                 'arm_up_state': _pretty(ArmUpState, arm_up),
+                 'alarm_state': _pretty(AlarmState, alarm)}
+                for at, armed, arm_up, alarm in islice(reversed(self._history), count)]
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
+        self._hidden = (len(self._keypads) == 0) and (len(self._zones) == 0) \
+            and (self._element.is_default_name())
+        if self._stale:
+            # Keep restored state until the panel confirms it
+            return
 
         if self._element.alarm_state is None:
             self._state = STATE_UNKNOWN
@@ -210,28 +288,44 @@ class ElkAreaDevice(alarm.AlarmControlPanel):
         else:
             self._state = ELK_STATE_2_HASS_STATE[self._element.armed_status]
 
-        self._hidden = (len(self._keypads) == 0) and (len(self._zones) == 0) \
-            and (self._element.is_default_name())
-
     def _entry_exit_timer_is_running(self):
         return self._element.timer1 > 0 or self._element.timer2 > 0
 
     def _area_is_in_alarm_state(self):
         return self._element.alarm_state >= AlarmState.FIRE_ALARM.value
 
-    def alarm_disarm(self, code=None):
-        """Send disarm command."""
-        self._element.disarm(int(code))
-        return
-
-    def alarm_arm_home(self, code=None):
-        """Send arm home command."""
-        from elkm1.const import ArmLevel
-        self._element.arm(ArmLevel.ARMED_STAY.value, int(code))
-        return
-
-    def alarm_arm_away(self, code=None):
-        """Send arm away command."""
-        from elkm1.const import ArmLevel
-        self._element.arm(ArmLevel.ARMED_AWAY.value, int(code))
-        return
+    @asyncio.coroutine
+    def async_alarm_disarm(self, code=None):
+        """Disarm, returning once the panel reports the area disarmed."""
+        yield from self._async_arm('disarm', code)
+
+    @asyncio.coroutine
+    def async_alarm_arm_home(self, code=None):
+        """Arm home, returning once the panel reports the area armed."""
+        yield from self._async_arm('stay', code)
+
+    @asyncio.coroutine
+    def async_alarm_arm_away(self, code=None):
+        """Arm away, returning once the panel reports the area armed."""
+        yield from self._async_arm('away', code)
+
+    @asyncio.coroutine
+    def _async_arm(self, level, code):
+        """Arm the area at level as the elkm1.arm service does.
+
+        Raises HomeAssistantError if the code is missing or rejected, the
+        area is not ready to arm, or the panel does not answer in time.
+        """
+        try:
+            code = int(code)
+        except (TypeError, ValueError):
+            raise HomeAssistantError(
+                'Unable to {} {}: a numeric code is required'.format(
+                    level, self._element.name))
+        result = yield from async_arm(
+            self.hass, self._elk, [self._element.index], level, code, [],
+            DEFAULT_ACK_TIMEOUT)
+        entry = result['areas'][0]
+        if not entry['success']:
+            raise HomeAssistantError('Unable to {} {}: {}'.format(
+                level, self._element.name, entry['error']))
@@ -0,0 +1,143 @@
+"""Measure HASS loop time for entities updating from a storm of callbacks.
+
+Run with the Python Home Assistant runs under:
+
+    python benchmarks/callback_storm.py [updates]
+
+No panel is needed. Zone sensors and output switches are built for every
+zone and output, and zone and output change messages are decoded as if
+read from the panel, so each element update goes through ElkInboundQueue
+to its entity. This is done once with entities refreshing through
+async_schedule_update_ha_state(True) and async_update, as they used to,
+and once computing their state in the callback with _update_state, as
+they do now. The loop time to drain the updates is reported per thousand.
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The component module is named elkm1 too and would shadow the library
+sys.path[:] = [path for path in sys.path
+               if os.path.abspath(path or os.curdir) != ROOT]
+
+# Installed as custom_components/elkm1.py and <domain>/elkm1.py below it,
+# where the platforms import from the component
+sys.modules['custom_components'] = types.ModuleType('custom_components')
+sys.modules['custom_components'].__path__ = [ROOT]
+
+
+def load(name):
+    """Import a new copy of one of the component's modules, e.g. 'elkm1'."""
+    name = 'custom_components.' + name
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+
+def frame(body):
+    """Return a panel message line, adding length and checksum."""
+    line = '{:02X}{}00'.format(len(body) + 4, body)
+    checksum = (256 - sum(ord(char) for char in line) % 256) % 256
+    return line + '{:02X}'.format(checksum)
+
+
+def storm(count):
+    """Return count lines flipping zones and outputs on and off."""
+    lines = []
+    for number in range(count):
+        index = number % 208 + 1
+        state = (number // 208) % 2
+        if number % 2:
+            lines.append(frame('ZC{:03d}{}'.format(index, 9 if state else 2)))
+        else:
+            lines.append(frame('CC{:03d}{}'.format(index, state)))
+    return lines
+
+
+def force_refresh(entity):
+    """Make entity refresh as it used to, in an async_update job."""
+    from homeassistant.helpers.entity import Entity
+    update_state = entity._update_state
+
+    @asyncio.coroutine
+    def async_update():
+        update_state()
+
+    entity._update_state = lambda: None
+    entity.async_update = async_update
+    entity.async_schedule_update_ha_state = \
+        lambda force_refresh=False: Entity.async_schedule_update_ha_state(
+            entity, True)
+
+
+def run(refresh, lines, config_dir):
+    """Drain lines through entities, refreshing them as refresh says."""
+    from elkm1 import message
+    from homeassistant.core import HomeAssistant
+    # Setup adds panel message handlers to the library's global registry
+    handlers = {message_type: list(registered) for message_type, registered
+                in message._message_handlers.items()}
+    component = load('elkm1')
+    component.SUPPORTED_DOMAINS = []
+    sensor = load('sensor.elkm1')
+    switch = load('switch.elkm1')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    hass = HomeAssistant(loop)
+    hass.config.config_dir = config_dir
+    config = component.CONFIG_SCHEMA({'elkm1': {
+        'host': 'elk://127.0.0.1:1'}})
+    loop.run_until_complete(component.async_setup(hass, config))
+    elk = hass.data['elkm1']['connection']
+    queue = hass.data['elkm1']['inbound_queue']
+    entities = [sensor.ElkSensorDevice(zone, elk, hass, None)
+                for zone in elk.zones]
+    entities += [switch.ElkOutputDevice(output, elk, hass, None)
+                 for output in elk.outputs]
+    for entity in entities:
+        entity.hass = hass
+        if refresh:
+            force_refresh(entity)
+
+    for line in lines:
+        elk._got_data(line)
+    start = time.perf_counter()
+    loop.run_until_complete(hass.async_block_till_done())
+    duration = time.perf_counter() - start
+
+    pending = asyncio.Task.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    hass.executor.shutdown()
+    loop.close()
+    message._message_handlers.clear()
+    message._message_handlers.update(handlers)
+    return {
+        'updates': queue.processed,
+        'loop_ms': round(duration * 1000, 1),
+        'per_1000_ms': round(duration * 1000 * 1000 / queue.processed, 2),
+        }
+
+
+def main():
+    """Run the storm with both update paths and print the loop time."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    lines = storm(count)
+    print('{:<14} {:>8} {:>10} {:>16}'.format(
+        'update path', 'updates', 'loop ms', 'ms per 1000'))
+    for name, refresh in (('async_update', True), ('_update_state', False)):
+        with tempfile.TemporaryDirectory() as config_dir:
+            result = run(refresh, lines, config_dir)
+        print('{:<14} {:>8} {:>10} {:>16}'.format(
+            name, result['updates'], result['loop_ms'],
+            result['per_1000_ms']))
+
+
+if __name__ == '__main__':
+    main()
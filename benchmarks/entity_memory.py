@@ -0,0 +1,62 @@
+"""Measure the memory each Elk entity class takes on a fully populated panel.
+
+Run with the Python Home Assistant runs under:
+
+    python benchmarks/entity_memory.py
+
+No panel or Home Assistant instance is needed. Every entity class of every
+platform is built for every element a new Elk object supports, as the
+elkm1.memory_report service does on a live install.
+"""
+import importlib
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The component module is named elkm1 too and would shadow the library
+sys.path[:] = [path for path in sys.path
+               if os.path.abspath(path or os.curdir) != ROOT]
+
+# Installed as custom_components/elkm1.py and <domain>/elkm1.py below it,
+# where the platforms import from the component
+sys.modules['custom_components'] = types.ModuleType('custom_components')
+sys.modules['custom_components'].__path__ = [ROOT]
+
+
+def load(name):
+    """Import a new copy of one of the component's modules, e.g. 'elkm1'."""
+    name = 'custom_components.' + name
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+
+def main():
+    """Build every entity class against a new Elk and print the report."""
+    from elkm1 import Elk
+    component = load('elkm1')
+    config = component.CONFIG_SCHEMA(
+        {'elkm1': {'host': 'elk://127.0.0.1:1'}})['elkm1']
+    platforms = {}
+    entity_classes = []
+    for domain, class_name, element_lists in component.MEMORY_ENTITIES:
+        if domain not in platforms:
+            platforms[domain] = load(domain + '.elkm1')
+        entity_classes.append(
+            (getattr(platforms[domain], class_name), element_lists))
+    elk = Elk({'url': 'elk://127.0.0.1:1'})
+    result = component._memory_report(entity_classes, elk, config)
+
+    print('{:<40} {:>8} {:>10} {:>10}'.format(
+        'entity class / element', 'entities', 'bytes', 'per entity'))
+    for kind, usage in sorted(result['types'].items()):
+        print('{:<40} {:>8} {:>10} {:>10}'.format(
+            kind, usage['entities'], usage['bytes'],
+            usage['bytes_per_entity']))
+    print('{:<40} {:>8} {:>10}'.format('total', '', result['bytes']))
+    print('measured in {} ms'.format(result['duration_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Measure HASS event loop lag while the panel sends a storm of messages.
+
+Run with the Python Home Assistant runs under:
+
+    python benchmarks/io_thread_lag.py [lines]
+
+No panel is needed. The component is set up on a new Home Assistant once
+with io_thread off and once with it on, and a storm of zone and output
+change messages is decoded as if read from the panel, in reads of a few
+lines each. A heartbeat on the HASS loop asleep for 1 ms records how late
+it wakes up; that lateness is the lag automations and the frontend see.
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+import types
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The component module is named elkm1 too and would shadow the library
+sys.path[:] = [path for path in sys.path
+               if os.path.abspath(path or os.curdir) != ROOT]
+
+# Installed as custom_components/elkm1.py and <domain>/elkm1.py below it,
+# where the platforms import from the component
+sys.modules['custom_components'] = types.ModuleType('custom_components')
+sys.modules['custom_components'].__path__ = [ROOT]
+
+HEARTBEAT = 0.001   # Seconds between heartbeats on the HASS loop
+LINES_PER_READ = 8  # Panel lines decoded per simulated read
+
+
+def load(name):
+    """Import a new copy of one of the component's modules, e.g. 'elkm1'."""
+    name = 'custom_components.' + name
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+
+def frame(body):
+    """Return a panel message line, adding length and checksum."""
+    line = '{:02X}{}00'.format(len(body) + 4, body)
+    checksum = (256 - sum(ord(char) for char in line) % 256) % 256
+    return line + '{:02X}'.format(checksum)
+
+
+def storm(count):
+    """Return count lines flipping zones and outputs on and off."""
+    lines = []
+    for number in range(count):
+        index = number % 208 + 1
+        state = (number // 208) % 2
+        if number % 2:
+            lines.append(frame('ZC{:03d}{}'.format(index, 9 if state else 2)))
+        else:
+            lines.append(frame('CC{:03d}{}'.format(index, state)))
+    return lines
+
+
+def run(io_thread, lines, config_dir):
+    """Decode lines with the given io_thread setting, return lag figures."""
+    from elkm1 import message
+    from homeassistant.core import HomeAssistant
+    # Setup adds panel message handlers to the library's global registry
+    handlers = {message_type: list(registered) for message_type, registered
+                in message._message_handlers.items()}
+    component = load('elkm1')
+    component.SUPPORTED_DOMAINS = []
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    hass = HomeAssistant(loop)
+    hass.config.config_dir = config_dir
+    config = component.CONFIG_SCHEMA({'elkm1': {
+        'host': 'elk://127.0.0.1:1', 'io_thread': io_thread}})
+    loop.run_until_complete(component.async_setup(hass, config))
+    elk = hass.data['elkm1']['connection']
+    queue = hass.data['elkm1']['inbound_queue']
+    for element in list(elk.zones) + list(elk.outputs):
+        # Stand-in for an entity writing its state
+        element.add_callback(
+            lambda attribute, value, entity_id='sensor.elk_{}'.format(
+                id(element)): hass.states.async_set(entity_id, str(value)))
+
+    read = []
+
+    def _read(offset):
+        # One read per panel loop iteration, like data_received
+        for line in lines[offset:offset + LINES_PER_READ]:
+            elk._got_data(line)
+        read.append(offset)
+        if offset + LINES_PER_READ < len(lines):
+            elk.loop.call_soon(_read, offset + LINES_PER_READ)
+
+    lags = []
+
+    @asyncio.coroutine
+    def _heartbeat():
+        elk.loop.call_soon_threadsafe(_read, 0)
+        while len(read) < -(-len(lines) // LINES_PER_READ) or \
+                queue.stats()['depth'] or not lags:
+            start = loop.time()
+            yield from asyncio.sleep(HEARTBEAT)
+            lags.append(loop.time() - start - HEARTBEAT)
+
+    start = time.perf_counter()
+    loop.run_until_complete(asyncio.wait_for(_heartbeat(), 60))
+    duration = time.perf_counter() - start
+
+    if io_thread:
+        hass.data['elkm1']['io_worker'].stop()
+    pending = asyncio.Task.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    hass.executor.shutdown()
+    loop.close()
+    message._message_handlers.clear()
+    message._message_handlers.update(handlers)
+    lags.sort()
+    return {
+        'duration_ms': round(duration * 1000, 1),
+        'lag_p50_ms': round(lags[len(lags) // 2] * 1000, 2),
+        'lag_max_ms': round(lags[-1] * 1000, 2),
+        'updates': queue.processed,
+        }
+
+
+def main():
+    """Run the storm without and with the I/O thread and print the lag."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    lines = storm(count)
+    print('{:<10} {:>8} {:>12} {:>12} {:>12}'.format(
+        'io_thread', 'updates', 'total ms', 'lag p50 ms', 'lag max ms'))
+    for io_thread in (False, True):
+        with tempfile.TemporaryDirectory() as config_dir:
+            result = run(io_thread, lines, config_dir)
+        print('{:<10} {:>8} {:>12} {:>12} {:>12}'.format(
+            str(io_thread), result['updates'], result['duration_ms'],
+            result['lag_p50_ms'], result['lag_max_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,8 @@ from homeassistant.helpers.typing import ConfigType
 from homeassistant.components.climate import (
     STATE_IDLE, STATE_HEAT, STATE_COOL, STATE_AUTO, STATE_FAN_ONLY,
     ATTR_TEMPERATURE, ATTR_TARGET_TEMP_LOW, ATTR_TARGET_TEMP_HIGH,
-    ATTR_CURRENT_TEMPERATURE, PRECISION_WHOLE, ClimateDevice,
+    ATTR_CURRENT_TEMPERATURE, ATTR_CURRENT_HUMIDITY, ATTR_FAN_MODE,
+    PRECISION_WHOLE, ClimateDevice,
     SUPPORT_TARGET_TEMPERATURE, SUPPORT_TARGET_TEMPERATURE_HIGH,
     SUPPORT_TARGET_TEMPERATURE_LOW, SUPPORT_FAN_MODE,
     SUPPORT_OPERATION_MODE, SUPPORT_AUX_HEAT,
@@ -20,6 +21,8 @@ from homeassistant.const import (
 
 from homeassistant.core import callback
 
+from custom_components.elkm1 import ElkDeviceBase
+
 DEPENDENCIES = ['elkm1']
 
 _LOGGER = logging.getLogger(__name__)
@@ -34,6 +37,7 @@ def async_setup_platform(hass, config: ConfigType,
     elk = hass.data['elkm1']['connection']
     elk_config = hass.data['elkm1']['config']
     discovered_devices = hass.data['elkm1']['discovered_devices']
+    entities = hass.data['elkm1']['entities']
     #if elk is None:
     #    _LOGGER.error('Elk is None')
     #    return False
@@ -69,6 +73,7 @@ def async_setup_platform(hass, config: ConfigType,
             _LOGGER.debug('Loading Elk %s: %s', element[0].__class__.__name__, element[0].name)
             device = ElkClimateDevice(element[0], elk, hass, element[1])
             discovered_devices[element_name] = device
+            entities[device.entity_id] = device
             devices.append(device)
         else:
             _LOGGER.debug('Skipping already loaded Elk %s: %s', element[0].__class__.__name__, element[0].name)
@@ -77,9 +82,13 @@ def async_setup_platform(hass, config: ConfigType,
     return True
 
 
-class ElkClimateDevice(ClimateDevice):
+class ElkClimateDevice(ElkDeviceBase, ClimateDevice):
     """Elk connected thermostat as Climate device."""
 
+    # Element attributes shown, the only ones we are woken for
+    ATTRIBUTES = {'name', 'mode', 'fan', 'current_temp', 'heat_setpoint',
+                  'cool_setpoint', 'humidity'}
+
     def __init__(self, device, elk, hass, show_override):
         """Initialize device sensor."""
         self._type = None
@@ -87,14 +96,38 @@ class ElkClimateDevice(ClimateDevice):
         self._hidden = self._element.is_default_name()
         self._name = 'elkm1_' + self._element.default_name('_').lower()
         self.entity_id = 'climate.' + self._name
-        self._element.add_callback(self.trigger_update)
+        hass.data['elkm1']['inbound_queue'].subscribe(
+            self._element, self.ATTRIBUTES, self.trigger_update)
         self._show_override = show_override
+        self._restored_state = None
+        self._restored_attributes = {}
+        self._debounce = hass.data['elkm1']['config']['thermostat_debounce']
+        self._pending_settings = {}
+        self._write_timer = None
+
+    def _sync_key(self):
+        """Thermostat data comes one thermostat at a time."""
+        return ('TR', self._element._index)
+
+    def _restore(self, state):
+        """Keep the restored operation mode apart from our own state."""
+        self._restored_state = state.state
+        self._restored_attributes = dict(state.attributes)
+
+    def _restored(self, attribute, value):
+        """Return restored attribute while stale, else the panel value."""
+        if self._stale:
+            return self._restored_attributes.get(attribute)
+        return value
 
     @callback
     def trigger_update(self, attribute, value):
         """Target of PyElk callback."""
+        if attribute != 'name':
+            self._confirm()
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @property
     def supported_features(self):
@@ -115,8 +148,8 @@ class ElkClimateDevice(ClimateDevice):
     def current_temperature(self):
         """Return the current temperature."""
         if self._element.current_temp is not None and self._element.current_temp > 0:
-                return self._element.current_temp
-        return None
+                return self._restored(ATTR_CURRENT_TEMPERATURE, self._element.current_temp)
+        return self._restored(ATTR_CURRENT_TEMPERATURE, None)
 
     @property
     def should_poll(self) -> bool:
@@ -127,6 +160,8 @@ class ElkClimateDevice(ClimateDevice):
     def state(self):
         """Return the current state."""
         from elkm1.const import ThermostatSetting, ThermostatMode, ThermostatFan, ThermostatHold
+        if self._stale:
+            return self._restored_state
         # We can't actually tell if it's actively running in any of these
         # modes, just what mode is set
         if (self._element.mode == ThermostatMode.OFF.value) and (
@@ -162,6 +197,15 @@ class ElkClimateDevice(ClimateDevice):
             'hidden': hidden,
             'temp_unit' : self.temperature_unit,
             }
+        if self._stale:
+            data['stale'] = True
+        data['Mode Hours 24h'] = self._runtime_hours('mode', 24)
+        data['Mode Hours 7d'] = self._runtime_hours('mode', 168)
+        data['Fan Hours 24h'] = self._runtime_hours('fan', 24)
+        data['Fan Hours 7d'] = self._runtime_hours('fan', 168)
+        poller = self.hass.data['elkm1']['poller']
+        data['Last Reported'] = poller.last_reported('thermostat', self._element.index)
+        data['Staleness'] = poller.staleness('thermostat', self._element.index)
         # Pending Omni2 support
         #if self._element.temp_outside is not None and self._element.temp_outside > -460:
         #    data['temp_outside'] = self._element.temp_outside
@@ -173,12 +217,41 @@ class ElkClimateDevice(ClimateDevice):
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
-        #if self._element.age() > 5:
-        #    # Only poll device if last update was more than 5 seconds ago
-        #    self.request_temp()
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
+        # Temperatures are polled by the elkm1 component's poll scheduler
         self._hidden = self._element.is_default_name()
-        return
+        if self._confirmed:
+            self._account_runtime()
+
+    def _runtime_key(self, setting):
+        """Return the accounting key for our mode or fan."""
+        return 'thermostat_{}_{}'.format(self._element.index + 1, setting)
+
+    def _account_runtime(self):
+        """Track time spent in each mode and fan state."""
+        from elkm1.const import ThermostatMode, ThermostatFan
+        runtime = self.hass.data['elkm1']['hvac_runtime']
+        try:
+            runtime.transition(self._runtime_key('mode'),
+                               ThermostatMode(self._element.mode).name)
+            runtime.transition(self._runtime_key('fan'),
+                               ThermostatFan(self._element.fan).name)
+        except ValueError:
+            _LOGGER.debug('Unknown mode %s / fan %s on %s', self._element.mode,
+                          self._element.fan, self._element.name)
+
+    def _runtime_hours(self, setting, hours):
+        """Return hours spent in each mode or fan state over a window."""
+        from elkm1.util import pretty_const
+        totals = self.hass.data['elkm1']['hvac_runtime'].totals(
+            self._runtime_key(setting), hours)
+        return {pretty_const(state): round(seconds / 3600, 2)
+                for state, seconds in totals.items()}
 
     @property
     def unit_of_measurement(self):
@@ -189,6 +262,8 @@ class ElkClimateDevice(ClimateDevice):
     def current_humidity(self):
         """Return the current humidity."""
         # FIXME: Should this be converted from RH to AH?
+        if self._stale:
+            return self._restored_attributes.get(ATTR_CURRENT_HUMIDITY, STATE_UNKNOWN)
         if self._element.humidity is not None and self._element.humidity > 0:
             return self._element.humidity
         return STATE_UNKNOWN
@@ -203,6 +278,8 @@ class ElkClimateDevice(ClimateDevice):
     def target_temperature(self):
         """Return the temperature we try to reach."""
         from elkm1.const import ThermostatMode
+        if self._stale:
+            return self._restored_attributes.get(ATTR_TEMPERATURE)
         if (self._element.mode == ThermostatMode.HEAT.value) or (
             self._element.mode == ThermostatMode.EMERGENCY_HEAT.value):
             return self._element.heat_setpoint
@@ -213,12 +290,12 @@ class ElkClimateDevice(ClimateDevice):
     @property
     def target_temperature_high(self):
         """Return the highbound target temperature we try to reach."""
-        return self._element.cool_setpoint
+        return self._restored(ATTR_TARGET_TEMP_HIGH, self._element.cool_setpoint)
 
     @property
     def target_temperature_low(self):
         """Return the lowbound target temperature we try to reach."""
-        return self._element.heat_setpoint
+        return self._restored(ATTR_TARGET_TEMP_LOW, self._element.heat_setpoint)
 
     @property
     def min_temp(self):
@@ -255,42 +332,47 @@ class ElkClimateDevice(ClimateDevice):
     def current_fan_mode(self):
         """Return the fan setting."""
         from elkm1.const import ThermostatFan
+        if self._stale:
+            return self._restored_attributes.get(ATTR_FAN_MODE, STATE_UNKNOWN)
         if self._element.fan == ThermostatFan.AUTO.value:
             return STATE_AUTO
         elif self._element.fan == ThermostatFan.ON.value:
             return STATE_ON
         return STATE_UNKNOWN
 
-    def set_operation_mode(self, operation_mode):
+    @asyncio.coroutine
+    def async_set_operation_mode(self, operation_mode):
         """Set mode."""
         from elkm1.const import ThermostatMode, ThermostatSetting, ThermostatFan
         if operation_mode == STATE_IDLE:
-            self._element.set(ThermostatSetting.MODE.value, ThermostatMode.OFF.value)
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+            self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.OFF.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
         elif operation_mode == STATE_HEAT:
-            self._element.set(ThermostatSetting.MODE.value, ThermostatMode.HEAT.value)
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+            self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.HEAT.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
         elif operation_mode == STATE_COOL:
-            self._element.set(ThermostatSetting.MODE.value, ThermostatMode.COOL.value)
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+            self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.COOL.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
         elif operation_mode == STATE_AUTO:
-            self._element.set(ThermostatSetting.MODE.value, ThermostatMode.AUTO.value)
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+            self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.AUTO.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
         elif operation_mode == STATE_FAN_ONLY:
-            self._element.set(ThermostatSetting.MODE.value, ThermostatMode.OFF.value)
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.ON.value)
+            self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.OFF.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.ON.value)
 
-    def turn_aux_heat_on(self):
+    @asyncio.coroutine
+    def async_turn_aux_heat_on(self):
         """Turn auxiliary heater on."""
         from elkm1.const import ThermostatMode, ThermostatSetting, ThermostatFan
-        self._element.set(ThermostatSetting.MODE.value, ThermostatMode.EMERGENCY_HEAT.value)
-        self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+        self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.EMERGENCY_HEAT.value)
+        self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
 
-    def turn_aux_heat_off(self):
+    @asyncio.coroutine
+    def async_turn_aux_heat_off(self):
         """Turn auxiliary heater off."""
         from elkm1.const import ThermostatMode, ThermostatSetting, ThermostatFan
-        self._element.set(ThermostatSetting.MODE.value, ThermostatMode.HEAT.value)
-        self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+        self._queue_setting(ThermostatSetting.MODE.value, ThermostatMode.HEAT.value)
+        self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
 
     @property
     def fan_list(self):
@@ -300,26 +382,56 @@ class ElkClimateDevice(ClimateDevice):
             STATE_ON,
         ]
 
-    def set_fan_mode(self, fan):
+    @asyncio.coroutine
+    def async_set_fan_mode(self, fan):
         """Set new target fan mode."""
         from elkm1.const import ThermostatSetting, ThermostatFan
         if fan == STATE_AUTO:
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.AUTO.value)
         elif fan == STATE_ON:
-            self._element.set(ThermostatSetting.FAN.value, ThermostatFan.ON.value)
+            self._queue_setting(ThermostatSetting.FAN.value, ThermostatFan.ON.value)
 
-    def set_temperature(self, **kwargs):
+    @asyncio.coroutine
+    def async_set_temperature(self, **kwargs):
         """Set new target temperature."""
         from elkm1.const import ThermostatMode, ThermostatSetting
         low_temp = kwargs.get(ATTR_TARGET_TEMP_LOW)
         high_temp = kwargs.get(ATTR_TARGET_TEMP_HIGH)
         if low_temp is not None:
             low_temp = round(low_temp)
-            self._element.set(ThermostatSetting.HEAT_SETPOINT.value, low_temp)
+            self._queue_setting(ThermostatSetting.HEAT_SETPOINT.value, low_temp)
         if high_temp is not None:
             high_temp = round(high_temp)
-            self._element.set(ThermostatSetting.COOL_SETPOINT.value, high_temp)
+            self._queue_setting(ThermostatSetting.COOL_SETPOINT.value, high_temp)
+
+    def _queue_setting(self, setting, value):
+        """Queue a thermostat write until no change is made for a while.
+
+        Clicking through setpoints or modes only writes the final values,
+        and only those that differ from what the thermostat reports.
+        """
+        self._pending_settings[setting] = value
+        if self._write_timer is not None:
+            self._write_timer.cancel()
+            self._write_timer = None
+        if self._debounce > 0:
+            self._write_timer = self.hass.loop.call_later(
+                self._debounce, self._write_settings)
+        else:
+            self._write_settings()
 
-    #def request_temp(self):
-    #    """Request temperature."""
-    #    self._element.request_temp()
+    @callback
+    def _write_settings(self):
+        """Write queued thermostat settings that would change anything."""
+        from elkm1.const import ThermostatSetting
+        current = {
+            ThermostatSetting.MODE.value: self._element.mode,
+            ThermostatSetting.FAN.value: self._element.fan,
+            ThermostatSetting.COOL_SETPOINT.value: self._element.cool_setpoint,
+            ThermostatSetting.HEAT_SETPOINT.value: self._element.heat_setpoint,
+            }
+        self._write_timer = None
+        pending, self._pending_settings = self._pending_settings, {}
+        for setting, value in sorted(pending.items()):
+            if current.get(setting) != value:
+                self._element.set(setting, value)
@@ -18,21 +18,42 @@ You can use ```host: /dev/ttyUSB0``` or such as well to speak to a directly
 attached serial device
 """
 import asyncio
+import bisect
+import copy
+import cProfile
+import gc
+import io
+import json
 import logging
+import math
+import os
+import pstats
 import re
+import threading
+import time
+import tracemalloc
 
+from array import array
+from collections import deque
+from datetime import timedelta
 from functools import partial
 
 import voluptuous as vol
 
-from homeassistant.core import HomeAssistant  # noqa
+from homeassistant.core import HomeAssistant, callback  # noqa
 from homeassistant.const import (
-    CONF_HOST,
+    ATTR_ENTITY_ID, STATE_ON, STATE_OFF,
+    CONF_HOST, CONF_PORT,
     CONF_EXCLUDE, CONF_INCLUDE,
     CONF_USERNAME, CONF_PASSWORD,
     EVENT_HOMEASSISTANT_STOP)
 from homeassistant.helpers import discovery, config_validation as cv
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.restore_state import async_get_last_state
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.typing import ConfigType # noqa
+from homeassistant.loader import get_platform
+import homeassistant.util.dt as dt_util
 
 DOMAIN = "elkm1"
 REQUIREMENTS = [
@@ -51,6 +72,46 @@ CONF_PANEL = 'panel'
 CONF_PLC = 'plc' # Not light because HASS complains about this
 CONF_ZONE = 'zone'
 
+CONF_PROXY = 'proxy'
+CONF_BIND = 'bind'
+CONF_IO_THREAD = 'io_thread'    # True to run panel I/O in its own thread
+CONF_QUEUE_SIZE = 'queue_size'  # Inbound updates queued before coalescing
+CONF_CAPTURE = 'capture'        # Record raw panel traffic
+CONF_AUDIT = 'audit'            # Log keypad access
+CONF_RULES = 'rules'            # Panel-side reactions to element changes
+CONF_ATTRIBUTE = 'attribute'
+CONF_VALUE = 'value'
+CONF_FORMAT = 'format'
+CONF_FILE = 'file'
+CONF_MAX_SIZE = 'max_size'
+CONF_BACKUPS = 'backups'
+CONF_SPEED = 'speed'
+CONF_LIGHT_DEBOUNCE = 'light_debounce'  # Seconds between brightness writes
+CONF_THERMOSTAT_DEBOUNCE = 'thermostat_debounce'  # Seconds to wait for more changes
+CONF_POLL_BUDGET = 'poll_budget'        # Temperature polls per minute
+
+ATTR_AREAS = 'areas'
+ATTR_BRIGHTNESS = 'brightness'
+ATTR_BYPASS = 'bypass'
+ATTR_CODE = 'code'
+ATTR_COUNT = 'count'
+ATTR_END = 'end'
+ATTR_DURATION = 'duration'
+ATTR_INDEX = 'index'
+ATTR_KIND = 'kind'
+ATTR_LEVEL = 'level'
+ATTR_LIMIT = 'limit'
+ATTR_LIGHTS = 'lights'
+ATTR_OUTPUTS = 'outputs'
+ATTR_START = 'start'
+ATTR_STATE = 'state'
+ATTR_TASKS = 'tasks'
+ATTR_TIMEOUT = 'timeout'
+ATTR_USER = 'user'
+ATTR_VALUE = 'value'
+ATTR_VALUES = 'values'
+ATTR_ZONES = 'zones'
+
 CONF_ENABLED = 'enabled'    # True to enable subdomain
 CONF_HIDE = 'hide'
 CONF_SHOW = 'show'
@@ -61,6 +122,20 @@ CONF_SHOW = 'show'
 
 DEFAULT_ENABLED = True                  # Enable subdomains
 DEFAULT_EXCLUDE = []                    # Exclude none
+DEFAULT_PROXY_BIND = '127.0.0.1'        # Only local clients by default
+DEFAULT_PROXY_PORT = 2101               # Same as M1XEP non-secure port
+DEFAULT_IO_THREAD = False               # Panel I/O on HASS event loop
+DEFAULT_QUEUE_SIZE = 500                # Inbound element updates
+DEFAULT_CAPTURE_FILE = 'elkm1_capture.log'
+DEFAULT_CAPTURE_MAX_SIZE = 1048576      # Bytes per capture file
+DEFAULT_CAPTURE_BACKUPS = 5             # Rotated capture files kept
+DEFAULT_AUDIT_FILE = 'elkm1_audit.log'
+DEFAULT_AUDIT_MAX_SIZE = 1048576        # Bytes per audit file
+DEFAULT_AUDIT_BACKUPS = 5               # Rotated audit files kept
+DEFAULT_LIGHT_DEBOUNCE = 0.5            # Seconds, 0 to write every change
+DEFAULT_THERMOSTAT_DEBOUNCE = 1.0       # Seconds, 0 to write every change
+DEFAULT_POLL_BUDGET = 6                 # Messages per minute, 0 to disable
+DEFAULT_ACK_TIMEOUT = 10                # Seconds to wait for the panel
 #DEFAULT_FASTLOAD = True     # Default enabled
 #DEFAULT_FASTLOAD_FILE = '/config/PyElk-fastload.json'   # Default
 
@@ -78,9 +153,149 @@ DEFAULT_EXCLUDE = []                    # Exclude none
 #    }
 
 EVENT_PYELK_UPDATE = 'elkm1_pyelk_update'
+EVENT_REPLAY_DONE = 'elkm1_replay_done'
+EVENT_SYNCED = 'elkm1_synced'
+EVENT_LIGHTS_BULK_DONE = 'elkm1_lights_bulk_done'
+EVENT_ON_TIME = 'elkm1_on_time'
+EVENT_SET_VALUES_DONE = 'elkm1_set_values_done'
+EVENT_ARM_DONE = 'elkm1_arm_done'
+EVENT_HISTORY = 'elkm1_history'
+EVENT_AUDIT = 'elkm1_audit'
+EVENT_SNAPSHOT_DONE = 'elkm1_snapshot_done'
+EVENT_PROFILE_DONE = 'elkm1_profile_done'
+EVENT_MEMORY_REPORT = 'elkm1_memory_report'
+
+SERVICE_REPLAY = 'replay'
+SERVICE_LIGHTS_BULK = 'lights_bulk'
+SERVICE_OUTPUTS_ON = 'outputs_on'
+SERVICE_ON_TIME = 'on_time'
+SERVICE_SET_VALUES = 'set_values'
+SERVICE_ARM = 'arm'
+SERVICE_HISTORY = 'history'
+SERVICE_AUDIT = 'audit'
+SERVICE_SNAPSHOT = 'snapshot'
+SERVICE_PROFILE = 'profile'
+SERVICE_MEMORY_REPORT = 'memory_report'
+
+KIND_COUNTER = 'counter'
+KIND_SETTING = 'setting'
+
+SPEED_MAX = 'max'
+
+# Panel messages that confirm state during sync, and for those covering a
+# single element, the decoded field holding its index
+SYNC_MESSAGES = {
+    'AS': None, 'CS': None, 'KA': None, 'LW': None, 'VN': None, 'ZS': None,
+    'CR': 'index', 'CV': 'counter', 'PS': 'bank', 'TR': 'thermostat_index',
+    }
+
+# X10 function codes for the pc (PLC control) command, sent with any unit
+# of the house code for house-wide commands
+X10_ALL_UNITS_OFF = 1
+X10_ALL_LIGHTS_ON = 2
+PLC_BANK_SIZE = 64
+# Longest on time, in seconds, the panel can time an output for
+MAX_OUTPUT_DURATION = 65535
+# Arm levels for the al command, and the armed status each ends up in
+# (elkm1.const ArmLevel and ArmedStatus values)
+ARM_LEVELS = {
+    'disarm': ('0', '0'),
+    'away': ('1', '1'),
+    'stay': ('2', '2'),
+    'stay_instant': ('3', '3'),
+    'night': ('4', '4'),
+    'night_instant': ('5', '5'),
+    'vacation': ('6', '6'),
+    'force_away': ('9', '1'),
+    'force_stay': (':', '2'),
+    }
+ZONE_BYPASSED = 3                   # ZoneLogicalStatus.BYPASSED
+# Zone aggregates, by ZoneLogicalStatus value, plus physically open zones
+ZONE_LOGICAL_AGGREGATES = {1: 'troubled', 2: 'violated', 3: 'bypassed'}
+ZONE_OPEN = 1                       # ZonePhysicalStatus.OPEN
+# Entity classes built one per element, as (element, elk, hass, show), by
+# platform, with the Elk element lists they are built for
+MEMORY_ENTITIES = (
+    ('alarm_control_panel', 'ElkAreaDevice', ('areas',)),
+    ('climate', 'ElkClimateDevice', ('thermostats',)),
+    ('light', 'ElkLightDevice', ('lights',)),
+    ('sensor', 'ElkAreaTimerSensor', ('areas',)),
+    ('sensor', 'ElkSensorDevice', ('panel', 'zones', 'keypads', 'thermostats',
+                                   'counters', 'settings')),
+    ('sensor', 'ElkZoneAggregateSensor', ('areas',)),
+    ('switch', 'ElkOutputDevice', ('outputs',)),
+    ('switch', 'ElkTaskDevice', ('tasks',)),
+    )
+
+# Temperature polling intervals, in seconds. Intervals halve when a poll
+# finds a changed value and double when it does not.
+POLL_MIN_INTERVAL = 60
+POLL_MAX_INTERVAL = 1800
+POLL_ACTIVE_MAX_INTERVAL = 300      # Thermostats not in off mode
+POLL_TICK = timedelta(seconds=5)
+
+# State time accounting keeps hourly buckets for a rolling week, plus the
+# hour partly outside the window
+ACCOUNTING_HOURS = 7 * 24 + 1
+ACCOUNTING_SAVE_DELAY = 300         # Seconds, batches writes to storage
+STORAGE_VERSION = 1
+# Rolling windows of on time and violations shown, (name, hours)
+ON_TIME_WINDOWS = (('1h', 1), ('24h', 24), ('7d', 168))
+# Status transitions kept per zone, and arm transitions per area
+HISTORY_SIZE = 100
+
+# How often buffered capture records are written out
+CAPTURE_FLUSH_INTERVAL = timedelta(seconds=5)
+# Seconds after a keypad access to read the area's resulting arm status
+AUDIT_SETTLE_DELAY = 5
+# Every this many audit records, the record's time and offset are indexed
+AUDIT_INDEX_EVERY = 64
+
+# Responses the panel sends for commands proxy clients may issue, so that
+# their writes wait in the same queue as ours
+PROXY_RESPONSES = {
+    'as': 'AS', 'az': 'AZ', 'cp': 'CR', 'cr': 'CR', 'cs': 'CS', 'cv': 'CV',
+    'cx': 'CV', 'ka': 'KA', 'lw': 'LW', 'ps': 'PS', 'sd': 'SD', 'vn': 'VN',
+    'zb': 'ZB', 'zd': 'ZD', 'zp': 'ZP', 'zs': 'ZS', 'zv': 'ZV',
+    }
+# Bytes allowed to pile up for a slow proxy client before lines are dropped
+PROXY_WRITE_BUFFER_LIMIT = 65536
+
+# Element updates that are never coalesced, however full the inbound queue
+# gets, by element class. None means every attribute of that class.
+SECURITY_ATTRIBUTES = {
+    'Area': None,
+    'Keypad': {'area', 'last_user'},
+    'Panel': {'remote_programming_status'},
+    'Zone': {'area', 'bypassed', 'definition', 'logical_status',
+             'physical_status'},
+    }
+# Element updates run per pass of the HASS loop when draining the queue
+QUEUE_FLUSH_BATCH = 256
+# Element attributes rules can be triggered by, by element class
+RULE_ATTRIBUTES = {
+    'Area': {'alarm_state', 'arm_up_state', 'armed_status'},
+    'Output': {'output_on'},
+    'Zone': {'bypassed', 'logical_status', 'physical_status'},
+    }
+# Status dumps sent by the panel on sync, which never fire rules. The AS
+# reply to the area sync doesn't either, but AS also reports live changes.
+RULE_QUIET_MESSAGES = ('CS', 'ZS')
 
 _LOGGER = logging.getLogger(__name__)
 
+
+def _unique_values(items):
+    """Reject a batch writing the same counter or setting twice."""
+    seen = set()
+    for item in items:
+        key = (item[ATTR_KIND], item[ATTR_INDEX])
+        if key in seen:
+            raise vol.Invalid('{} {} is given more than once'.format(*key))
+        seen.add(key)
+    return items
+
+
 CONFIG_SCHEMA_SUBDOMAIN = vol.Schema({
     vol.Optional(CONF_ENABLED, default=DEFAULT_ENABLED): cv.boolean,
     vol.Optional(CONF_INCLUDE): list,
@@ -89,6 +304,117 @@ CONFIG_SCHEMA_SUBDOMAIN = vol.Schema({
     vol.Optional(CONF_SHOW): list,
     })
 
+CONFIG_SCHEMA_CAPTURE = vol.Schema({
+    vol.Optional(CONF_FILE, default=DEFAULT_CAPTURE_FILE): cv.string,
+    vol.Optional(CONF_MAX_SIZE, default=DEFAULT_CAPTURE_MAX_SIZE):
+        cv.positive_int,
+    vol.Optional(CONF_BACKUPS, default=DEFAULT_CAPTURE_BACKUPS):
+        cv.positive_int,
+    })
+
+CONFIG_SCHEMA_AUDIT = vol.Schema({
+    vol.Optional(CONF_FILE, default=DEFAULT_AUDIT_FILE): cv.string,
+    vol.Optional(CONF_MAX_SIZE, default=DEFAULT_AUDIT_MAX_SIZE):
+        cv.positive_int,
+    vol.Optional(CONF_BACKUPS, default=DEFAULT_AUDIT_BACKUPS):
+        cv.positive_int,
+    })
+
+CONFIG_SCHEMA_RULE = vol.All(vol.Schema({
+    vol.Exclusive(CONF_ZONE, 'trigger'): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Exclusive(CONF_AREA, 'trigger'): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Exclusive(CONF_OUTPUT, 'trigger'): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Required(CONF_ATTRIBUTE): cv.string,
+    vol.Optional(CONF_VALUE): vol.Any(bool, int, cv.string),
+    vol.Optional(ATTR_OUTPUTS, default=[]):
+        vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Optional(ATTR_LIGHTS, default=[]):
+        vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Optional(ATTR_TASKS, default=[]):
+        vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Optional(ATTR_STATE, default=True): vol.Any('toggle', cv.boolean),
+    vol.Optional(ATTR_DURATION, default=0): vol.All(
+        cv.time_period, lambda value: int(value.total_seconds()),
+        vol.Range(min=0, max=MAX_OUTPUT_DURATION)),
+    }), cv.has_at_least_one_key(CONF_ZONE, CONF_AREA, CONF_OUTPUT))
+
+SERVICE_SCHEMA_REPLAY = vol.Schema({
+    vol.Required(CONF_FILE): cv.string,
+    vol.Optional(CONF_SPEED, default=1):
+        vol.Any(SPEED_MAX, vol.All(vol.Coerce(float), vol.Range(min=0.01))),
+    })
+
+SERVICE_SCHEMA_LIGHTS_BULK = vol.All(vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_LIGHTS): vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Required(ATTR_STATE): vol.In([STATE_ON, STATE_OFF]),
+    vol.Optional(ATTR_BRIGHTNESS): vol.All(vol.Coerce(int), vol.Range(min=0, max=255)),
+    }), cv.has_at_least_one_key(ATTR_ENTITY_ID, ATTR_LIGHTS))
+
+SERVICE_SCHEMA_OUTPUTS_ON = vol.All(vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_OUTPUTS): vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Required(ATTR_DURATION): vol.All(
+        cv.time_period, cv.positive_timedelta,
+        lambda value: int(value.total_seconds()),
+        vol.Range(min=1, max=MAX_OUTPUT_DURATION)),
+    }), cv.has_at_least_one_key(ATTR_ENTITY_ID, ATTR_OUTPUTS))
+
+SERVICE_SCHEMA_ON_TIME = vol.Schema({
+    vol.Optional(ATTR_OUTPUTS): vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Optional(ATTR_ZONES): vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    })
+
+SERVICE_SCHEMA_SET_VALUES = vol.Schema({
+    vol.Required(ATTR_VALUES): vol.All(cv.ensure_list, [vol.Schema({
+        vol.Required(ATTR_KIND): vol.In([KIND_COUNTER, KIND_SETTING]),
+        vol.Required(ATTR_INDEX): vol.All(vol.Coerce(int), vol.Range(min=1)),
+        vol.Required(ATTR_VALUE): vol.All(vol.Coerce(int), vol.Range(min=0, max=65535)),
+        })], _unique_values),
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_ACK_TIMEOUT):
+        vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+    })
+
+SERVICE_SCHEMA_ARM = vol.All(vol.Schema({
+    vol.Optional(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_AREAS): vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Required(ATTR_LEVEL): vol.In(ARM_LEVELS),
+    vol.Required(ATTR_CODE): vol.All(vol.Coerce(int), vol.Range(min=0, max=999999)),
+    vol.Optional(ATTR_BYPASS, default=[]):
+        vol.All(cv.ensure_list, [vol.Any(int, cv.string)]),
+    vol.Optional(ATTR_TIMEOUT, default=DEFAULT_ACK_TIMEOUT):
+        vol.All(vol.Coerce(float), vol.Range(min=0.1)),
+    }), cv.has_at_least_one_key(ATTR_ENTITY_ID, ATTR_AREAS))
+
+SERVICE_SCHEMA_HISTORY = vol.Schema({
+    vol.Required(ATTR_ENTITY_ID): cv.entity_ids,
+    vol.Optional(ATTR_COUNT, default=10): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    })
+
+SERVICE_SCHEMA_AUDIT = vol.Schema({
+    vol.Optional(ATTR_START): cv.datetime,
+    vol.Optional(ATTR_END): cv.datetime,
+    vol.Optional(ATTR_USER): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(ATTR_LIMIT, default=100): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    })
+
+SERVICE_SCHEMA_SNAPSHOT = vol.Schema({
+    vol.Optional(CONF_FILE, default='elkm1_snapshot.json'): cv.string,
+    vol.Optional(CONF_FORMAT, default='json'): vol.In(['json', 'jsonl']),
+    })
+
+SERVICE_SCHEMA_PROFILE = vol.Schema({
+    vol.Optional(ATTR_DURATION, default=30): vol.All(
+        cv.time_period, lambda value: value.total_seconds(),
+        vol.Range(min=1, max=3600)),
+    vol.Optional(CONF_FILE, default='elkm1_profile'): cv.string,
+    })
+
+CONFIG_SCHEMA_PROXY = vol.Schema({
+    vol.Optional(CONF_BIND, default=DEFAULT_PROXY_BIND): cv.string,
+    vol.Optional(CONF_PORT, default=DEFAULT_PROXY_PORT): cv.port,
+    })
+
 #CONFIG_SCHEMA_SUBDOMAIN = vol.Schema({
 #    vol.Optional(CONF_ENABLED, default=DEFAULT_ENABLED): cv.boolean,
 #    vol.Optional(CONF_AUTOHIDE, default=DEFAULT_ENABLED): cv.boolean,
@@ -141,6 +467,16 @@ CONFIG_SCHEMA = vol.Schema({
         vol.Required(CONF_HOST): cv.string,
         vol.Optional(CONF_USERNAME): cv.string,
         vol.Optional(CONF_PASSWORD): cv.string,
+        vol.Optional(CONF_IO_THREAD, default=DEFAULT_IO_THREAD): cv.boolean,
+        vol.Optional(CONF_QUEUE_SIZE, default=DEFAULT_QUEUE_SIZE):
+            cv.positive_int,
+        vol.Optional(CONF_LIGHT_DEBOUNCE, default=DEFAULT_LIGHT_DEBOUNCE):
+            vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_THERMOSTAT_DEBOUNCE,
+                     default=DEFAULT_THERMOSTAT_DEBOUNCE):
+            vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_POLL_BUDGET, default=DEFAULT_POLL_BUDGET):
+            cv.positive_int,
         #vol.Optional(CONF_FASTLOAD, default=DEFAULT_FASTLOAD): cv.boolean,
         #vol.Optional(CONF_FASTLOAD_FILE, default=DEFAULT_FASTLOAD_FILE): cv.string,
         vol.Optional(CONF_AREA): CONFIG_SCHEMA_SUBDOMAIN,
@@ -153,6 +489,10 @@ CONFIG_SCHEMA = vol.Schema({
         vol.Optional(CONF_THERMOSTAT): CONFIG_SCHEMA_SUBDOMAIN,
         vol.Optional(CONF_USER): CONFIG_SCHEMA_SUBDOMAIN,
         vol.Optional(CONF_ZONE): CONFIG_SCHEMA_SUBDOMAIN,
+        vol.Optional(CONF_PROXY): CONFIG_SCHEMA_PROXY,
+        vol.Optional(CONF_CAPTURE): CONFIG_SCHEMA_CAPTURE,
+        vol.Optional(CONF_AUDIT): CONFIG_SCHEMA_AUDIT,
+        vol.Optional(CONF_RULES, default=[]): [CONFIG_SCHEMA_RULE],
     })
 }, extra=vol.ALLOW_EXTRA)
 
@@ -185,15 +525,20 @@ def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
             _LOGGER.error('Must specify username and password for secure connection')
             return False
     elk_config[CONF_HOST] = elk_config_raw[CONF_HOST]
-
-    def housecode_to_int(hc):
-        """Convert house / device code to integer device number."""
-        hc_split = re.split(r'(\d+)', hc.upper())
-        house = ord(hc_split[0]) - ord('A') + 1
-        code = int(hc_split[1])
-        if (house >= 1) and (house <= 16) and (code > 0) and (code <= 16):
-            return ((house - 1) * 16) + code
-        return None
+    elk_config[CONF_PROXY] = elk_config_raw.get(CONF_PROXY)
+    elk_config[CONF_IO_THREAD] = elk_config_raw.get(CONF_IO_THREAD,
+                                                    DEFAULT_IO_THREAD)
+    elk_config[CONF_QUEUE_SIZE] = elk_config_raw.get(CONF_QUEUE_SIZE,
+                                                     DEFAULT_QUEUE_SIZE)
+    elk_config[CONF_CAPTURE] = elk_config_raw.get(CONF_CAPTURE)
+    elk_config[CONF_AUDIT] = elk_config_raw.get(CONF_AUDIT)
+    elk_config[CONF_RULES] = elk_config_raw.get(CONF_RULES, [])
+    elk_config[CONF_LIGHT_DEBOUNCE] = elk_config_raw.get(
+        CONF_LIGHT_DEBOUNCE, DEFAULT_LIGHT_DEBOUNCE)
+    elk_config[CONF_THERMOSTAT_DEBOUNCE] = elk_config_raw.get(
+        CONF_THERMOSTAT_DEBOUNCE, DEFAULT_THERMOSTAT_DEBOUNCE)
+    elk_config[CONF_POLL_BUDGET] = elk_config_raw.get(CONF_POLL_BUDGET,
+                                                      DEFAULT_POLL_BUDGET)
 
     for subconfig in [CONF_AREA, CONF_COUNTER, CONF_KEYPAD, CONF_OUTPUT, CONF_PANEL, CONF_PLC, CONF_SETTING, CONF_TASK, CONF_THERMOSTAT, CONF_USER, CONF_ZONE]:
         max = 0
@@ -234,36 +579,7 @@ def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
                     if listset == CONF_INCLUDE:
                         # If overriding default include list, set to False first
                         elk_config[subconfig][listset] = [False] * max
-                    data = elk_config_raw[subconfig][listset]
-                    if not isinstance(data, list):
-                        data = [data]
-                    result = []
-                    for ranges in data:
-                        if (isinstance(ranges, int)):
-                            ranges = str(ranges)
-                        num_start = 0
-                        num_end = 0
-                        if '-' in ranges:
-                            split_start, split_end = ranges.split('-')
-                            if (split_start.isdigit()) and (split_end.isdigit()):
-                                # Numeric ranges
-                                num_start, num_end = int(split_start), int(split_end)
-                            else:
-                                # X10 house/device code ranges
-                                num_start = housecode_to_int(split_start)
-                                num_end = housecode_to_int(split_end)
-                            if num_start is not None and num_end is not None:
-                                range_start = num_start - 1
-                                range_end = num_end - 1
-                                result.extend(list(range(range_start, range_end + 1)))
-                        else:
-                            num_start = None
-                            if ranges.isdigit():
-                                num_start = int(ranges)
-                            else:
-                                num_start = housecode_to_int(ranges)
-                            if num_start is not None:
-                                result.append(num_start - 1)
+                    result = parse_ranges(elk_config_raw[subconfig][listset])
                     for element in result:
                         if element < max and element >= 0:
                             elk_config[subconfig][listset][element] = True
@@ -303,13 +619,87 @@ def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
         elk_obj_config['userid'] = elk_config[CONF_USERNAME]
         elk_obj_config['password'] = elk_config[CONF_PASSWORD]
 
-    elk = elkm1.Elk(elk_obj_config, loop=hass.loop)
+    io_worker = None
+    if elk_config[CONF_IO_THREAD]:
+        io_worker = ElkIOWorker(hass)
+        io_worker.start()
+        elk = elkm1.Elk(elk_obj_config, loop=io_worker.loop)
+        io_worker.attach(elk)
+    else:
+        elk = elkm1.Elk(elk_obj_config, loop=hass.loop)
+    inbound_queue = ElkInboundQueue(hass, elk, elk_config[CONF_QUEUE_SIZE])
+    inbound_queue.attach()
+    rules = None
+    if elk_config[CONF_RULES]:
+        rules = ElkRuleEngine(elk, elk_config[CONF_RULES])
+        inbound_queue.rules = rules
+    profiler = ElkProfiler(elk, inbound_queue)
 
     hass.data['elkm1'] = {
         'connection' : elk,
         'discovered_devices' : {},
+        'entities' : {},
         'config' : elk_config,
+        'proxy' : None,
+        'io_worker' : io_worker,
+        'inbound_queue' : inbound_queue,
+        'capture' : None,
+        'audit' : None,
+        'rules' : rules,
+        'profiler' : profiler,
+        'synced' : set(),
+        'acks' : ElkAckWaiter(hass),
+        'arm_latency' : ElkLatencyStats(),
+        'zone_aggregates' : ElkZoneAggregates(),
         }
+    _track_sync(hass)
+
+    hvac_runtime = ElkAccumulator(hass, 'hvac_runtime')
+    yield from hvac_runtime.async_load()
+    hass.data['elkm1']['hvac_runtime'] = hvac_runtime
+    on_time = ElkAccumulator(hass, 'on_time')
+    yield from on_time.async_load()
+    hass.data['elkm1']['on_time'] = on_time
+
+    poller = ElkPollScheduler(elk, elk_config[CONF_POLL_BUDGET])
+    hass.data['elkm1']['poller'] = poller
+    if elk_config[CONF_POLL_BUDGET] > 0:
+        async_track_time_interval(hass, poller.async_tick, POLL_TICK)
+
+    if elk_config[CONF_CAPTURE] is not None:
+        capture = ElkTrafficRecorder(
+            hass, elk, hass.config.path(elk_config[CONF_CAPTURE][CONF_FILE]),
+            elk_config[CONF_CAPTURE][CONF_MAX_SIZE],
+            elk_config[CONF_CAPTURE][CONF_BACKUPS])
+        hass.data['elkm1']['capture'] = capture
+        async_track_time_interval(hass, capture.async_flush,
+                                  CAPTURE_FLUSH_INTERVAL)
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP,
+                                   capture.async_flush)
+
+    if elk_config[CONF_AUDIT] is not None:
+        audit = ElkAuditLog(
+            hass, elk, hass.config.path(elk_config[CONF_AUDIT][CONF_FILE]),
+            elk_config[CONF_AUDIT][CONF_MAX_SIZE],
+            elk_config[CONF_AUDIT][CONF_BACKUPS])
+        hass.data['elkm1']['audit'] = audit
+        yield from hass.async_add_job(audit.load_index)
+        async_track_time_interval(hass, audit.async_flush,
+                                  CAPTURE_FLUSH_INTERVAL)
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP,
+                                   audit.async_flush)
+
+    if elk_config[CONF_PROXY] is not None:
+        proxy = ElkProxy(elk, elk_config[CONF_PROXY][CONF_BIND],
+                         elk_config[CONF_PROXY][CONF_PORT])
+        hass.data['elkm1']['proxy'] = proxy
+        _run_on_elk_loop(hass, elk, proxy.async_start)
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP,
+            lambda event: _run_on_elk_loop(hass, elk, proxy.stop))
+    if io_worker is not None:
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP,
+                                   lambda event: io_worker.stop())
     ## Listen for HA stop to disconnect.
     #hass.bus.listen_once(EVENT_HOMEASSISTANT_STOP,
     #                     hass.data['PyElk']['connection'].stop())
@@ -319,7 +709,9 @@ def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
         _LOGGER.debug("Elk connect")
         yield from elk._connect()
 
-    hass.async_add_job(connect)
+    _run_on_elk_loop(hass, elk, connect)
+
+    _async_register_services(hass, elk)
 
     # Load platforms for the devices in the Elk panel that we support.
     for component in SUPPORTED_DOMAINS:
@@ -329,6 +721,2106 @@ def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     return True
 
 
+def housecode_to_int(hc):
+    """Convert house / device code to integer device number."""
+    hc_split = re.split(r'(\d+)', hc.upper())
+    house = ord(hc_split[0]) - ord('A') + 1
+    code = int(hc_split[1])
+    if (house >= 1) and (house <= 16) and (code > 0) and (code <= 16):
+        return ((house - 1) * 16) + code
+    return None
+
+
+def parse_ranges(data):
+    """Convert numbers, house codes and ranges of either to 0-based indexes.
+
+    Accepts a single value or a list, e.g. [1, '3-5', 'a1-a16', 'c3'].
+    """
+    if not isinstance(data, list):
+        data = [data]
+    result = []
+    for ranges in data:
+        if (isinstance(ranges, int)):
+            ranges = str(ranges)
+        num_start = 0
+        num_end = 0
+        if '-' in ranges:
+            split_start, split_end = ranges.split('-')
+            if (split_start.isdigit()) and (split_end.isdigit()):
+                # Numeric ranges
+                num_start, num_end = int(split_start), int(split_end)
+            else:
+                # X10 house/device code ranges
+                num_start = housecode_to_int(split_start)
+                num_end = housecode_to_int(split_end)
+            if num_start is not None and num_end is not None:
+                range_start = num_start - 1
+                range_end = num_end - 1
+                result.extend(list(range(range_start, range_end + 1)))
+        else:
+            num_start = None
+            if ranges.isdigit():
+                num_start = int(ranges)
+            else:
+                num_start = housecode_to_int(ranges)
+            if num_start is not None:
+                result.append(num_start - 1)
+    return result
+
+
+def _async_register_services(hass, elk):
+    """Register the elkm1 services."""
+
+    @asyncio.coroutine
+    def async_replay_service(call):
+        """Feed a traffic capture back through the Elk."""
+        if elk._conn is not None:
+            _LOGGER.error('Elk replay refused while connected to the panel')
+            return
+        path = hass.config.path(call.data[CONF_FILE])
+        speed = call.data[CONF_SPEED]
+        records = yield from hass.async_add_job(_read_capture, path)
+        if records is None:
+            _LOGGER.error('Unable to read Elk capture %s', path)
+            return
+        _LOGGER.info('Replaying %d Elk messages from %s at %s speed',
+                     len(records), path, speed)
+        _run_on_elk_loop(hass, elk, _async_replay, hass, elk, records,
+                         None if speed == SPEED_MAX else speed)
+
+    hass.services.async_register(DOMAIN, SERVICE_REPLAY,
+                                 async_replay_service,
+                                 schema=SERVICE_SCHEMA_REPLAY)
+
+    @callback
+    def async_lights_bulk_service(call):
+        """Switch a set of lights with as few PLC messages as possible."""
+        indexes = _service_indexes(hass, call, ATTR_LIGHTS, 'Light')
+        level = None
+        if call.data[ATTR_STATE] == STATE_ON:
+            level = 100
+            if ATTR_BRIGHTNESS in call.data:
+                level = min(max(math.ceil(call.data[ATTR_BRIGHTNESS] / 2.55), 2), 99)
+        result = _lights_bulk(elk, indexes, level)
+        _LOGGER.debug('Elk bulk lights: %s', result)
+        hass.bus.async_fire(EVENT_LIGHTS_BULK_DONE, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_LIGHTS_BULK,
+                                 async_lights_bulk_service,
+                                 schema=SERVICE_SCHEMA_LIGHTS_BULK)
+
+    @callback
+    def async_outputs_on_service(call):
+        """Turn outputs on, leaving the panel to turn them off again."""
+        for index in _service_indexes(hass, call, ATTR_OUTPUTS, 'Output'):
+            if 0 <= index < len(elk.outputs.elements):
+                elk.outputs[index].turn_on(call.data[ATTR_DURATION])
+
+    hass.services.async_register(DOMAIN, SERVICE_OUTPUTS_ON,
+                                 async_outputs_on_service,
+                                 schema=SERVICE_SCHEMA_OUTPUTS_ON)
+
+    @callback
+    def async_on_time_service(call):
+        """Report output on time and zone violated time."""
+        on_time = hass.data['elkm1']['on_time']
+        result = {}
+        for kind, ranges_key, state in (('output', ATTR_OUTPUTS, 'ON'),
+                                        ('zone', ATTR_ZONES, 'VIOLATED')):
+            if ranges_key in call.data:
+                numbers = [index + 1 for index in parse_ranges(call.data[ranges_key])]
+            elif ATTR_OUTPUTS in call.data or ATTR_ZONES in call.data:
+                numbers = []
+            else:
+                prefix = kind + '_'
+                numbers = sorted(int(key[len(prefix):]) for key in on_time.keys()
+                                 if key.startswith(prefix))
+            result[kind + 's'] = {
+                number: _on_time_report(on_time, '{}_{}'.format(kind, number), state)
+                for number in numbers}
+        hass.bus.async_fire(EVENT_ON_TIME, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_ON_TIME,
+                                 async_on_time_service,
+                                 schema=SERVICE_SCHEMA_ON_TIME)
+
+
+    @asyncio.coroutine
+    def async_set_values_service(call):
+        """Write counters and settings, and check what the panel kept."""
+        result = yield from _async_set_values(
+            hass, elk, call.data[ATTR_VALUES], call.data[ATTR_TIMEOUT])
+        hass.bus.async_fire(EVENT_SET_VALUES_DONE, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_SET_VALUES,
+                                 async_set_values_service,
+                                 schema=SERVICE_SCHEMA_SET_VALUES)
+
+    @asyncio.coroutine
+    def async_arm_service(call):
+        """Bypass zones then arm or disarm areas, and wait for the panel."""
+        areas = _service_indexes(hass, call, ATTR_AREAS, 'Area')
+        result = yield from _async_arm(
+            hass, elk, areas, call.data[ATTR_LEVEL], call.data[ATTR_CODE],
+            parse_ranges(call.data[ATTR_BYPASS]), call.data[ATTR_TIMEOUT])
+        _LOGGER.debug('Elk arm: %s', result)
+        hass.bus.async_fire(EVENT_ARM_DONE, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_ARM, async_arm_service,
+                                 schema=SERVICE_SCHEMA_ARM)
+
+    @callback
+    def async_history_service(call):
+        """Report the latest transitions of zones and areas."""
+        entities = hass.data['elkm1']['entities']
+        result = {}
+        for entity_id in call.data[ATTR_ENTITY_ID]:
+            device = entities.get(entity_id)
+            if device is None or not hasattr(device, 'history'):
+                _LOGGER.warning('%s is not an Elk zone or area', entity_id)
+                continue
+            result[entity_id] = device.history(call.data[ATTR_COUNT])
+        hass.bus.async_fire(EVENT_HISTORY, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_HISTORY,
+                                 async_history_service,
+                                 schema=SERVICE_SCHEMA_HISTORY)
+
+    @asyncio.coroutine
+    def async_audit_service(call):
+        """Report keypad access between two times."""
+        audit = hass.data['elkm1']['audit']
+        if audit is None:
+            _LOGGER.error('Elk audit log is not configured')
+            return
+        start = call.data.get(ATTR_START)
+        end = call.data.get(ATTR_END)
+        started = time.time()
+        # Records still buffered belong in the answer
+        yield from audit.async_flush()
+        records = yield from hass.async_add_job(
+            audit.query,
+            0 if start is None else dt_util.as_timestamp(start),
+            started if end is None else dt_util.as_timestamp(end),
+            call.data.get(ATTR_USER), call.data[ATTR_LIMIT])
+        hass.bus.async_fire(EVENT_AUDIT, {
+            'records': records,
+            'duration_ms': round((time.time() - started) * 1000, 1),
+            })
+
+    hass.services.async_register(DOMAIN, SERVICE_AUDIT, async_audit_service,
+                                 schema=SERVICE_SCHEMA_AUDIT)
+
+    @asyncio.coroutine
+    def async_snapshot_service(call):
+        """Write the state of every panel element to a file."""
+        path = hass.config.path(call.data[CONF_FILE])
+        started = time.time()
+        # Hold off decoding panel messages so the walk sees one moment
+        paused = yield from _async_on_elk_loop(hass, elk, _pause_panel_reading, elk)
+        try:
+            result = yield from hass.async_add_job(
+                _write_snapshot, elk, path, call.data[CONF_FORMAT])
+        finally:
+            if paused:
+                yield from _async_on_elk_loop(
+                    hass, elk, _resume_panel_reading, hass, elk)
+        if result is None:
+            return
+        result['paused_ms'] = round((time.time() - started) * 1000, 1)
+        _LOGGER.info('Elk snapshot of %d elements written to %s in %sms',
+                     result['elements'], path, result['walk_ms'])
+        hass.bus.async_fire(EVENT_SNAPSHOT_DONE, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_SNAPSHOT,
+                                 async_snapshot_service,
+                                 schema=SERVICE_SCHEMA_SNAPSHOT)
+
+    @asyncio.coroutine
+    def async_profile_service(call):
+        """Profile the integration's own code paths for a while."""
+        profiler = hass.data['elkm1']['profiler']
+        if profiler.active:
+            _LOGGER.warning('Elk profiling is already running')
+            return
+        path = hass.config.path(call.data[CONF_FILE])
+        _LOGGER.info('Profiling Elk for %s seconds', call.data[ATTR_DURATION])
+        profiler.start()
+        yield from asyncio.sleep(call.data[ATTR_DURATION])
+        profiler.stop()
+        result = yield from hass.async_add_job(profiler.write, path)
+        if result is not None:
+            hass.bus.async_fire(EVENT_PROFILE_DONE, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_PROFILE,
+                                 async_profile_service,
+                                 schema=SERVICE_SCHEMA_PROFILE)
+
+    @asyncio.coroutine
+    def async_memory_report_service(call):
+        """Report memory used per entity, for every element of the panel."""
+        entity_classes = []
+        for domain, class_name, element_lists in MEMORY_ENTITIES:
+            platform = get_platform(hass, domain, DOMAIN)
+            if platform is None:
+                _LOGGER.error('Unable to load Elk %s platform', domain)
+                continue
+            entity_classes.append((getattr(platform, class_name), element_lists))
+        result = yield from hass.async_add_job(
+            _memory_report, entity_classes, elk, hass.data['elkm1']['config'])
+        _LOGGER.info('Elk memory report: %s', result)
+        hass.bus.async_fire(EVENT_MEMORY_REPORT, result)
+
+    hass.services.async_register(DOMAIN, SERVICE_MEMORY_REPORT,
+                                 async_memory_report_service)
+
+
+def _on_time_report(on_time, key, state):
+    """Return seconds in, and entries into, state for each window."""
+    report = {'seconds': {}, 'count': {}}
+    for window, hours in ON_TIME_WINDOWS:
+        report['seconds'][window] = round(on_time.totals(key, hours).get(state, 0))
+        report['count'][window] = on_time.counts(key, hours).get(state, 0)
+    return report
+
+
+@asyncio.coroutine
+def _async_set_values(hass, elk, items, timeout):
+    """Write a batch of counters and settings, and report each outcome.
+
+    Every write is sent before waiting on any of them. Counter writes are
+    acknowledged with the counter's new value; settings writes are not
+    acknowledged, so each is followed by a read-back of the setting.
+    """
+    from elkm1.message import cr_encode, cw_encode, cx_encode
+    acks = hass.data['elkm1']['acks']
+    pending = []
+    results = []
+    for item in items:
+        kind, index, value = item[ATTR_KIND], item[ATTR_INDEX] - 1, item[ATTR_VALUE]
+        elements = elk.counters if kind == KIND_COUNTER else elk.settings
+        if index >= len(elements.elements):
+            results.append(dict(item, success=False, error='unknown'))
+            continue
+        if kind == KIND_COUNTER:
+            future = acks.expect('CV', partial(_ack_match, 'counter', index))
+            messages = [cx_encode(index, value)]
+        else:
+            # Write the raw value; the library's time format packing is
+            # not needed for an integer
+            future = acks.expect('CR', partial(_ack_match, 'index', index))
+            messages = [cw_encode(index, value, 0), cr_encode(index)]
+        pending.append((item, elements[index], future, messages))
+
+    started = time.time()
+    for _, _, _, messages in pending:
+        for message in messages:
+            elk.send(message)
+    for item, element, future, _ in pending:
+        try:
+            acked_at, decoded = yield from asyncio.wait_for(
+                future, max(started + timeout - time.time(), 0.01))
+        except asyncio.TimeoutError:
+            results.append(dict(item, success=False, error='timeout'))
+            continue
+        actual = decoded['value']
+        if isinstance(actual, tuple):
+            actual = (actual[0] << 8) | actual[1]
+        # The library stores the value without telling entities
+        element._call_callbacks('value', decoded['value'])
+        results.append(dict(item, success=actual == item[ATTR_VALUE],
+                            actual=actual,
+                            latency_ms=round((acked_at - started) * 1000, 1)))
+    return {'results': results,
+            'duration_ms': round((time.time() - started) * 1000, 1)}
+
+
+@asyncio.coroutine
+def _async_arm(hass, elk, areas, level, code, bypass, timeout):
+    """Bypass zones and arm areas as one batch, and report each outcome.
+
+    Bypass requests go first so the areas arm with the zones bypassed.
+    Zones already bypassed are skipped, as a bypass request toggles. An
+    area succeeds once the panel reports it in the armed status for
+    level, and fails if reported not ready to arm; a code rejected at a
+    keypad in one of the areas fails all areas not yet armed.
+    """
+    from elkm1.message import al_encode, zb_encode
+    acks = hass.data['elkm1']['acks']
+    arm_latency = hass.data['elkm1']['arm_latency']
+    arm_level, armed_status = ARM_LEVELS[level]
+    areas = [area for area in areas if 0 <= area < len(elk.areas.elements)]
+    zones = [zone for zone in bypass if 0 <= zone < len(elk.zones.elements)
+             and elk.zones[zone].logical_status != ZONE_BYPASSED]
+    rejected = acks.expect('IC', partial(_ack_invalid_code, elk, areas))
+    bypassing = []
+    for zone in zones:
+        area = elk.zones[zone].area
+        if area is None:
+            area = areas[0] if areas else 0
+        bypassing.append((zone, acks.expect(
+            'ZB', partial(_ack_match, 'zone_number', zone)), area))
+    arming = []
+    for area in areas:
+        arming.append((area, acks.expect(
+            'AS', partial(_ack_arm_settled, area, armed_status))))
+
+    started = time.time()
+    for zone, _, area in bypassing:
+        elk.send(zb_encode(zone, area, code))
+    for area, _ in arming:
+        elk.send(al_encode(arm_level, area, code))
+
+    outstanding = set(future for _, future, _ in bypassing)
+    outstanding.update(future for _, future in arming)
+    while outstanding and not rejected.done():
+        remaining = started + timeout - time.time()
+        if remaining <= 0:
+            break
+        done, _ = yield from asyncio.wait(
+            outstanding | {rejected}, timeout=remaining,
+            return_when=asyncio.FIRST_COMPLETED)
+        outstanding -= done
+    outstanding = set(future for future in outstanding if not future.done())
+    error = 'invalid code' if rejected.done() else 'timeout'
+    rejected.cancel()
+    for future in outstanding:
+        future.cancel()
+
+    result = {'areas': [], 'bypassed': []}
+    for zone, future, _ in bypassing:
+        entry = {'zone': zone + 1}
+        if future in outstanding:
+            entry['success'] = False
+            entry['error'] = error
+        elif not future.result()[1]['zone_bypassed']:
+            entry['success'] = False
+            entry['error'] = 'not bypassed'
+        else:
+            entry['success'] = True
+        result['bypassed'].append(entry)
+    for area, future in arming:
+        entry = {'area': area + 1}
+        if future in outstanding:
+            entry['success'] = False
+            entry['error'] = error
+            arm_latency.record(level, None)
+        elif future.result()[1]['armed_statuses'][area] != armed_status:
+            entry['success'] = False
+            entry['error'] = 'not ready'
+            arm_latency.record(level, None)
+        else:
+            entry['success'] = True
+            entry['time_to_armed_ms'] = round(
+                (future.result()[0] - started) * 1000, 1)
+            arm_latency.record(level, entry['time_to_armed_ms'])
+        result['areas'].append(entry)
+    result['duration_ms'] = round((time.time() - started) * 1000, 1)
+    return result
+
+
+def _ack_arm_settled(area, armed_status, decoded):
+    """Return True if an AS report shows area armed or not ready to arm."""
+    from elkm1.const import ArmedStatus, ArmUpState
+    if decoded['armed_statuses'][area] == armed_status:
+        return True
+    return armed_status != ArmedStatus.DISARMED.value and \
+        decoded['arm_up_states'][area] == ArmUpState.NOT_READY_TO_ARM.value
+
+
+def _ack_invalid_code(elk, areas, decoded):
+    """Return True if an IC report is a code matching no user in areas.
+
+    Keypads whose area the panel has not reported count as in every area.
+    """
+    if decoded['user'] >= 0:
+        return False
+    keypad = decoded['keypad']
+    if not 0 <= keypad < len(elk.keypads.elements):
+        return True
+    area = elk.keypads[keypad].area
+    return area is None or area in areas
+
+
+def _ack_match(key, index, decoded):
+    """Return True if a decoded message is about element index."""
+    return decoded.get(key) == index
+
+
+def _service_indexes(hass, call, ranges_key, element_kind):
+    """Collect 0-based element indexes from a service call.
+
+    Elements can be given as ranges in the config syntax, as entity ids of
+    our entities for elements of class element_kind, or both.
+    """
+    indexes = set(parse_ranges(call.data.get(ranges_key, [])))
+    entities = hass.data['elkm1']['entities']
+    for entity_id in call.data.get(ATTR_ENTITY_ID, []):
+        device = entities.get(entity_id)
+        if device is None or \
+                device._element.__class__.__name__ != element_kind:
+            _LOGGER.warning('%s is not an Elk %s', entity_id, element_kind.lower())
+            continue
+        indexes.add(device._element.index)
+    return sorted(indexes)
+
+
+def _lights_bulk(elk, indexes, level):
+    """Send the PLC messages to set many lights, and report what was sent.
+
+    level is None for off, 100 for full on, otherwise a dim level. A house
+    code with all 16 units targeted gets one house-wide all units off or
+    all lights on command, other units get one message each, skipping
+    those already at the wanted level.
+    """
+    from elkm1.message import pc_encode, ps_encode
+    started = time.time()
+    indexes = [index for index in indexes if 0 <= index < len(elk.lights.elements)]
+    houses = {}
+    for index in indexes:
+        houses.setdefault(index // 16, []).append(index)
+    messages = 0
+    house_commands = 0
+    skipped = 0
+    banks = set()
+    for house, units in sorted(houses.items()):
+        if len(units) == 16 and level in (None, 100):
+            function = X10_ALL_UNITS_OFF if level is None else X10_ALL_LIGHTS_ON
+            elk.send(pc_encode(house * 16, function, 0, 0))
+            banks.add(house * 16 // PLC_BANK_SIZE)
+            messages += 1
+            house_commands += 1
+            continue
+        for index in units:
+            light = elk.lights[index]
+            wanted = 0 if level is None else (1 if level == 100 else level)
+            if light.status == wanted:
+                skipped += 1
+                continue
+            if level is None:
+                light.turn_off()
+            else:
+                light.turn_on(level, 0)
+            messages += 1
+    # House-wide commands are not reported per unit, so ask for status
+    for bank in sorted(banks):
+        elk.send(ps_encode(bank))
+        messages += 1
+    return {
+        'lights': len(indexes),
+        'messages': messages,
+        'house_commands': house_commands,
+        'skipped': skipped,
+        'milliseconds': round((time.time() - started) * 1000, 1),
+        }
+
+
+def _run_on_elk_loop(hass, elk, target, *args):
+    """Run a function or coroutine on whichever loop owns the panel I/O."""
+    if elk.loop is hass.loop:
+        hass.async_add_job(target, *args)
+    elif asyncio.iscoroutinefunction(target):
+        asyncio.run_coroutine_threadsafe(target(*args), elk.loop)
+    else:
+        elk.loop.call_soon_threadsafe(target, *args)
+
+
+@asyncio.coroutine
+def _async_on_elk_loop(hass, elk, target, *args):
+    """Run a function on the panel I/O loop and return its result."""
+    if elk.loop is hass.loop:
+        return target(*args)
+
+    @asyncio.coroutine
+    def _run():
+        return target(*args)
+    return (yield from asyncio.wrap_future(
+        asyncio.run_coroutine_threadsafe(_run(), elk.loop), loop=hass.loop))
+
+
+def _pause_panel_reading(elk):
+    """Stop decoding panel messages, returning True if paused (panel I/O loop)."""
+    transport = getattr(elk._conn, '_transport', None)
+    if transport is None:
+        return False
+    try:
+        transport.pause_reading()
+    except (AttributeError, NotImplementedError, RuntimeError):
+        return False
+    return True
+
+
+def _resume_panel_reading(hass, elk):
+    """Resume decoding panel messages (panel I/O loop)."""
+    if hass.data['elkm1']['inbound_queue']._paused is not None:
+        # The inbound queue resumes once it has drained
+        return
+    transport = getattr(elk._conn, '_transport', None)
+    try:
+        transport.resume_reading()
+    except (AttributeError, NotImplementedError, RuntimeError):
+        pass
+
+
+def _write_snapshot(elk, path, output_format):
+    """Stream every element's attributes to a file (executor).
+
+    Elements are written one at a time, as one JSON document grouped by
+    element type or as one JSON line per element.
+    """
+    started = time.time()
+    count = 0
+    try:
+        with open(path, 'w', encoding='utf-8') as snapshot_file:
+            if output_format == 'json':
+                snapshot_file.write('{{"taken_at": {:.3f}, "elements": {{'.format(started))
+            for number, element_type in enumerate(elk.element_list):
+                elements = getattr(elk, element_type)
+                if element_type == 'panel':
+                    elements = [elements]
+                if output_format == 'json':
+                    snapshot_file.write('{}{}: ['.format(
+                        ', ' if number else '', json.dumps(element_type)))
+                for position, element in enumerate(elements):
+                    record = {key: value for key, value in vars(element).items()
+                              if not key.startswith('_')}
+                    record['index'] = element.index
+                    if output_format == 'json':
+                        if position:
+                            snapshot_file.write(', ')
+                        snapshot_file.write(json.dumps(record, default=str))
+                    else:
+                        record['type'] = element_type
+                        record['taken_at'] = round(started, 3)
+                        snapshot_file.write(json.dumps(record, default=str) + '\n')
+                    count += 1
+                if output_format == 'json':
+                    snapshot_file.write(']')
+            if output_format == 'json':
+                snapshot_file.write('}}\n')
+    except OSError as err:
+        _LOGGER.error('Unable to write Elk snapshot %s: %s', path, err)
+        return None
+    return {'file': path, 'elements': count,
+            'walk_ms': round((time.time() - started) * 1000, 1)}
+
+
+def _memory_report(entity_classes, elk, config):
+    """Measure the memory an entity takes, per entity class and element type.
+
+    entity_classes are (class, element lists) pairs. For each, a throwaway
+    entity is built for every element in those lists, that is every one
+    the panel supports, not just those configured, under tracemalloc.
+    Entities are built on copies of the elements and a stand-in for hass,
+    so nothing live is touched and dropping them frees them. Runs in the
+    executor; allocations by other threads meanwhile are counted too.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    started = time.time()
+    result = {'types': {}}
+    total = 0
+    try:
+        for entity_class, element_lists in sorted(
+                entity_classes, key=lambda kind: kind[0].__name__):
+            for element_list in element_lists:
+                elements = getattr(elk, element_list)
+                if element_list == 'panel':
+                    elements = [elements]
+                targets = [copy.copy(element) for element in elements]
+                for element in targets:
+                    element._callbacks = []
+                stand_in = _MemoryReportHass(elk, config)
+                # Entities form reference cycles; free the last step's now
+                gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+                devices = [entity_class(element, elk, stand_in, None)
+                           for element in targets]
+                used = tracemalloc.get_traced_memory()[0] - before
+                del devices, stand_in
+                total += used
+                result['types']['{} {}'.format(
+                    entity_class.__name__, type(targets[0]).__name__)] = {
+                        'entities': len(targets),
+                        'bytes': used,
+                        'bytes_per_entity': used // len(targets),
+                        }
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    result['bytes'] = total
+    result['duration_ms'] = round((time.time() - started) * 1000, 1)
+    return result
+
+
+class _MemoryReportHass(object):
+    """Just enough of hass to build entities for the memory report.
+
+    Entities subscribe to a private inbound queue and listen on a bus that
+    keeps nothing.
+    """
+
+    class _Bus(object):
+        """Bus that never calls its listeners."""
+
+        @staticmethod
+        def async_listen(event_type, listener):
+            """Return a remover for a listener that was not kept."""
+            return lambda: None
+
+    def __init__(self, elk, config):
+        """Initialize the stand-in."""
+        self.loop = None
+        self.bus = self._Bus()
+        self.data = {'elkm1': {
+            'config': config,
+            'inbound_queue': ElkInboundQueue(self, elk, 0),
+            }}
+
+
+def _elk_elements(elk):
+    """Iterate over every element of every type tracked by the Elk."""
+    for element_type in elk.element_list:
+        elements = getattr(elk, element_type)
+        if element_type == 'panel':
+            yield elements
+        else:
+            for element in elements:
+                yield element
+
+
+def _track_sync(hass):
+    """Announce the first panel message confirming each element's state.
+
+    Entities restored from the last known state stay marked stale until
+    their message has been seen. Later copies of a message, from polls or
+    reconnects, are not announced again.
+    """
+    from elkm1.message import add_message_handler
+
+    synced = hass.data['elkm1']['synced']
+
+    def _synced(message, index_key, **kwargs):
+        index = kwargs[index_key] if index_key else None
+        if (message, index) in synced:
+            return
+        synced.add((message, index))
+        hass.bus.fire(EVENT_SYNCED, {'message': message, 'index': index})
+
+    for message, index_key in SYNC_MESSAGES.items():
+        add_message_handler(message, partial(_synced, message, index_key))
+
+
+def _tap_inbound(elk, tap):
+    """Call tap with every raw line received from the panel."""
+    got_data = elk._got_data
+
+    def _got_data(data):
+        tap(data)
+        got_data(data)
+    # Connection picks this up the next time it (re)connects
+    elk._got_data = _got_data
+
+
+def _elk_line_valid(line):
+    """Check the length and checksum of a raw Elk message line."""
+    try:
+        if int(line[:2], 16) != len(line) - 2:
+            return False
+        checksum = int(line[-2:], 16)
+    except ValueError:
+        return False
+    for char in line[:-2]:
+        checksum += ord(char)
+    return checksum % 256 == 0
+
+
+class ElkDeviceBase(object):
+    """Last known state for an Elk entity until the panel confirms it.
+
+    Mixed into the platforms' entity classes, ahead of the Home Assistant
+    base class. An entity added before its element's sync message (see
+    _track_sync) arrives shows the state restored from the recorder and
+    is stale until that message, or any update of the element, arrives.
+    Subclasses provide _sync_key and _update_state, and override _restore
+    to keep more than the state and attributes.
+    """
+
+    _stale = False
+    _confirmed = False
+    _remove_synced = None
+
+    def _sync_key(self):
+        """Return the (message, index) that confirms our element's state.
+
+        The message is None if no sync message covers the element.
+        """
+        raise NotImplementedError()
+
+    @asyncio.coroutine
+    def async_added_to_hass(self):
+        """Restore last known state until the panel confirms it."""
+        message, index = self._sync_key()
+        if self._confirmed or (message, index) in self.hass.data['elkm1']['synced']:
+            self._confirmed = True
+            return
+        if message is not None:
+            self._remove_synced = self.hass.bus.async_listen(
+                EVENT_SYNCED, self._synced)
+        state = yield from async_get_last_state(self.hass, self.entity_id)
+        if state is None or self._confirmed:
+            return
+        self._stale = True
+        self._restore(state)
+
+    def _restore(self, state):
+        """Take our state and attributes from the restored state."""
+        self._state = state.state
+        self._restored_attributes = dict(state.attributes)
+
+    @callback
+    def _synced(self, event):
+        """Stop reporting restored state once our sync message arrives."""
+        if (event.data['message'], event.data['index']) == self._sync_key():
+            self._confirm()
+
+    def _confirm(self):
+        """Mark state as confirmed by the panel, dropping restored state."""
+        self._confirmed = True
+        if self._remove_synced is not None:
+            self._remove_synced()
+            self._remove_synced = None
+        if self._stale:
+            self._stale = False
+            self._restored_attributes = {}
+            self._update_state()
+            self.async_schedule_update_ha_state()
+
+
+class ElkIOWorker(object):
+    """Run the panel transport and message decoding in their own thread.
+
+    The Elk object gets a private event loop, so reading, parsing and the
+    library's element updates never touch the HASS loop. Element callbacks
+    reach the HASS loop in batches through the ElkInboundQueue.
+    """
+
+    def __init__(self, hass):
+        """Initialize the worker, not yet running."""
+        self._hass = hass
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='ElkM1IO',
+                                        daemon=True)
+
+    def _run(self):
+        """Thread body, the library looks up this loop on reconnect."""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        """Start the worker thread."""
+        self._thread.start()
+
+    def stop(self):
+        """Stop the worker loop, which ends the thread."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def attach(self, elk):
+        """Route outbound messages onto the worker loop."""
+        send = elk.send
+
+        def _send(msg):
+            if threading.current_thread() is self._thread:
+                send(msg)
+            else:
+                self.loop.call_soon_threadsafe(send, msg)
+        elk.send = _send
+
+
+class ElkInboundQueue(object):
+    """Bounded queue of element updates between the panel and entities.
+
+    Element callbacks raised while decoding panel messages are queued and
+    run on the HASS loop in batches. Once the queue holds max_size updates,
+    updates of non-security kinds (temperatures, voltages, lights, ...)
+    only replace the value of an update already queued for the same
+    element attribute. Zone, area and alarm transitions are always queued,
+    and reading from the panel is paused until the queue drains.
+    """
+
+    def __init__(self, hass, elk, max_size):
+        """Initialize the queue."""
+        self._hass = hass
+        self._elk = elk
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._latest = {}
+        self._flush_scheduled = False
+        self._paused = None
+        self._pausing = False
+        self.rules = None
+        self._subscriptions = {}
+        self.processed = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.pauses = 0
+
+    def attach(self):
+        """Route callbacks of every element through the queue."""
+        for element in _elk_elements(self._elk):
+            element._call_callbacks = partial(self.put, element)
+
+    def subscribe(self, element, attributes, target):
+        """Call target for updates of the given attributes of element only.
+
+        Used instead of the element's add_callback by entities that render
+        a few of their element's attributes.
+        """
+        self._subscriptions.setdefault(element, []).append(
+            (frozenset(attributes), target))
+
+    @staticmethod
+    def _is_security(element, attribute):
+        """Return True if an update must never be coalesced."""
+        kind = element.__class__.__name__
+        if kind not in SECURITY_ATTRIBUTES:
+            return False
+        attributes = SECURITY_ATTRIBUTES[kind]
+        return attributes is None or attribute in attributes
+
+    def put(self, element, attribute, value):
+        """Queue an element update (panel I/O loop)."""
+        if self.rules is not None:
+            self.rules.fire(element, attribute, value)
+        security = self._is_security(element, attribute)
+        key = (element, attribute)
+        with self._lock:
+            depth = len(self._queue)
+            if depth >= self._max_size and not security:
+                entry = self._latest.get(key)
+                if entry is not None:
+                    entry[2] = value
+                    self.coalesced += 1
+                    return
+            entry = [element, attribute, value]
+            self._queue.append(entry)
+            if not security:
+                self._latest[key] = entry
+            depth += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+            pause = depth >= self._max_size and self._paused is None and \
+                not self._pausing
+            if pause:
+                self._pausing = True
+            flush = not self._flush_scheduled
+            self._flush_scheduled = True
+        if pause:
+            # Updates also come from the HASS loop, e.g. set_values
+            self._elk.loop.call_soon_threadsafe(self._pause_reading)
+        if flush:
+            self._hass.loop.call_soon_threadsafe(self._flush)
+
+    def _pause_reading(self):
+        """Stop reading from the panel until the queue drains (panel I/O loop)."""
+        transport = getattr(self._elk._conn, '_transport', None)
+        with self._lock:
+            self._pausing = False
+            if transport is None or \
+                    len(self._queue) <= self._max_size // 2:
+                # Not connected, or drained before we got here
+                return
+            try:
+                transport.pause_reading()
+            except (AttributeError, NotImplementedError, RuntimeError):
+                return
+            self._paused = transport
+            self.pauses += 1
+
+    def _resume_reading(self):
+        """Resume reading from the panel (panel I/O loop)."""
+        with self._lock:
+            transport, self._paused = self._paused, None
+        if transport is None:
+            return
+        try:
+            transport.resume_reading()
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+
+    def _flush(self):
+        """Run a batch of queued element callbacks (HASS loop)."""
+        batch = []
+        with self._lock:
+            while self._queue and len(batch) < QUEUE_FLUSH_BATCH:
+                entry = self._queue.popleft()
+                key = (entry[0], entry[1])
+                if self._latest.get(key) is entry:
+                    del self._latest[key]
+                batch.append(entry)
+            more = bool(self._queue)
+            if not more:
+                self._flush_scheduled = False
+            resume = self._paused is not None and \
+                len(self._queue) <= self._max_size // 2
+        for element, attribute, value in batch:
+            type(element)._call_callbacks(element, attribute, value)
+            for attributes, target in self._subscriptions.get(element, []):
+                if attribute in attributes:
+                    target(attribute, value)
+                else:
+                    self.skipped += 1
+        self.processed += len(batch)
+        if resume:
+            _run_on_elk_loop(self._hass, self._elk, self._resume_reading)
+        if more:
+            self._hass.loop.call_soon(self._flush)
+
+    def stats(self):
+        """Return queue depth and counters."""
+        return {
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'coalesced': self.coalesced,
+            'skipped': self.skipped,
+            'pauses': self.pauses,
+            }
+
+
+def _read_capture(path):
+    """Read the received lines and delays out of a capture file."""
+    records = []
+    try:
+        with open(path, encoding='ISO-8859-1') as capture_file:
+            for raw in capture_file:
+                if raw.startswith('#'):
+                    continue
+                fields = raw.rstrip('\r\n').split(' ', 2)
+                if len(fields) != 3:
+                    continue
+                delay, direction, line = fields
+                # Keep the timing of what we sent, without replaying it
+                records.append((int(delay) / 1000,
+                                line if direction == 'R' else None))
+    except (OSError, ValueError) as err:
+        _LOGGER.debug('Reading capture %s failed: %s', path, err)
+        return None
+    return records
+
+
+@asyncio.coroutine
+def _async_replay(hass, elk, records, speed):
+    """Decode captured panel lines, at speed times real time or flat out.
+
+    Runs on the panel I/O loop. Lines bypass the proxy and recorder taps.
+    Nothing is sent to the panel while replaying, should it connect in the
+    meantime: follow-up requests from the library's handlers are dropped,
+    and rules are paused. Replayed code entries, on-times and thermostat
+    runtimes are not recorded either.
+    """
+    if elk._conn is not None:
+        _LOGGER.error('Elk replay refused while connected to the panel')
+        return
+    loop = elk.loop
+    start = loop.time()
+    due = 0
+    replayed = 0
+    errors = 0
+    rules = hass.data['elkm1']['rules']
+    audit = hass.data['elkm1']['audit']
+    accumulators = (hass.data['elkm1']['on_time'],
+                    hass.data['elkm1']['hvac_runtime'])
+    send = elk.send
+    elk.send = lambda msg: None
+    for paused in (rules, audit) + accumulators:
+        if paused is not None:
+            paused.paused = True
+    try:
+        for delay, line in records:
+            if speed is not None:
+                due += delay / speed
+                wait = due - (loop.time() - start)
+                if wait > 0:
+                    yield from asyncio.sleep(wait)
+            elif replayed % 100 == 0:
+                yield from asyncio.sleep(0)
+            if line is None:
+                continue
+            try:
+                type(elk)._got_data(elk, line)
+            except (AttributeError, IndexError, KeyError, ValueError) as err:
+                _LOGGER.debug('Replay of %s failed: %s', line, err)
+                errors += 1
+            replayed += 1
+    finally:
+        elk.send = send
+        for paused in (rules, audit):
+            if paused is not None:
+                paused.paused = False
+        # Entities account time as they get the replayed updates
+        hass.loop.call_soon_threadsafe(
+            _resume_accounting, hass, accumulators)
+    elapsed = loop.time() - start
+    _LOGGER.info('Elk replay done: %d messages in %.2fs', replayed, elapsed)
+    hass.bus.fire(EVENT_REPLAY_DONE, {
+        'messages': replayed,
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(replayed / elapsed, 1) if elapsed else None,
+        })
+
+
+def _resume_accounting(hass, accumulators):
+    """Unpause accumulators once replayed updates are all handed out."""
+    if hass.data['elkm1']['inbound_queue'].stats()['depth']:
+        hass.loop.call_soon(_resume_accounting, hass, accumulators)
+        return
+    for accumulator in accumulators:
+        accumulator.paused = False
+
+
+class ElkRuleEngine(object):
+    """Reactions to element changes that never leave the panel I/O loop.
+
+    Rules from the config are compiled into an index keyed by (element
+    kind, index, attribute), with the messages they send already encoded.
+    Element updates are looked up as the inbound queue receives them, and
+    matching messages are handed straight to the connection. The time
+    from the triggering line arriving to the last write is measured.
+
+    Only changes the panel reports as they happen fire rules: the status
+    dumps and area status reply of each (re)connect's sync only bring the
+    elements up to date. Rules are paused while a capture is replayed.
+    """
+
+    def __init__(self, elk, rules):
+        """Compile the rules and tap the connection for arrival times."""
+        from elkm1.util import add_sync_handler
+        self._elk = elk
+        self._index = {}
+        self._received_at = None
+        self._quiet = False
+        self._area_sync = True
+        self.paused = False
+        self.fired = 0
+        self.last_ms = None
+        self.max_ms = 0
+        self._total_ms = 0
+        for rule in rules:
+            trigger = self._compile_trigger(rule)
+            messages = self._compile_messages(rule)
+            if trigger is not None and messages:
+                key, value = trigger
+                self._index.setdefault(key, []).append((value, messages))
+        _tap_inbound(elk, self._received)
+        add_sync_handler(self._syncing)
+
+    @staticmethod
+    def _compile_trigger(rule):
+        """Return the index key and wanted value of a rule."""
+        from elkm1.const import (
+            AlarmState, ArmedStatus, ArmUpState, ZoneLogicalStatus,
+            ZonePhysicalStatus)
+        enums = {
+            'alarm_state': AlarmState, 'armed_status': ArmedStatus,
+            'arm_up_state': ArmUpState, 'logical_status': ZoneLogicalStatus,
+            'physical_status': ZonePhysicalStatus,
+            }
+        for conf, kind in ((CONF_ZONE, 'Zone'), (CONF_AREA, 'Area'),
+                           (CONF_OUTPUT, 'Output')):
+            if conf in rule:
+                index = rule[conf] - 1
+                break
+        attribute = rule[CONF_ATTRIBUTE]
+        if attribute not in RULE_ATTRIBUTES[kind]:
+            _LOGGER.error('Elk rules cannot be triggered by %s %s', kind.lower(),
+                          attribute)
+            return None
+        value = rule.get(CONF_VALUE)
+        if value is None:
+            return (kind, index, attribute), None
+        # Coerced to the type the element holds, so they can be equal: ints
+        # or the strings '0'..'9' the panel sends, by name or value, and bools
+        if attribute in enums:
+            enum = enums[attribute]
+            member = None
+            if isinstance(value, str):
+                member = enum.__members__.get(value.upper())
+            if member is None and not isinstance(value, bool):
+                try:
+                    member = enum(type(next(iter(enum)).value)(value))
+                except ValueError:
+                    pass
+            if member is None:
+                _LOGGER.error('Unknown %s %s in Elk rule', attribute, value)
+                return None
+            value = member.value
+        else:
+            try:
+                value = cv.boolean(value)
+            except vol.Invalid:
+                _LOGGER.error('Elk rule %s %s is not on or off', attribute,
+                              value)
+                return None
+        return (kind, index, attribute), value
+
+    @staticmethod
+    def _compile_messages(rule):
+        """Return the encoded messages a rule sends."""
+        from elkm1.message import (
+            cf_encode, cn_encode, ct_encode, pf_encode, pn_encode, pt_encode,
+            tn_encode)
+        state = rule[ATTR_STATE]
+        messages = []
+        for index in parse_ranges(rule[ATTR_OUTPUTS]):
+            if state == 'toggle':
+                messages.append(ct_encode(index))
+            elif state:
+                messages.append(cn_encode(index, rule[ATTR_DURATION]))
+            else:
+                messages.append(cf_encode(index))
+        for index in parse_ranges(rule[ATTR_LIGHTS]):
+            if state == 'toggle':
+                messages.append(pt_encode(index))
+            elif state:
+                messages.append(pn_encode(index))
+            else:
+                messages.append(pf_encode(index))
+        # Tasks can only be activated
+        for index in parse_ranges(rule[ATTR_TASKS]):
+            messages.append(tn_encode(index))
+        return messages
+
+    def _syncing(self):
+        """Expect the panel's sync replies, the connection being (re)made."""
+        self._area_sync = True
+
+    def _received(self, line):
+        """Note when the line being decoded arrived, and if it is sync."""
+        self._received_at = time.perf_counter()
+        message = line[2:4]
+        self._quiet = message in RULE_QUIET_MESSAGES or \
+            (message == 'AS' and self._area_sync)
+        if message == 'AS':
+            self._area_sync = False
+
+    def fire(self, element, attribute, value):
+        """Run the rules for an element update (panel I/O loop)."""
+        if self._quiet or self.paused:
+            return
+        rules = self._index.get(
+            (element.__class__.__name__, element.index, attribute))
+        if rules is None:
+            return
+        sent = False
+        for wanted, messages in rules:
+            if wanted is not None and value != wanted:
+                continue
+            for message in messages:
+                self._elk.send(message)
+            sent = True
+        if not sent or self._received_at is None:
+            return
+        latency_ms = (time.perf_counter() - self._received_at) * 1000
+        self.fired += 1
+        self.last_ms = round(latency_ms, 3)
+        self.max_ms = max(self.max_ms, self.last_ms)
+        self._total_ms += latency_ms
+
+    def stats(self):
+        """Return how often rules fired and their trigger to write times."""
+        return {
+            'rules': sum(len(rules) for rules in self._index.values()),
+            'fired': self.fired,
+            'last_ms': self.last_ms,
+            'max_ms': self.max_ms,
+            'mean_ms': round(self._total_ms / self.fired, 3)
+                       if self.fired else None,
+            }
+
+
+class ElkProfiler(object):
+    """Deterministic profiling of the integration's code paths, on demand.
+
+    Decoding of panel lines, the inbound queue's entity callbacks and
+    elk.send are wrapped, and while profiling is on each of them runs
+    under a cProfile profile for its thread. Profiles of all threads are
+    merged into one report when profiling stops. When off, the wrappers
+    cost one attribute check per call.
+    """
+
+    def __init__(self, elk, inbound_queue):
+        """Wrap the entry points to profile."""
+        self.active = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = {}
+        self._calls = 0
+        got_data = elk._got_data
+        # Connection picks this up the next time it (re)connects
+        elk._got_data = partial(self._run, got_data)
+        elk.send = partial(self._run, elk.send)
+        inbound_queue._flush = partial(self._run, inbound_queue._flush)
+
+    def start(self):
+        """Start profiling with empty profiles."""
+        with self._lock:
+            self._profiles = {}
+            self._calls = 0
+        self.active = True
+
+    def stop(self):
+        """Stop profiling; calls in progress finish their profile."""
+        self.active = False
+
+    def _run(self, target, *args):
+        """Call target, under this thread's profile if profiling."""
+        if not self.active or getattr(self._local, 'profiling', False):
+            return target(*args)
+        ident = threading.get_ident()
+        with self._lock:
+            profile = self._profiles.get(ident)
+            if profile is None:
+                profile = self._profiles[ident] = cProfile.Profile()
+            self._calls += 1
+        self._local.profiling = True
+        profile.enable()
+        try:
+            return target(*args)
+        finally:
+            profile.disable()
+            self._local.profiling = False
+
+    def write(self, path):
+        """Write merged pstats and a text report, sorted by cumulative time (executor)."""
+        with self._lock:
+            profiles = list(self._profiles.values())
+            calls = self._calls
+        if not profiles:
+            _LOGGER.info('Elk profiling saw no calls')
+            return None
+        report = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=report)
+        stats.sort_stats('cumulative')
+        try:
+            stats.dump_stats(path + '.pstats')
+            stats.print_stats(50)
+            with open(path + '.txt', 'w', encoding='utf-8') as report_file:
+                report_file.write(report.getvalue())
+        except OSError as err:
+            _LOGGER.error('Unable to write Elk profile %s: %s', path, err)
+            return None
+        return {'pstats': path + '.pstats', 'report': path + '.txt',
+                'calls': calls, 'threads': len(profiles),
+                'seconds': round(stats.total_tt, 3)}
+
+
+class ElkAckWaiter(object):
+    """Futures resolved by the panel message acknowledging a command.
+
+    Message handlers run on the panel I/O loop, which may be the I/O
+    thread, so waiters are matched under a lock and their futures are
+    resolved on the HASS loop with the time the message arrived.
+    """
+
+    def __init__(self, hass):
+        """Initialize with no waiters."""
+        self._hass = hass
+        self._lock = threading.Lock()
+        self._waiters = {}
+
+    def expect(self, message, match):
+        """Return a future for the next message for which match(decoded) is true.
+
+        Call before sending the command, so a fast reply is not missed.
+        The future's result is (arrival time, decoded message).
+        """
+        from elkm1.message import add_message_handler
+        future = self._hass.loop.create_future()
+        with self._lock:
+            waiters = self._waiters.get(message)
+            if waiters is None:
+                waiters = self._waiters[message] = []
+                add_message_handler(message, partial(self._handler, message))
+            # Drop waiters given up on (timed out) since the last message
+            waiters[:] = [waiter for waiter in waiters if not waiter[1].done()]
+            waiters.append((match, future))
+        return future
+
+    def _handler(self, message, **kwargs):
+        """Resolve the waiters a message matches (panel I/O loop)."""
+        arrived = time.time()
+        with self._lock:
+            waiters = self._waiters[message]
+            matched = [waiter for waiter in waiters if waiter[0](kwargs)]
+            for waiter in matched:
+                waiters.remove(waiter)
+        for _, future in matched:
+            self._hass.loop.call_soon_threadsafe(
+                self._resolve, future, (arrived, kwargs))
+
+    @staticmethod
+    def _resolve(future, result):
+        """Set a future's result unless it was given up on (HASS loop)."""
+        if not future.done():
+            future.set_result(result)
+
+
+class ElkZoneAggregates(object):
+    """Zones violated, bypassed, troubled or open, per area and panel wide.
+
+    Kept up to date one zone change at a time, so what is open in an area
+    is known without looking at every zone. Area 0 is the whole panel.
+    """
+
+    def __init__(self):
+        """Initialize with every zone normal."""
+        self._zones = {}
+        self._members = {}
+        self._listeners = {}
+
+    def update(self, zone, area, logical_status, physical_status):
+        """Record a zone's current status (HASS loop)."""
+        categories = set()
+        if logical_status in ZONE_LOGICAL_AGGREGATES:
+            categories.add(ZONE_LOGICAL_AGGREGATES[logical_status])
+        if physical_status == ZONE_OPEN:
+            categories.add('open')
+        old_area, old_categories = self._zones.get(zone, (None, set()))
+        if old_area == area and old_categories == categories:
+            return
+        self._zones[zone] = (area, categories)
+        for category in old_categories:
+            self._members[(old_area, category)].discard(zone)
+            self._members[(0, category)].discard(zone)
+        for category in categories:
+            self._members.setdefault((area, category), set()).add(zone)
+            self._members.setdefault((0, category), set()).add(zone)
+        for scope in {old_area, area, 0}:
+            for listener in self._listeners.get(scope, []):
+                listener()
+
+    def members(self, area, category):
+        """Return the zone numbers of area in category."""
+        return sorted(self._members.get((area, category), []))
+
+    def async_add_listener(self, area, listener):
+        """Call listener when any aggregate of area changes."""
+        self._listeners.setdefault(area, []).append(listener)
+
+
+class ElkLatencyStats(object):
+    """Command to acknowledgement latency, per kind of command."""
+
+    def __init__(self):
+        """Initialize with no commands seen."""
+        self._stats = {}
+
+    def record(self, command, latency_ms):
+        """Record a command's latency, or None if it failed (HASS loop)."""
+        stats = self._stats.get(command)
+        if stats is None:
+            stats = self._stats[command] = {
+                'count': 0, 'failed': 0, 'last_ms': None, 'max_ms': 0,
+                'total_ms': 0}
+        stats['count'] += 1
+        if latency_ms is None:
+            stats['failed'] += 1
+            return
+        stats['last_ms'] = latency_ms
+        stats['max_ms'] = max(stats['max_ms'], latency_ms)
+        stats['total_ms'] += latency_ms
+
+    def stats(self):
+        """Return counts and latencies per command."""
+        result = {}
+        for command, stats in self._stats.items():
+            succeeded = stats['count'] - stats['failed']
+            result[command] = {
+                'count': stats['count'],
+                'failed': stats['failed'],
+                'last_ms': stats['last_ms'],
+                'max_ms': stats['max_ms'],
+                'mean_ms': round(stats['total_ms'] / succeeded, 1)
+                           if succeeded else None,
+                }
+        return result
+
+
+class ElkPollScheduler(object):
+    """Poll thermostat and temperature readings adaptively.
+
+    Every report of a reading, polled or not, pushes its next poll back.
+    Readings that turned out to have changed are polled more often,
+    stable ones less, and thermostats running a mode at least every
+    POLL_ACTIVE_MAX_INTERVAL. Polls are limited to budget messages per
+    minute overall, most overdue first. Keypad and zone temperatures all
+    come in one lw poll. Reports are handled on the panel's I/O thread and
+    ticks on the HASS loop, so the schedule is only touched under a lock.
+    """
+
+    def __init__(self, elk, budget):
+        """Initialize the scheduler and listen for temperature reports."""
+        from elkm1.message import add_message_handler
+        self._elk = elk
+        self._budget = budget
+        self._tokens = budget
+        self._last_tick = time.time()
+        self._targets = {}
+        self._reported = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        add_message_handler('LW', self._lw_handler)
+        add_message_handler('ST', self._st_handler)
+        add_message_handler('TR', self._tr_handler)
+
+    def _target(self, key):
+        """Return the poll schedule for a target, creating it if new."""
+        target = self._targets.get(key)
+        if target is None:
+            target = {'interval': POLL_MIN_INTERVAL, 'active': False,
+                      'due': time.time() + POLL_MIN_INTERVAL}
+            self._targets[key] = target
+        return target
+
+    def _reschedule(self, key, changed, active=None):
+        """Adapt a target's interval after a report."""
+        target = self._target(key)
+        if active is not None:
+            target['active'] = active
+        if changed:
+            target['interval'] = max(POLL_MIN_INTERVAL, target['interval'] // 2)
+        else:
+            target['interval'] = min(POLL_MAX_INTERVAL, target['interval'] * 2)
+        if target['active']:
+            target['interval'] = min(POLL_ACTIVE_MAX_INTERVAL, target['interval'])
+        target['due'] = time.time() + target['interval']
+
+    def _report(self, kind, index, value):
+        """Record a reading, returning True if it changed."""
+        key = (kind, index)
+        self._reported[key] = time.time()
+        changed = self._values.get(key, value) != value
+        self._values[key] = value
+        return changed
+
+    def _lw_handler(self, keypad_temps, zone_temps):
+        """Keypad and zone 1-16 temperatures reported."""
+        with self._lock:
+            changed = False
+            for index, temperature in enumerate(keypad_temps):
+                changed |= self._report('keypad', index, temperature)
+            for index, temperature in enumerate(zone_temps):
+                changed |= self._report('zone', index, temperature)
+            self._reschedule(('lw', None), changed)
+
+    def _st_handler(self, group, device, temperature):
+        """Single temperature reported."""
+        kind = {0: 'zone', 1: 'keypad', 2: 'thermostat'}.get(group)
+        if kind is None:
+            return
+        with self._lock:
+            changed = self._report(kind, device, temperature)
+            if kind == 'thermostat':
+                self._reschedule((kind, device), changed)
+            elif device < 16:
+                self._reschedule(('lw', None), changed)
+
+    def _tr_handler(self, thermostat_index, mode, hold, fan, current_temp,
+                    heat_setpoint, cool_setpoint, humidity):
+        """Thermostat data reported."""
+        from elkm1.const import ThermostatMode
+        with self._lock:
+            changed = self._report('thermostat', thermostat_index, current_temp)
+            self._reschedule(('thermostat', thermostat_index), changed,
+                             mode != ThermostatMode.OFF.value)
+
+    def last_reported(self, kind, index):
+        """Return when a reading was last reported, or None."""
+        return self._reported.get((kind, index))
+
+    def staleness(self, kind, index):
+        """Return seconds since a reading was last reported, or None."""
+        reported = self._reported.get((kind, index))
+        if reported is None:
+            return None
+        return int(time.time() - reported)
+
+    def _poll(self, key):
+        """Send the request for a target."""
+        from elkm1.message import lw_encode, tr_encode
+        kind, index = key
+        if kind == 'lw':
+            self._elk.send(lw_encode())
+        else:
+            self._elk.send(tr_encode(index))
+
+    @callback
+    def async_tick(self, now=None):
+        """Poll whatever is due, within the message budget."""
+        tick = time.time()
+        self._tokens = min(self._budget, self._tokens +
+                           self._budget * (tick - self._last_tick) / 60)
+        self._last_tick = tick
+        if self._elk._conn is None:
+            return
+        polls = []
+        with self._lock:
+            self._target(('lw', None))
+            for thermostat in self._elk.thermostats:
+                if not thermostat.is_default_name():
+                    self._target(('thermostat', thermostat.index))
+            due = sorted((target['due'], key) for key, target in self._targets.items()
+                         if target['due'] <= tick)
+            for _, key in due:
+                if self._tokens < 1:
+                    break
+                self._tokens -= 1
+                # Don't ask again before the interval, even without an answer
+                self._targets[key]['due'] = tick + self._targets[key]['interval']
+                polls.append(key)
+        for key in polls:
+            self._poll(key)
+
+
+class ElkAccumulator(object):
+    """Time spent in, and entries into, each state per key over rolling windows.
+
+    Time and entry counts are added to hourly buckets in fixed-size rings
+    per key and state, so memory does not grow with the number of
+    transitions and rolling totals of up to a week are a sum over a few
+    buckets. Totals are saved to storage at most every
+    ACCOUNTING_SAVE_DELAY seconds.
+    """
+
+    def __init__(self, hass, name):
+        """Initialize an empty accumulator."""
+        self._store = Store(hass, STORAGE_VERSION, 'elkm1.' + name)
+        self._hour = int(time.time() // 3600)
+        self._buckets = {}
+        self._counts = {}
+        self._current = {}
+        self.paused = False
+
+    @asyncio.coroutine
+    def async_load(self):
+        """Load saved totals. Time spent while we were down is unknown."""
+        data = yield from self._store.async_load()
+        if not data:
+            return
+        self._hour = data['hour']
+        for key, states in data['buckets'].items():
+            self._buckets[key] = {
+                state: array('d', buckets) for state, buckets in states.items()}
+        for key, states in data.get('counts', {}).items():
+            self._counts[key] = {
+                state: array('I', counts) for state, counts in states.items()}
+        self._advance(time.time())
+
+    def keys(self):
+        """Return the keys with any accounted time."""
+        return list(self._buckets)
+
+    def _data_to_save(self):
+        """Return totals for storage."""
+        return {
+            'hour': self._hour,
+            'buckets': {
+                key: {state: [round(value, 1) for value in buckets]
+                      for state, buckets in states.items()}
+                for key, states in self._buckets.items()},
+            'counts': {
+                key: {state: list(counts) for state, counts in states.items()}
+                for key, states in self._counts.items()},
+            }
+
+    def _advance(self, now):
+        """Clear buckets for hours that have started since we last looked."""
+        hour = int(now // 3600)
+        if hour <= self._hour:
+            return
+        for cleared in range(self._hour + 1,
+                             min(hour, self._hour + ACCOUNTING_HOURS) + 1):
+            for rings in (self._buckets, self._counts):
+                for states in rings.values():
+                    for buckets in states.values():
+                        buckets[cleared % ACCOUNTING_HOURS] = 0
+        self._hour = hour
+
+    def _add(self, key, state, start, end):
+        """Add the time from start to end to the state's hourly buckets."""
+        states = self._buckets.setdefault(key, {})
+        buckets = states.get(state)
+        if buckets is None:
+            buckets = states[state] = array('d', [0]) * ACCOUNTING_HOURS
+        start = max(start, (self._hour - ACCOUNTING_HOURS + 1) * 3600)
+        while start < end:
+            hour = int(start // 3600)
+            chunk_end = min(end, (hour + 1) * 3600)
+            buckets[hour % ACCOUNTING_HOURS] += chunk_end - start
+            start = chunk_end
+
+    def _settle(self, key, now):
+        """Account time spent in the current state up to now."""
+        current = self._current.get(key)
+        if current is not None:
+            self._add(key, current[0], current[1], now)
+            self._current[key] = (current[0], now)
+
+    def transition(self, key, state):
+        """Record that key is now in state.
+
+        Entering a state only counts as an entry after the first state
+        seen for the key, which is just where it was when we started.
+        Ignored while paused.
+        """
+        if self.paused:
+            return
+        current = self._current.get(key)
+        if current is not None and current[0] == state:
+            return
+        now = time.time()
+        self._advance(now)
+        self._settle(key, now)
+        if current is not None:
+            states = self._counts.setdefault(key, {})
+            counts = states.get(state)
+            if counts is None:
+                counts = states[state] = array('I', [0]) * ACCOUNTING_HOURS
+            counts[self._hour % ACCOUNTING_HOURS] += 1
+        self._current[key] = (state, now)
+        self._store.async_delay_save(self._data_to_save, ACCOUNTING_SAVE_DELAY)
+
+    def _window(self, rings, key, hours, now):
+        """Sum each state's buckets over the last hours."""
+        # Only the part of the oldest bucket inside the window counts
+        oldest_fraction = 1 - (now % 3600) / 3600
+        totals = {}
+        for state, buckets in rings.get(key, {}).items():
+            total = buckets[(self._hour - hours) % ACCOUNTING_HOURS] * oldest_fraction
+            for hour in range(self._hour - hours + 1, self._hour + 1):
+                total += buckets[hour % ACCOUNTING_HOURS]
+            totals[state] = total
+        return totals
+
+    def totals(self, key, hours):
+        """Return seconds spent in each state over the last hours."""
+        now = time.time()
+        self._advance(now)
+        self._settle(key, now)
+        return self._window(self._buckets, key, hours, now)
+
+    def counts(self, key, hours):
+        """Return the number of entries into each state over the last hours."""
+        now = time.time()
+        self._advance(now)
+        return {state: int(round(count)) for state, count in
+                self._window(self._counts, key, hours, now).items()}
+
+
+class ElkTrafficRecorder(object):
+    """Record raw panel traffic to a compact, size-rotated file.
+
+    Each record is one line holding the milliseconds since the previous
+    record, R (received) or S (sent), and the raw message. A comment line
+    with the absolute time starts each file and each recording session.
+    Records are buffered in memory and written by the executor.
+    """
+
+    def __init__(self, hass, elk, path, max_size, backups):
+        """Initialize the recorder and tap the connection."""
+        self._hass = hass
+        self._path = path
+        self._max_size = max_size
+        self._backups = backups
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_at = None
+        _tap_inbound(elk, partial(self._record, 'R'))
+        send = elk.send
+
+        def _send(msg):
+            self._record('S', msg.message)
+            send(msg)
+        elk.send = _send
+
+    def _record(self, direction, line):
+        """Buffer one record."""
+        with self._lock:
+            self._buffer.append((time.time(), direction, line))
+
+    @asyncio.coroutine
+    def async_flush(self, *_):
+        """Write buffered records out in the executor."""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if records:
+            yield from self._hass.async_add_job(self._write, records)
+
+    def _rotate(self):
+        """Shift capture files along, dropping the oldest."""
+        for index in range(self._backups - 1, 0, -1):
+            older = '{}.{}'.format(self._path, index)
+            if os.path.exists(older):
+                os.replace(older, '{}.{}'.format(self._path, index + 1))
+        os.replace(self._path, self._path + '.1')
+        self._last_at = None
+
+    def _write(self, records):
+        """Append records to the capture file (executor)."""
+        try:
+            if os.path.exists(self._path) and \
+                    os.path.getsize(self._path) >= self._max_size:
+                self._rotate()
+            lines = []
+            for recorded_at, direction, line in records:
+                if self._last_at is None:
+                    lines.append('# elkm1 capture {:.3f}\n'.format(recorded_at))
+                    self._last_at = recorded_at
+                delay = int(round((recorded_at - self._last_at) * 1000))
+                self._last_at = recorded_at
+                lines.append('{} {} {}\n'.format(max(delay, 0), direction, line))
+            with open(self._path, 'a', encoding='ISO-8859-1') as capture_file:
+                capture_file.write(''.join(lines))
+        except OSError as err:
+            _LOGGER.error('Unable to write Elk capture %s: %s', self._path, err)
+
+
+class ElkAuditLog(object):
+    """Append-only, size-rotated log of keypad access.
+
+    Each record is one tab separated line: time, user number and name,
+    keypad number and name, area, the area's armed status once it has had
+    AUDIT_SETTLE_DELAY seconds to change, and whether the code was accepted.
+    Records come straight from the panel's IC reports, so every code entry
+    is logged; rejected codes have no user. Records are buffered and
+    written by the executor. For each file, the time and byte offset of
+    every AUDIT_INDEX_EVERY-th record is kept, so a query reads from just
+    before the start of its time range instead of the whole log.
+    """
+
+    FIELDS = ('at', 'user', 'user_name', 'keypad', 'keypad_name', 'area',
+              'armed_status', 'result')
+
+    def __init__(self, hass, elk, path, max_size, backups):
+        """Initialize the log and listen for code entries."""
+        from elkm1.message import add_message_handler
+        self._hass = hass
+        self._elk = elk
+        self._path = path
+        self._max_size = max_size
+        self._backups = backups
+        # Held by the executor jobs writing and reading the files
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._index = {}
+        self._count = 0
+        self.paused = False
+        add_message_handler('IC', self._ic_handler)
+
+    def _paths(self):
+        """Return the log files, oldest first."""
+        return ['{}.{}'.format(self._path, index)
+                for index in range(self._backups, 0, -1)] + [self._path]
+
+    def load_index(self):
+        """Index the existing log files (executor)."""
+        with self._lock:
+            for path in self._paths():
+                times, offsets = [], []
+                count = offset = 0
+                try:
+                    with open(path, 'rb') as audit_file:
+                        for line in audit_file:
+                            if count % AUDIT_INDEX_EVERY == 0:
+                                times.append(float(line.split(b'\t', 1)[0]))
+                                offsets.append(offset)
+                            count += 1
+                            offset += len(line)
+                except (OSError, ValueError):
+                    if not times:
+                        continue
+                self._index[path] = (times, offsets)
+                if path == self._path:
+                    self._count = count
+
+    def _ic_handler(self, code, user, keypad):
+        """Log a code entry once its area has settled (panel I/O loop).
+
+        user is -1 for a code matching no user. The code itself is never logged.
+        """
+        if self.paused:
+            return
+        record = {'at': time.time(), 'keypad': keypad + 1,
+                  'result': 'rejected' if user < 0 else 'accepted'}
+        if user >= 0:
+            record['user'] = user + 1
+            if user < len(self._elk.users.elements):
+                record['user_name'] = self._elk.users[user].name
+        if 0 <= keypad < len(self._elk.keypads.elements):
+            record['keypad_name'] = self._elk.keypads[keypad].name
+            area = self._elk.keypads[keypad].area
+            if area is not None and area >= 0:
+                record['area'] = area + 1
+        self._hass.loop.call_soon_threadsafe(
+            self._hass.loop.call_later, AUDIT_SETTLE_DELAY, self._settled,
+            record)
+
+    def _settled(self, record):
+        """Buffer an access record with the area's armed status now."""
+        from elkm1.const import ArmedStatus
+        area = record.get('area')
+        if area and area <= len(self._elk.areas.elements):
+            value = self._elk.areas[area - 1].armed_status
+            if value is not None:
+                record['armed_status'] = ArmedStatus(value).name
+        self._buffer.append(tuple(record.get(field) for field in self.FIELDS))
+
+    @asyncio.coroutine
+    def async_flush(self, *_):
+        """Write buffered records out in the executor."""
+        records, self._buffer = self._buffer, []
+        if records:
+            yield from self._hass.async_add_job(self._write, records)
+
+    def _rotate(self):
+        """Shift log files and their indexes along, dropping the oldest."""
+        paths = self._paths()
+        for older, newer in zip(paths, paths[1:]):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+            self._index[older] = self._index.pop(newer, ([], []))
+        if not self._backups:
+            os.remove(self._path)
+        # The live file starts over, with or without a backup of it
+        self._index.pop(self._path, None)
+        self._count = 0
+
+    def _write(self, records):
+        """Append records to the log file (executor)."""
+        with self._lock:
+            try:
+                if os.path.exists(self._path) and \
+                        os.path.getsize(self._path) >= self._max_size:
+                    self._rotate()
+                offset = os.path.getsize(self._path) \
+                    if os.path.exists(self._path) else 0
+                lines = []
+                indexed = []
+                for count, record in enumerate(records, self._count):
+                    line = '{:.3f}\t{}\n'.format(record[0], '\t'.join(
+                        '' if field is None else str(field)
+                        for field in record[1:])).encode('utf-8')
+                    if count % AUDIT_INDEX_EVERY == 0:
+                        indexed.append((record[0], offset))
+                    offset += len(line)
+                    lines.append(line)
+                with open(self._path, 'ab') as audit_file:
+                    audit_file.write(b''.join(lines))
+            except OSError as err:
+                _LOGGER.error('Unable to write Elk audit log %s: %s',
+                              self._path, err)
+                return
+            self._count += len(records)
+            times, offsets = self._index.setdefault(self._path, ([], []))
+            for recorded_at, offset in indexed:
+                times.append(recorded_at)
+                offsets.append(offset)
+
+    def query(self, start, end, user, limit):
+        """Return up to limit records from start to end, oldest first (executor)."""
+        records = []
+        with self._lock:
+            for path in self._paths():
+                times, offsets = self._index.get(path, ([], []))
+                if not times:
+                    continue
+                if times[0] > end:
+                    break
+                position = max(bisect.bisect_right(times, start) - 1, 0)
+                try:
+                    with open(path, 'rb') as audit_file:
+                        audit_file.seek(offsets[position])
+                        for line in audit_file:
+                            fields = line.decode('utf-8').rstrip('\n').split('\t')
+                            at = float(fields[0])
+                            if at < start:
+                                continue
+                            if at > end:
+                                return records
+                            if user is not None and fields[1] != str(user):
+                                continue
+                            # Records logged before a field was added lack it
+                            record = dict.fromkeys(self.FIELDS)
+                            record.update((field, value or None) for field, value
+                                          in zip(self.FIELDS, fields))
+                            record['at'] = at
+                            for field in ('user', 'keypad', 'area'):
+                                if record[field] is not None:
+                                    record[field] = int(record[field])
+                            records.append(record)
+                            if len(records) >= limit:
+                                return records
+                except (OSError, ValueError) as err:
+                    _LOGGER.error('Unable to read Elk audit log %s: %s', path, err)
+        return records
+
+
+class ElkProxy(object):
+    """Share the single panel connection with other local clients.
+
+    Every line received from the panel is fanned out to all connected
+    clients. Lines from clients are validated and written to the panel
+    through the connection's own write queue, so they are serialised with
+    the messages Home Assistant sends.
+    """
+
+    def __init__(self, elk, host, port):
+        """Initialize the proxy, not yet listening."""
+        self._elk = elk
+        self._host = host
+        self._port = port
+        self._server = None
+        self._clients = []
+        _tap_inbound(elk, self.broadcast)
+
+    @asyncio.coroutine
+    def async_start(self):
+        """Start listening for proxy clients."""
+        try:
+            self._server = yield from self._elk.loop.create_server(
+                lambda: ElkProxyClient(self), self._host, self._port)
+        except OSError as err:
+            _LOGGER.error('Unable to start Elk proxy on %s:%s: %s',
+                          self._host, self._port, err)
+            return
+        _LOGGER.info('Elk proxy listening on %s:%s', self._host, self._port)
+
+    def stop(self):
+        """Stop listening and disconnect all clients."""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for client in list(self._clients):
+            client.close()
+
+    def client_connected(self, client):
+        """Track a newly connected client."""
+        _LOGGER.debug('Elk proxy client connected: %s', client.peer)
+        self._clients.append(client)
+
+    def client_disconnected(self, client):
+        """Forget a client that has gone away."""
+        _LOGGER.debug('Elk proxy client disconnected: %s', client.peer)
+        if client in self._clients:
+            self._clients.remove(client)
+
+    def broadcast(self, line):
+        """Send a line received from the panel to every client."""
+        if not self._clients:
+            return
+        data = (line + '\r\n').encode('ISO-8859-1')
+        for client in self._clients:
+            client.write(data)
+
+    def forward(self, line):
+        """Queue a line from a client for the panel."""
+        conn = self._elk._conn
+        if conn is None or not _elk_line_valid(line):
+            return False
+        command = line[2:4]
+        response = PROXY_RESPONSES.get(command)
+        if response is None and command.startswith('a'):
+            # Arm / disarm commands (a0 - a:) all answer with AS
+            response = 'AS'
+        # write_data adds the checksum back, and requeues non-raw data
+        conn.write_data(line[:-2], response)
+        return True
+
+    def stats(self):
+        """Return throughput stats for each connected client."""
+        return [client.stats() for client in list(self._clients)]
+
+
+class ElkProxyClient(asyncio.Protocol):
+    """A single local client connected to the Elk proxy."""
+
+    def __init__(self, proxy):
+        """Initialize client protocol."""
+        self._proxy = proxy
+        self._transport = None
+        self._buffer = ''
+        self.peer = None
+        self.connected_at = 0
+        self.lines_in = 0
+        self.lines_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        """Register with the proxy once connected."""
+        self._transport = transport
+        peer = transport.get_extra_info('peername')
+        self.peer = '{}:{}'.format(peer[0], peer[1]) if peer else 'unknown'
+        self.connected_at = time.time()
+        self._proxy.client_connected(self)
+
+    def connection_lost(self, exc):
+        """Unregister from the proxy."""
+        self._transport = None
+        self._proxy.client_disconnected(self)
+
+    def data_received(self, data):
+        """Split client data into lines and forward them to the panel."""
+        self.bytes_in += len(data)
+        self._buffer += data.decode('ISO-8859-1')
+        while '\r\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\r\n', 1)
+            self.lines_in += 1
+            if not self._proxy.forward(line):
+                self.rejected += 1
+        if len(self._buffer) > 256:
+            # No valid Elk message is this long, so the client is confused
+            self._buffer = ''
+            self.rejected += 1
+
+    def write(self, data):
+        """Send panel data to the client, dropping it if they fall behind."""
+        if self._transport is None:
+            return
+        if self._transport.get_write_buffer_size() > PROXY_WRITE_BUFFER_LIMIT:
+            self.dropped += 1
+            return
+        self._transport.write(data)
+        self.lines_out += 1
+        self.bytes_out += len(data)
+
+    def close(self):
+        """Disconnect the client."""
+        if self._transport is not None:
+            self._transport.close()
+
+    def stats(self):
+        """Return throughput stats for this client."""
+        elapsed = max(time.time() - self.connected_at, 1)
+        return {
+            'peer': self.peer,
+            'connected_at': self.connected_at,
+            'lines_in': self.lines_in,
+            'lines_out': self.lines_out,
+            'bytes_in_per_sec': round(self.bytes_in / elapsed, 1),
+            'bytes_out_per_sec': round(self.bytes_out / elapsed, 1),
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            }
+
+
 #def stop(event: object) -> None:
 #    """Stop PyElk."""
 #    pyelk_instance.stop()
@@ -12,6 +12,8 @@ from homeassistant.components.light import (Light, ATTR_BRIGHTNESS,
                                             SUPPORT_BRIGHTNESS)
 from homeassistant.core import callback
 
+from custom_components.elkm1 import ElkDeviceBase
+
 DEPENDENCIES = ['elkm1']
 
 _LOGGER = logging.getLogger(__name__)
@@ -24,6 +26,7 @@ def async_setup_platform(hass, config: ConfigType,
     elk = hass.data['elkm1']['connection']
     elk_config = hass.data['elkm1']['config']
     discovered_devices = hass.data['elkm1']['discovered_devices']
+    entities = hass.data['elkm1']['entities']
     #if elk is None:
     #    _LOGGER.error('Elk is None')
     #    return False
@@ -59,6 +62,7 @@ def async_setup_platform(hass, config: ConfigType,
             device = ElkLightDevice(element[0], elk, hass, element[1])
             _LOGGER.debug('Loading Elk %s: %s', element[0].__class__.__name__, element[0].name)
             discovered_devices[element_name] = device
+            entities[device.entity_id] = device
             devices.append(device)
         else:
             _LOGGER.debug('Skipping already loaded Elk %s: %s', element[0].__class__.__name__, element[0].name)
@@ -67,18 +71,35 @@ def async_setup_platform(hass, config: ConfigType,
     return True
 
 
-class ElkLightDevice(Light):
+class ElkLightDevice(ElkDeviceBase, Light):
     """Elk X10 device as Switch."""
 
+    # Element attributes shown, the only ones we are woken for
+    ATTRIBUTES = {'name', 'status'}
+
     def __init__(self, device, elk, hass, show_override):
         """Initialize X10 switch."""
         self._element = device
         self._name = 'elkm1_' + self._element.default_name('_').lower()
         self.entity_id = 'light.' + self._name
         self._state = None
+        self._brightness = 0
         self._hidden = self._element.is_default_name() #not self._device.enabled
-        self._element.add_callback(self.trigger_update)
+        hass.data['elkm1']['inbound_queue'].subscribe(
+            self._element, self.ATTRIBUTES, self.trigger_update)
         self._show_override = show_override
+        self._debounce = hass.data['elkm1']['config']['light_debounce']
+        self._debounce_timer = None
+        self._pending_level = None
+
+    def _sync_key(self):
+        """Light status comes in banks of 64 lights."""
+        return ('PS', self._element._index // 64)
+
+    def _restore(self, state):
+        """Take our state and brightness from the restored state."""
+        super()._restore(state)
+        self._brightness = (state.attributes.get(ATTR_BRIGHTNESS) or 0) / 2.55
 
     @property
     def name(self):
@@ -98,6 +119,8 @@ class ElkLightDevice(Light):
     @property
     def brightness(self) -> float:
         """Get the brightness of the X10 light."""
+        if self._stale:
+            return self._brightness / 100.0
         if self._element.status > 2:
             return self._element.status / 100.0
         if self._element.status == 1:
@@ -112,12 +135,23 @@ class ElkLightDevice(Light):
     @callback
     def trigger_update(self, attribute, value):
         """Target of PyElk callback."""
+        if attribute != 'name':
+            self._confirm()
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
+        self._hidden = self._element.is_default_name()
+        if self._stale:
+            return
         if self._element.status > 2:
             self._brightness = self._element.status
             self._state = STATE_ON
@@ -127,7 +161,6 @@ class ElkLightDevice(Light):
         if self._element.status == 0:
             self._brightness = 0
             self._state = STATE_OFF
-        self._hidden = self._element.is_default_name()
 
     @property
     def device_state_attributes(self):
@@ -136,13 +169,16 @@ class ElkLightDevice(Light):
             hidden = self._hidden
         else:
             hidden = not self._show_override
-        return {
+        attributes = {
             #'House Code': self._element.house_pretty,
             #'Device': self._element.device_pretty,
             #'unique_id': self._element.house_pretty + self._element.device_pretty,
             'hidden': hidden,
             ATTR_BRIGHTNESS : round(self._brightness * 2.55),
             }
+        if self._stale:
+            attributes['stale'] = True
+        return attributes
 
     @property
     def is_on(self) -> bool:
@@ -165,11 +201,36 @@ class ElkLightDevice(Light):
                 level = 99
             if level < 2:
                 level = 2
-            self._element.turn_on(level,0)
+            self._set_level(level)
         else:
+            self._pending_level = None
             self._element.turn_on(100,0)
 
     @asyncio.coroutine
     def async_turn_off(self, **kwargs):
         """Turn off output."""
+        self._pending_level = None
         self._element.turn_off()
+
+    def _set_level(self, level):
+        """Debounce brightness writes, e.g. from a slider being dragged.
+
+        The first level is written at once, then at most one more write
+        per debounce window, carrying the latest level asked for.
+        """
+        if self._debounce_timer is not None:
+            self._pending_level = level
+            return
+        if level != self._element.status:
+            self._element.turn_on(level, 0)
+        if self._debounce > 0:
+            self._debounce_timer = self.hass.loop.call_later(
+                self._debounce, self._debounce_done)
+
+    @callback
+    def _debounce_done(self):
+        """Write the last level asked for during the window, if any."""
+        self._debounce_timer = None
+        level, self._pending_level = self._pending_level, None
+        if level is not None:
+            self._set_level(level)
@@ -1,7 +1,10 @@
 """Support for Elk zones as sensors."""
 import asyncio
 import logging
+import math
 import time
+from collections import deque
+from itertools import islice
 from typing import Callable  # noqa
 
 from homeassistant.const import (TEMP_FAHRENHEIT, STATE_UNKNOWN)
@@ -12,6 +15,9 @@ from homeassistant.helpers.typing import ConfigType
 
 from homeassistant.core import callback
 
+from custom_components.elkm1 import (
+    ElkDeviceBase, HISTORY_SIZE, ON_TIME_WINDOWS)
+
 DEPENDENCIES = ['elkm1']
 
 _LOGGER = logging.getLogger(__name__)
@@ -24,6 +30,7 @@ def async_setup_platform(hass, config: ConfigType,
     elk = hass.data['elkm1']['connection']
     elk_config = hass.data['elkm1']['config']
     discovered_devices = hass.data['elkm1']['discovered_devices']
+    entities = hass.data['elkm1']['entities']
     #if elk is None:
     #    _LOGGER.error('Elk is None')
     #    return False
@@ -90,17 +97,41 @@ def async_setup_platform(hass, config: ConfigType,
                 _LOGGER.debug('Loading Elk %s: %s', element[0].__class__.__name__, element[0].name)
                 device = ElkSensorDevice(element[0], elk, hass, element[1])
                 discovered_devices[element_name] = device
+                entities[device.entity_id] = device
                 devices.append(device)
             else:
                 _LOGGER.debug('Skipping already loaded Elk %s: %s', element[0].__class__.__name__, element[0].name)
         else:
             continue
 
+    # Entry/exit countdown per area
+    if elk_config['area']['enabled']:
+        for element in elk.areas:
+            if element and elk_config['area']['included'][element._index] is True:
+                element_name = 'sensor.elkm1_' + element.default_name('_').lower() + '_timer'
+                if element_name not in discovered_devices:
+                    device = ElkAreaTimerSensor(element, elk, hass, elk_config['area']['shown'][element._index])
+                    discovered_devices[element_name] = device
+                    entities[device.entity_id] = device
+                    devices.append(device)
+                element_name = 'sensor.elkm1_' + element.default_name('_').lower() + '_zones'
+                if element_name not in discovered_devices:
+                    device = ElkZoneAggregateSensor(element, elk, hass, elk_config['area']['shown'][element._index])
+                    discovered_devices[element_name] = device
+                    entities[device.entity_id] = device
+                    devices.append(device)
+    # Zone aggregates for the whole panel
+    if elk_config['zone']['enabled'] and 'sensor.elkm1_zones' not in discovered_devices:
+        device = ElkZoneAggregateSensor(None, elk, hass, elk_config['panel']['shown'][0])
+        discovered_devices['sensor.elkm1_zones'] = device
+        entities[device.entity_id] = device
+        devices.append(device)
+
     async_add_devices(devices, True)
     return True
 
 
-class ElkSensorDevice(Entity):
+class ElkSensorDevice(ElkDeviceBase, Entity):
     """Elk device as Sensor."""
 
     TYPE_UNDEFINED = 0
@@ -113,6 +144,26 @@ class ElkSensorDevice(Entity):
     TYPE_COUNTER = 7
     TYPE_SETTING = 8
 
+    # Panel message confirming the state of each type during sync
+    SYNC_MESSAGES = {
+        TYPE_PANEL: 'VN',
+        TYPE_ZONE: 'ZS',
+        TYPE_ZONE_TEMP: 'LW',
+        TYPE_KEYPAD: 'LW',
+        TYPE_THERMOSTAT: 'TR',
+        TYPE_COUNTER: 'CV',
+        TYPE_SETTING: 'CR',
+        }
+
+    # Element attributes shown by zone sensors, the only ones they are
+    # woken for; other types are woken for every attribute
+    ATTRIBUTES = {
+        TYPE_ZONE: {'name', 'area', 'definition', 'logical_status',
+                    'physical_status'},
+        TYPE_ZONE_TEMP: {'name', 'area', 'definition', 'temperature'},
+        TYPE_ZONE_VOLTAGE: {'name', 'area', 'definition', 'voltage'},
+        }
+
     def __init__(self, device, elk, hass, show_override):
         """Initialize device sensor."""
         from elkm1.const import ZoneType, ZoneLogicalStatus, ZonePhysicalStatus
@@ -131,6 +182,9 @@ class ElkSensorDevice(Entity):
         self._last_user_at = 0
         self._area = None
         self._show_override = show_override
+        self._restored_attributes = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._history_pending = False
 
         self._name = 'elkm1_' + self._element.default_name('_').lower()
         if isinstance(device, ElkZone):
@@ -205,9 +259,19 @@ class ElkSensorDevice(Entity):
             ZoneType.INTERCOM_KEY.value : 'deskphone'
             }
         self._definition_temperature = ZoneType.TEMPERATURE.value
-        self._element.add_callback(self.trigger_update)
+        if self._type in self.ATTRIBUTES:
+            hass.data['elkm1']['inbound_queue'].subscribe(
+                self._element, self.ATTRIBUTES[self._type], self.trigger_update)
+        else:
+            self._element.add_callback(self.trigger_update)
         self.hass = hass
 
+    def _sync_key(self):
+        """Return our type's sync message, and our index if it has one."""
+        if self._type in [self.TYPE_THERMOSTAT, self.TYPE_COUNTER, self.TYPE_SETTING]:
+            return (self.SYNC_MESSAGES[self._type], self._element._index)
+        return (self.SYNC_MESSAGES.get(self._type), None)
+
     @property
     def temperature_unit(self):
         """Return the unit of measurement."""
@@ -272,12 +336,22 @@ class ElkSensorDevice(Entity):
         """Return the state attributes of the sensor."""
         from elkm1.const import ZoneType, ZoneLogicalStatus, ZonePhysicalStatus, SettingFormat, ElkRPStatus
         from elkm1.util import pretty_const
+        if self._stale:
+            attributes = dict(self._restored_attributes)
+            attributes['stale'] = True
+            return attributes
         attributes = {
     #        'hidden': self._hidden,
             }
     #    # If we're some kind of Zone, add Zone attributes
         if self._type == self.TYPE_ZONE:
             attributes['Physical Status'] = pretty_const(ZonePhysicalStatus(self._element.physical_status).name)
+            on_time = self.hass.data['elkm1']['on_time']
+            for window, hours in ON_TIME_WINDOWS:
+                attributes['Violated Hours ' + window] = round(on_time.totals(
+                    self._on_time_key(), hours).get('VIOLATED', 0) / 3600, 2)
+                attributes['Violations ' + window] = on_time.counts(
+                    self._on_time_key(), hours).get('VIOLATED', 0)
     #        attributes['State'] = self._element.state_pretty()
     #        attributes['Alarm'] = self._element.alarm_pretty()
             attributes['Definition'] = pretty_const(ZoneType(self._element.definition).name)
@@ -298,6 +372,12 @@ class ElkSensorDevice(Entity):
                 attributes['Last User Number'] = self._last_user_num
             if self._last_user_at:
                 attributes['Last User At'] = self._last_user_at
+        if self._type in [self.TYPE_ZONE_TEMP, self.TYPE_KEYPAD, self.TYPE_THERMOSTAT]:
+            kind = {self.TYPE_ZONE_TEMP: 'zone', self.TYPE_KEYPAD: 'keypad',
+                    self.TYPE_THERMOSTAT: 'thermostat'}[self._type]
+            poller = self.hass.data['elkm1']['poller']
+            attributes['Last Reported'] = poller.last_reported(kind, self._element.index)
+            attributes['Staleness'] = poller.staleness(kind, self._element.index)
         if self._type == self.TYPE_SETTING:
             attributes['Value Format'] = None
             if self._element.value_format:
@@ -315,8 +395,37 @@ class ElkSensorDevice(Entity):
                 attributes['Real Time Clock'] = self._element.real_time_clock
             if self._element.remote_programming_status is not None:
                 attributes['ElkRP'] = pretty_const(ElkRPStatus(self._element.remote_programming_status).name)
+            attributes['Inbound Queue'] = self.hass.data['elkm1']['inbound_queue'].stats()
+            attributes['Arm Latency'] = self.hass.data['elkm1']['arm_latency'].stats()
+            rules = self.hass.data['elkm1']['rules']
+            if rules is not None:
+                attributes['Rules'] = rules.stats()
+            proxy = self.hass.data['elkm1']['proxy']
+            if proxy is not None:
+                attributes['Proxy Clients'] = proxy.stats()
         return attributes
 
+    def _record_history(self):
+        """Add the zone's status to its history."""
+        self._history_pending = False
+        status = (self._element.logical_status, self._element.physical_status)
+        if self._history and self._history[-1][1:] == status:
+            return
+        self._history.append((time.time(),) + status)
+
+    def history(self, count):
+        """Return the last count status transitions, newest first."""
+        from elkm1.const import ZoneLogicalStatus, ZonePhysicalStatus
+        from elkm1.util import pretty_const
+        return [{'at': at,
+                 'logical_status': pretty_const(ZoneLogicalStatus(logical).name),
+                 'physical_status': pretty_const(ZonePhysicalStatus(physical).name)}
+                for at, logical, physical in islice(reversed(self._history), count)]
+
+    def _on_time_key(self):
+        """Return the accounting key for this zone."""
+        return 'zone_{}'.format(self._element.index + 1)
+
     @callback
     def trigger_update(self, attribute, value):
         """Target of PyElk callback."""
@@ -340,7 +449,7 @@ class ElkSensorDevice(Entity):
             self._last_user_num = value + 1
             self._last_user_name = self._element._elk.users[value].name
             event_data['user_at'] = self._last_user_at
-            event_data['user_num'] = self._last_user_num,
+            event_data['user_num'] = self._last_user_num
             event_data['user_name'] = self._last_user_name
         if attribute == 'area':
             event_send = True
@@ -348,12 +457,29 @@ class ElkSensorDevice(Entity):
             event_data['area'] = self._area
         if event_send and self.hass and event_data['type'] != '':
             self.hass.bus.fire('elkm1_sensor_event', event_data)
+        if self._type == self.TYPE_ZONE and self.hass and \
+                attribute in ['logical_status', 'physical_status', 'area']:
+            self.hass.data['elkm1']['zone_aggregates'].update(
+                self._element.index + 1, self._element.area + 1,
+                self._element.logical_status, self._element.physical_status)
+            if attribute != 'area' and not self._history_pending:
+                # One entry for both statuses of a zone change message
+                self._history_pending = True
+                self.hass.loop.call_soon(self._record_history)
+        if attribute != 'name':
+            self._confirm()
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
         from elkm1.const import ZoneType, ZoneLogicalStatus, ZonePhysicalStatus
         from elkm1.util import pretty_const
         # Set state according to device type
@@ -408,7 +534,179 @@ class ElkSensorDevice(Entity):
                     state = 'Normal'
             else:
                 state = 'Disconnected'
+        if self._stale:
+            # Keep restored state until the panel confirms it
+            return
+        if self._type == self.TYPE_ZONE and self._confirmed:
+            self.hass.data['elkm1']['on_time'].transition(
+                self._on_time_key(),
+                ZoneLogicalStatus(self._element.logical_status).name)
         if state is not None:
             self._state = state
         else:
-            self._state = STATE_UNKNOWN
\ No newline at end of file
+            self._state = STATE_UNKNOWN
+
+
+class ElkAreaTimerSensor(Entity):
+    """Entry/exit delay countdown of an Area.
+
+    The panel reports the timer only when it starts, so the countdown is
+    extrapolated from that report with one callback scheduled for each
+    change of the whole seconds shown.
+    """
+
+    def __init__(self, area, elk, hass, show_override):
+        """Initialize the countdown."""
+        self._element = area
+        self._name = 'elkm1_' + self._element.default_name('_').lower() + '_timer'
+        self.entity_id = 'sensor.' + self._name
+        self._show_override = show_override
+        self._ends_at = None
+        self._tick_handle = None
+        hass.data['elkm1']['inbound_queue'].subscribe(
+            self._element, {'name', 'armed_status', 'timer_timestamp'},
+            self.trigger_update)
+
+    @property
+    def name(self):
+        """Return the name of the countdown."""
+        return self._element.name + ' Timer'
+
+    @property
+    def state(self):
+        """Return the whole seconds left."""
+        if self._ends_at is None:
+            return 0
+        return int(math.ceil(max(self._ends_at - time.time(), 0)))
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement."""
+        return 's'
+
+    @property
+    def icon(self):
+        """Icon to use in the frontend."""
+        return 'mdi:timer'
+
+    @property
+    def should_poll(self) -> bool:
+        """Return whether this device should be polled."""
+        return False
+
+    @property
+    def device_state_attributes(self):
+        """Return the state attributes of the countdown."""
+        if self._show_override is None:
+            hidden = self._element.is_default_name()
+        else:
+            hidden = not self._show_override
+        timer = None
+        if self._ends_at is not None:
+            timer = 'Exit' if self._element.is_exit else 'Entry'
+        return {'hidden': hidden, 'Timer': timer}
+
+    @callback
+    def trigger_update(self, attribute, value):
+        """Target of PyElk callback."""
+        from elkm1.const import ArmedStatus
+        if attribute == 'timer_timestamp':
+            # Set together with the timers, when the panel reported them
+            remaining = max(self._element.timer1, self._element.timer2)
+            self._ends_at = value + remaining if remaining > 0 else None
+        elif attribute == 'armed_status' and value == ArmedStatus.DISARMED.value:
+            self._ends_at = None
+        elif attribute != 'name':
+            return
+        self._schedule_tick()
+        if self.hass:
+            self.async_schedule_update_ha_state()
+
+    def _schedule_tick(self):
+        """Schedule the next update of the seconds shown, if counting."""
+        if self._tick_handle is not None:
+            self._tick_handle.cancel()
+            self._tick_handle = None
+        if self._ends_at is None or self.hass is None:
+            return
+        remaining = self._ends_at - time.time()
+        if remaining <= 0:
+            self._ends_at = None
+            return
+        # Just after the shown whole seconds drop by one
+        self._tick_handle = self.hass.loop.call_later(
+            (remaining % 1 or 1) + 0.01, self._tick)
+
+    @callback
+    def _tick(self):
+        """Show the countdown's new value."""
+        self._tick_handle = None
+        self._schedule_tick()
+        self.async_schedule_update_ha_state()
+
+
+
+class ElkZoneAggregateSensor(Entity):
+    """Violated, bypassed, troubled and open zones of an Area, or of all.
+
+    The state is the number of violated zones; the attributes list the
+    zones in each group by name.
+    """
+
+    CATEGORIES = ['violated', 'bypassed', 'troubled', 'open']
+
+    def __init__(self, area, elk, hass, show_override):
+        """Initialize the aggregate, for the whole panel if area is None."""
+        self._elk = elk
+        self._element = area
+        self._area = 0 if area is None else area.index + 1
+        if area is None:
+            self._name = 'elkm1_zones'
+        else:
+            self._name = 'elkm1_' + area.default_name('_').lower() + '_zones'
+        self.entity_id = 'sensor.' + self._name
+        self._show_override = show_override
+
+    @asyncio.coroutine
+    def async_added_to_hass(self):
+        """Follow changes to the zone aggregates."""
+        self.hass.data['elkm1']['zone_aggregates'].async_add_listener(
+            self._area, self.async_schedule_update_ha_state)
+
+    @property
+    def name(self):
+        """Return the name of the aggregate."""
+        if self._element is None:
+            return 'Elk Zones'
+        return self._element.name + ' Zones'
+
+    @property
+    def state(self):
+        """Return the number of violated zones."""
+        return len(self.hass.data['elkm1']['zone_aggregates'].members(
+            self._area, 'violated'))
+
+    @property
+    def icon(self):
+        """Icon to use in the frontend."""
+        return 'mdi:shield-home'
+
+    @property
+    def should_poll(self) -> bool:
+        """Return whether this device should be polled."""
+        return False
+
+    @property
+    def device_state_attributes(self):
+        """Return the zones in each group."""
+        aggregates = self.hass.data['elkm1']['zone_aggregates']
+        if self._show_override is None:
+            hidden = self._element is not None and self._element.is_default_name()
+        else:
+            hidden = not self._show_override
+        attributes = {'hidden': hidden}
+        for category in self.CATEGORIES:
+            attributes[category.title()] = [
+                self._elk.zones[zone - 1].name
+                for zone in aggregates.members(self._area, category)]
+        return attributes
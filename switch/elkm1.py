@@ -11,6 +11,8 @@ from homeassistant.helpers.entity import ToggleEntity
 
 from homeassistant.core import callback
 
+from custom_components.elkm1 import ElkDeviceBase, ON_TIME_WINDOWS
+
 DEPENDENCIES = ['elkm1']
 
 _LOGGER = logging.getLogger(__name__)
@@ -23,6 +25,7 @@ def async_setup_platform(hass, config: ConfigType,
     elk = hass.data['elkm1']['connection']
     elk_config = hass.data['elkm1']['config']
     discovered_devices = hass.data['elkm1']['discovered_devices']
+    entities = hass.data['elkm1']['entities']
     #if elk is None:
     #    _LOGGER.error('Elk is None')
     #    return False
@@ -67,6 +70,7 @@ def async_setup_platform(hass, config: ConfigType,
                 device = ElkTaskDevice(element[0], elk, hass, element[1])
             _LOGGER.debug('Loading Elk %s: %s', element[0].__class__.__name__, element[0].name)
             discovered_devices[element_name] = device
+            entities[device.entity_id] = device
             devices.append(device)
         else:
             _LOGGER.debug('Skipping already loaded Elk %s: %s', element[0].__class__.__name__, element[0].name)
@@ -75,18 +79,26 @@ def async_setup_platform(hass, config: ConfigType,
     return True
 
 
-class ElkOutputDevice(ToggleEntity):
+class ElkOutputDevice(ElkDeviceBase, ToggleEntity):
     """Elk Output as Toggle Switch."""
 
+    # Element attributes shown, the only ones we are woken for
+    ATTRIBUTES = {'name', 'output_on'}
+
     def __init__(self, output, elk, hass, show_override):
         """Initialize output switch."""
         self._element = output
         self._name = 'elkm1_' + self._element.default_name('_').lower()
         self.entity_id = 'switch.' + self._name
         self._state = None
-        self._element.add_callback(self.trigger_update)
+        hass.data['elkm1']['inbound_queue'].subscribe(
+            self._element, self.ATTRIBUTES, self.trigger_update)
         self._show_override = show_override
 
+    def _sync_key(self):
+        """Output status covers every output."""
+        return ('CS', None)
+
     @property
     def name(self):
         """Return the name of the switch."""
@@ -105,16 +117,29 @@ class ElkOutputDevice(ToggleEntity):
     @callback
     def trigger_update(self, attribute, value):
         """Target of PyElk callback."""
+        if attribute != 'name':
+            self._confirm()
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
+        if self._stale:
+            return
         if self.is_on:
             self._state = STATE_ON
         else:
             self._state = STATE_OFF
+        if self._confirmed:
+            self.hass.data['elkm1']['on_time'].transition(
+                self._on_time_key(), self._state.upper())
         #self._hidden = not self._element.enabled
 
     @property
@@ -124,13 +149,28 @@ class ElkOutputDevice(ToggleEntity):
             hidden = self._element.is_default_name()
         else:
             hidden = not self._show_override
-        return {
+        attributes = {
             'hidden': hidden #self._element.is_default_name(),
             }
+        if self._stale:
+            attributes['stale'] = True
+        on_time = self.hass.data['elkm1']['on_time']
+        for window, hours in ON_TIME_WINDOWS:
+            attributes['On Hours ' + window] = round(on_time.totals(
+                self._on_time_key(), hours).get('ON', 0) / 3600, 2)
+            attributes['Activations ' + window] = on_time.counts(
+                self._on_time_key(), hours).get('ON', 0)
+        return attributes
+
+    def _on_time_key(self):
+        """Return the accounting key for this output."""
+        return 'output_{}'.format(self._element.index + 1)
 
     @property
     def is_on(self) -> bool:
         """True if output in the on state."""
+        if self._stale:
+            return self._state == STATE_ON
         return self._element.output_on
 
     @property
@@ -180,11 +220,17 @@ class ElkTaskDevice(ToggleEntity):
         if attribute == 'last_change':
             self._state = STATE_ON
         if self.hass:
-            self.async_schedule_update_ha_state(True)
+            self._update_state()
+            self.async_schedule_update_ha_state()
 
     @asyncio.coroutine
     def async_update(self):
-        """Get the latest data and update the state."""
+        """Compute the state before the entity is first added."""
+        self._update_state()
+
+    @callback
+    def _update_state(self):
+        """Compute the state from the element."""
         if self.is_on:
             self.hass.async_add_job(self._async_auto_off)
 
@@ -224,7 +270,7 @@ class ElkTaskDevice(ToggleEntity):
         # Tasks aren't actually ever turned off
         # Tasks are momentary, so "always" off
         self._state = STATE_OFF
-        self.async_schedule_update_ha_state(True)
+        self.async_schedule_update_ha_state()
 
     @asyncio.coroutine
     def _async_auto_off(self, timeout=2):
@@ -0,0 +1,133 @@
+"""Fixtures for testing the Elk M1 component against a real Home Assistant."""
+import asyncio
+import importlib
+import os
+import sys
+import time
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The component module is named elkm1 too and would shadow the library
+sys.path[:] = [path for path in sys.path
+               if os.path.abspath(path or os.curdir) != ROOT]
+
+# Installed as custom_components/elkm1.py and <domain>/elkm1.py below it,
+# where the platforms import from the component
+sys.modules['custom_components'] = types.ModuleType('custom_components')
+sys.modules['custom_components'].__path__ = [ROOT]
+
+
+def load(name):
+    """Import a new copy of one of the component's modules.
+
+    name is relative to custom_components, e.g. 'sensor.elkm1'. Platforms
+    import from the last copy of the component loaded.
+    """
+    name = 'custom_components.' + name
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+
+@pytest.fixture(autouse=True)
+def message_handlers():
+    """Drop the panel message handlers a test registered.
+
+    The library keeps them in one module-wide registry, so without this
+    handlers from an earlier test's setup would run on its closed loop.
+    """
+    from elkm1 import message
+    saved = {message_type: list(handlers) for message_type, handlers
+             in message._message_handlers.items()}
+    yield
+    message._message_handlers.clear()
+    message._message_handlers.update(saved)
+
+
+@pytest.fixture
+def component():
+    """Return the component module, with no platforms loaded by setup."""
+    module = load('elkm1')
+    module.SUPPORTED_DOMAINS = []
+    return module
+
+
+@pytest.fixture
+def clock(component, monkeypatch):
+    """Return a list holding the time.time() the component sees.
+
+    Tests move it on by changing clock[0]. Only the component's own module
+    sees it, not Home Assistant or the event loop.
+    """
+    now = [time.time()]
+    monkeypatch.setattr(component, 'time', types.SimpleNamespace(
+        time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def hass(tmpdir):
+    """Return a Home Assistant instance on its own event loop."""
+    from homeassistant.core import HomeAssistant
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    hass = HomeAssistant(loop)
+    hass.config.config_dir = str(tmpdir)
+    yield hass
+    # e.g. the panel connection attempt, if the test never ran the loop
+    pending = asyncio.Task.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+    hass.executor.shutdown()
+    loop.close()
+
+
+@pytest.fixture
+def setup_elk(hass, component):
+    """Return a function setting up the component with extra config.
+
+    The host is unreachable, so the panel never connects and tests feed
+    it messages directly. Returns the Elk and the list of messages sent,
+    or None for the list if record is False and sending is left alone.
+    """
+    def _setup(record=True, **conf):
+        config = component.CONFIG_SCHEMA(
+            {'elkm1': dict({'host': 'elk://127.0.0.1:1'}, **conf)})
+        assert hass.loop.run_until_complete(
+            component.async_setup(hass, config))
+        elk = hass.data['elkm1']['connection']
+        if not record:
+            return elk, None
+        sent = []
+        elk.send = sent.append
+        return elk, sent
+    return _setup
+
+
+def frame(body):
+    """Return a panel message line, adding length and checksum."""
+    line = '{:02X}{}00'.format(len(body) + 4, body)
+    checksum = (256 - sum(ord(char) for char in line) % 256) % 256
+    return line + '{:02X}'.format(checksum)
+
+
+def feed(elk, body):
+    """Decode a panel message as if received."""
+    elk._got_data(frame(body))
+
+
+def answer(hass, elk, sent, replies):
+    """Have the panel answer requests with the reply given for them.
+
+    replies maps the start of a request, e.g. 'cx01', to the message body
+    the panel answers with. Requests without a reply go unanswered.
+    """
+    def _send(msg):
+        sent.append(msg)
+        for request, reply in replies.items():
+            if msg.message[2:].startswith(request):
+                hass.loop.call_soon(feed, elk, reply)
+    elk.send = _send
@@ -0,0 +1,65 @@
+"""Tests for time and entry accounting over rolling windows."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+HOUR = 3600
+
+
+@pytest.fixture
+def accumulator(hass, component, clock):
+    """Return an empty accumulator, the clock half way into an hour."""
+    clock[0] = (int(clock[0] // HOUR) + 1) * HOUR + HOUR / 2
+    return component.ElkAccumulator(hass, 'test')
+
+
+def test_time_is_split_across_hours(accumulator, clock):
+    """An hour on from half past is half in each hour's bucket."""
+    start = clock[0]
+    accumulator.transition('output_1', 'ON')
+    clock[0] += HOUR
+    accumulator.transition('output_1', 'OFF')
+    hour = int(start // HOUR)
+    buckets = accumulator._buckets['output_1']['ON']
+    assert buckets[hour % len(buckets)] == HOUR / 2
+    assert buckets[(hour + 1) % len(buckets)] == HOUR / 2
+    # On the hour, so the window holds whole buckets
+    clock[0] += HOUR / 2
+    assert accumulator.totals('output_1', 24) == {'ON': HOUR, 'OFF': HOUR / 2}
+    # The first state seen is where it was, not an entry
+    assert accumulator.counts('output_1', 24) == {'OFF': 1}
+
+
+def test_windows_roll_forward(accumulator, clock):
+    """Time and entries leave the 24h and 168h windows as hours pass."""
+    accumulator.transition('output_1', 'ON')
+    clock[0] += HOUR
+    accumulator.transition('output_1', 'OFF')
+    clock[0] += HOUR / 2
+    accumulator.transition('output_1', 'ON')
+
+    clock[0] += 23 * HOUR
+    # The first half hour on is now more than a day ago
+    assert accumulator.totals('output_1', 24) == {
+        'ON': HOUR / 2 + 23 * HOUR, 'OFF': HOUR / 2}
+    assert accumulator.totals('output_1', 168) == {
+        'ON': HOUR + 23 * HOUR, 'OFF': HOUR / 2}
+    assert accumulator.counts('output_1', 24) == {'ON': 1, 'OFF': 1}
+
+    # Eight days later, hours we did not see are cleared by _advance
+    clock[0] += 8 * 24 * HOUR
+    assert accumulator.totals('output_1', 168) == {'ON': 168 * HOUR, 'OFF': 0}
+    assert accumulator.counts('output_1', 168) == {'ON': 0, 'OFF': 0}
+    assert accumulator.totals('output_1', 24) == {'ON': 24 * HOUR, 'OFF': 0}
+
+
+def test_paused_accumulator_ignores_transitions(accumulator, clock):
+    """Transitions while paused, e.g. replayed ones, are not accounted."""
+    accumulator.transition('zone_1', 'NORMAL')
+    accumulator.paused = True
+    clock[0] += HOUR / 2
+    accumulator.transition('zone_1', 'VIOLATED')
+    accumulator.paused = False
+    clock[0] += HOUR
+    assert accumulator.totals('zone_1', 24) == {'NORMAL': HOUR * 1.5}
+    assert accumulator.counts('zone_1', 24) == {}
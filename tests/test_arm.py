@@ -0,0 +1,94 @@
+"""Tests for bypassing zones and arming areas in one batch."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import answer, load  # noqa: E402
+
+ARMED_AWAY = 'AS' + '1' + '0' * 7 + '0' * 8 + '0' * 8
+INVALID_CODE = 'IC' + '00' * 6 + '000' + '01'
+NOT_READY = 'AS' + '0' * 8 + '0' * 8 + '0' * 8
+
+
+def _arm(hass, **data):
+    """Call elkm1.arm and return the result it reports."""
+    events = []
+    hass.bus.async_listen('elkm1_arm_done', events.append)
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'arm', dict({'code': 1234, 'timeout': 0.1}, **data),
+        blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    return events[0].data
+
+
+def test_bypasses_zones_then_arms(hass, setup_elk):
+    """Zones already bypassed are left alone, as a bypass request toggles."""
+    elk, sent = setup_elk()
+    elk.zones[0].logical_status = 3
+    answer(hass, elk, sent, {'zb002': 'ZB002' + '1', 'a11': ARMED_AWAY})
+    result = _arm(hass, areas=['1'], level='away', bypass=['1-2'])
+    assert [msg.message[2:7] for msg in sent] == ['zb002', 'a1100']
+    assert result['bypassed'] == [{'zone': 2, 'success': True}]
+    assert [(entry['area'], entry['success']) for entry in result['areas']] \
+        == [(1, True)]
+
+
+@pytest.mark.parametrize('replies,error', [
+    ({'a11': INVALID_CODE}, 'invalid code'),
+    ({}, 'timeout'),
+    ])
+def test_unarmed_areas_report_why(hass, setup_elk, replies, error):
+    """A rejected code or no answer fails every area not yet armed."""
+    elk, sent = setup_elk()
+    answer(hass, elk, sent, replies)
+    result = _arm(hass, areas=['1-2'], level='away', bypass=['3'])
+    assert [entry.get('error') for entry in result['bypassed']] == [error]
+    assert [(entry['area'], entry['success'], entry['error'])
+            for entry in result['areas']] == [(1, False, error),
+                                              (2, False, error)]
+
+
+def test_other_areas_keypads_do_not_fail_arming(hass, setup_elk):
+    """A code rejected at a keypad in another area is someone else's."""
+    elk, sent = setup_elk()
+    elk.keypads[1].area = 1
+    answer(hass, elk, sent, {'a11': 'IC' + '00' * 6 + '000' + '02'})
+    result = _arm(hass, areas=['1'], level='away')
+    assert result['areas'][0]['error'] == 'timeout'
+
+
+def _area(hass, elk, monkeypatch):
+    """Return the entity for area 1, giving up on the panel quickly."""
+    alarm = load('alarm_control_panel.elkm1')
+    monkeypatch.setattr(alarm, 'DEFAULT_ACK_TIMEOUT', 0.1)
+    device = alarm.ElkAreaDevice(elk.areas[0], elk, hass, None)
+    device.hass = hass
+    return device
+
+
+def test_entity_arms_through_the_arm_batch(hass, setup_elk, monkeypatch):
+    """Arming from the entity returns once the panel reports it armed."""
+    elk, sent = setup_elk()
+    answer(hass, elk, sent, {'a11': ARMED_AWAY})
+    device = _area(hass, elk, monkeypatch)
+    hass.loop.run_until_complete(device.async_alarm_arm_away('1234'))
+    assert [msg.message[2:11] for msg in sent] == ['a11001234']
+    assert hass.data['elkm1']['arm_latency'].stats()['away']['failed'] == 0
+
+
+@pytest.mark.parametrize('code,replies,error', [
+    (None, {}, 'a numeric code is required'),
+    ('1234', {}, 'timeout'),
+    ('1234', {'a11': INVALID_CODE}, 'invalid code'),
+    ('1234', {'a11': NOT_READY}, 'not ready'),
+    ])
+def test_entity_raises_when_not_armed(hass, setup_elk, monkeypatch,
+                                      code, replies, error):
+    """Failing to arm is an error to the caller, not only a log line."""
+    from homeassistant.exceptions import HomeAssistantError
+    elk, sent = setup_elk()
+    answer(hass, elk, sent, replies)
+    device = _area(hass, elk, monkeypatch)
+    with pytest.raises(HomeAssistantError) as raised:
+        hass.loop.run_until_complete(device.async_alarm_arm_away(code))
+    assert str(raised.value).endswith(error)
@@ -0,0 +1,42 @@
+"""Tests for the keypad access log."""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed  # noqa: E402
+
+
+def test_every_code_entry_is_logged(hass, component, setup_elk):
+    """Repeated and rejected codes are logged, rejected ones without a user."""
+    component.AUDIT_SETTLE_DELAY = 0
+    elk, _ = setup_elk(audit={})
+    elk.users[0].name = 'Alice'
+    feed(elk, 'IC' + '000000000000' + '001' + '01')
+    feed(elk, 'IC' + '000000000000' + '001' + '01')
+    feed(elk, 'IC' + '000102030405' + '000' + '02')
+    hass.loop.run_until_complete(asyncio.sleep(0.05))
+    audit = hass.data['elkm1']['audit']
+    hass.loop.run_until_complete(audit.async_flush())
+    records = audit.query(0, time.time() + 60, None, 100)
+    assert [(record['user'], record['user_name'], record['keypad'],
+             record['result']) for record in records] == [
+                 (1, 'Alice', 1, 'accepted'),
+                 (1, 'Alice', 1, 'accepted'),
+                 (None, None, 2, 'rejected')]
+
+
+@pytest.mark.parametrize('backups', [0, 1])
+def test_rotation_starts_a_new_index(hass, component, tmpdir, backups):
+    """After rotating, queries find only records in the files kept."""
+    path = str(tmpdir.join('audit.log'))
+    audit = component.ElkAuditLog(hass, None, path, 1, backups)
+    fields = (1, 'Alice', 1, None, None, None, 'accepted')
+    # Each write rotates, the file having reached max_size
+    audit._write([(1000.0,) + fields])
+    audit._write([(2000.0,) + fields])
+    assert audit._index[path] == ([2000.0], [0])
+    found = [found['at'] for found in audit.query(0, 3000, None, 10)]
+    assert found == [1000.0, 2000.0][-backups - 1:]
@@ -0,0 +1,76 @@
+"""Tests for the Elk thermostat climate platform."""
+import asyncio
+import json
+import os
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed, load  # noqa: E402
+
+
+def _thermostat(hass, elk):
+    """Return a thermostat entity fed heat 68 and cool 75 by the panel."""
+    climate = load('climate.elkm1')
+    feed(elk, 'TR01' + '2' + '0' + '0' + '72' + '68' + '75' + '40')
+    device = climate.ElkClimateDevice(elk.thermostats[0], elk, hass, None)
+    device.hass = hass
+    return device
+
+
+def _setpoint_writes(sent):
+    """Return (setting, value) of each thermostat write sent."""
+    return [(int(msg.message[8]), int(msg.message[6:8]))
+            for msg in sent if msg.message[2:4] == 'ts']
+
+
+def test_clicks_write_each_setpoint_once(hass, setup_elk):
+    """Five clicks on the cool setpoint make one write, of the last value."""
+    from elkm1.const import ThermostatSetting
+    elk, sent = setup_elk(thermostat_debounce=0.05)
+    device = _thermostat(hass, elk)
+    for click in range(1, 6):
+        hass.loop.run_until_complete(device.async_set_temperature(
+            target_temp_low=68, target_temp_high=75 + click))
+    assert _setpoint_writes(sent) == []
+    hass.loop.run_until_complete(asyncio.sleep(0.1))
+    assert _setpoint_writes(sent) == [
+        (ThermostatSetting.COOL_SETPOINT.value, 80)]
+
+
+def test_no_debounce_writes_every_click(hass, setup_elk):
+    """With thermostat_debounce 0 each changed setpoint is written at once."""
+    from elkm1.const import ThermostatSetting
+    elk, sent = setup_elk(thermostat_debounce=0)
+    device = _thermostat(hass, elk)
+    for click in range(1, 3):
+        hass.loop.run_until_complete(device.async_set_temperature(
+            target_temp_low=68, target_temp_high=75 + click))
+    assert _setpoint_writes(sent) == [
+        (ThermostatSetting.COOL_SETPOINT.value, 76),
+        (ThermostatSetting.COOL_SETPOINT.value, 77)]
+
+
+def test_runtime_per_mode_and_fan(hass, setup_elk, clock):
+    """Time in each mode and fan state is shown, and saved write-behind."""
+    from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+    elk, _ = setup_elk()
+    device = _thermostat(hass, elk)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    clock[0] += 1800
+    feed(elk, 'TR01' + '1' + '0' + '1' + '72' + '68' + '75' + '40')
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    clock[0] += 900
+    attributes = device.device_state_attributes
+    assert attributes['Mode Hours 24h'] == {'Cool': 0.5, 'Heat': 0.25}
+    assert attributes['Mode Hours 7d'] == attributes['Mode Hours 24h']
+    assert attributes['Fan Hours 24h'] == {'Auto': 0.5, 'On': 0.25}
+
+    path = hass.config.path('.storage', 'elkm1.hvac_runtime')
+    assert not os.path.exists(path)
+    hass.bus.async_fire(EVENT_HOMEASSISTANT_STOP)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    with open(path) as saved:
+        data = json.load(saved)['data']
+    assert sum(data['buckets']['thermostat_1_mode']['COOL']) == 1800
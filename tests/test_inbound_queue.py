@@ -0,0 +1,64 @@
+"""Tests for the bounded queue between the panel and entities."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import load  # noqa: E402
+
+
+def _record(element, calls):
+    """Record every (attribute, value) the element's callbacks get."""
+    element.add_callback(
+        lambda attribute, value: calls.append((attribute, value)))
+
+
+def test_burst_keeps_transitions_and_coalesces_the_rest(hass, setup_elk):
+    """Past queue_size, security updates are all kept, others coalesced."""
+    elk, _ = setup_elk(queue_size=4)
+    queue = hass.data['elkm1']['inbound_queue']
+    zone, area, counter = elk.zones[0], elk.areas[0], elk.counters[0]
+    zone_calls, area_calls, counter_calls = [], [], []
+    _record(zone, zone_calls)
+    _record(area, area_calls)
+    _record(counter, counter_calls)
+
+    # The HASS loop is not running, so every update stays queued
+    for step in range(1, 11):
+        zone.setattr('logical_status', step % 3)
+        area.setattr('alarm_state', str(step % 2))
+        counter.setattr('value', step)
+    assert queue.stats()['depth'] > 4
+    hass.loop.run_until_complete(hass.async_block_till_done())
+
+    assert zone_calls == [('logical_status', step % 3)
+                          for step in range(1, 11)]
+    assert area_calls == [('alarm_state', str(step % 2))
+                          for step in range(1, 11)]
+    # Queued before the queue filled up, then only overwritten
+    assert counter_calls == [('value', 10)]
+    stats = queue.stats()
+    assert stats['depth'] == 0
+    assert stats['max_depth'] == 21
+    assert stats['coalesced'] == 9
+    assert stats['processed'] == 21
+
+
+def test_subscribers_sleep_through_other_attributes(hass, setup_elk,
+                                                    monkeypatch):
+    """A temperature zone's sensor is woken for temperature, not status."""
+    from elkm1.const import ZoneType
+    elk, _ = setup_elk()
+    queue = hass.data['elkm1']['inbound_queue']
+    sensor = load('sensor.elkm1')
+    woken = []
+    monkeypatch.setattr(sensor.ElkSensorDevice, 'trigger_update',
+                        lambda self, attribute, value: woken.append(attribute))
+    zone = elk.zones[0]
+    zone.definition = ZoneType.TEMPERATURE.value
+    sensor.ElkSensorDevice(zone, elk, hass, None)
+
+    zone.setattr('logical_status', 2)
+    zone.setattr('temperature', 70)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert woken == ['temperature']
+    assert queue.stats()['skipped'] == 1
@@ -0,0 +1,110 @@
+"""Tests for running panel I/O in its own thread."""
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP  # noqa: E402
+
+from conftest import feed  # noqa: E402
+
+
+class _Transport(object):
+    """Transport recording the thread pausing and resuming it."""
+
+    def __init__(self):
+        self.calls = []
+        self.paused = threading.Event()
+        self.done = threading.Event()
+
+    def pause_reading(self):
+        self.calls.append(('pause', threading.current_thread().name))
+        self.paused.set()
+
+    def resume_reading(self):
+        self.calls.append(('resume', threading.current_thread().name))
+        self.done.set()
+
+
+class _Connection(object):
+    """Panel connection recording the thread writing each message."""
+
+    def __init__(self):
+        self._transport = _Transport()
+        self.written = []
+        self.done = threading.Event()
+
+    def write_data(self, data, response_required=None):
+        self.written.append((data, threading.current_thread().name))
+        self.done.set()
+
+
+def test_send_from_hass_goes_out_on_worker(hass, setup_elk):
+    """Messages sent from the HASS thread are written by the worker."""
+    from elkm1.message import zs_encode
+    elk, _ = setup_elk(record=False, io_thread=True)
+    elk._conn = connection = _Connection()
+    elk.send(zs_encode())
+    assert connection.done.wait(2)
+    assert [name for _, name in connection.written] == ['ElkM1IO']
+
+
+def test_worker_updates_reach_hass_in_one_batch(hass, setup_elk):
+    """Callbacks decoded on the worker run on the HASS loop, batched."""
+    elk, _ = setup_elk(record=False, io_thread=True)
+    worker = hass.data['elkm1']['io_worker']
+    queue = hass.data['elkm1']['inbound_queue']
+    flush = queue._flush
+    flushes = []
+
+    def _flush():
+        flushes.append(threading.current_thread())
+        flush()
+    queue._flush = _flush
+    calls = []
+    for zone in elk.zones[:5]:
+        zone.add_callback(lambda attribute, value, index=zone.index:
+                          calls.append((index, threading.current_thread())))
+
+    def _storm():
+        for index in range(1, 6):
+            feed(elk, 'ZC{:03d}9'.format(index))
+    done = threading.Event()
+    worker.loop.call_soon_threadsafe(lambda: (_storm(), done.set()))
+    assert done.wait(2)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    main = threading.current_thread()
+    assert flushes == [main]
+    assert sorted({index for index, _ in calls}) == [0, 1, 2, 3, 4]
+    assert {thread for _, thread in calls} == {main}
+    assert queue.processed == 10
+
+
+def test_pause_from_hass_thread_runs_on_worker(hass, setup_elk):
+    """A full queue pauses and resumes the worker's transport on its loop."""
+    elk, _ = setup_elk(record=False, io_thread=True, queue_size=1)
+    elk._conn = connection = _Connection()
+    queue = hass.data['elkm1']['inbound_queue']
+    # e.g. an update made by a service call on the HASS loop
+    elk.zones[0].setattr('logical_status', 2)
+    # The HASS loop has not run yet, so the update is still queued
+    assert connection._transport.paused.wait(2)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert connection._transport.done.wait(2)
+    assert connection._transport.calls == [
+        ('pause', 'ElkM1IO'), ('resume', 'ElkM1IO')]
+    assert queue.stats()['pauses'] == 1
+
+
+def test_worker_stops_with_home_assistant(hass, setup_elk):
+    """The worker thread ends on EVENT_HOMEASSISTANT_STOP."""
+    setup_elk(record=False, io_thread=True)
+    worker = hass.data['elkm1']['io_worker']
+    assert worker._thread.is_alive()
+    hass.bus.async_fire(EVENT_HOMEASSISTANT_STOP)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    worker._thread.join(2)
+    assert not worker._thread.is_alive()
+    assert not worker.loop.is_running()
@@ -0,0 +1,79 @@
+"""Tests for switching lights, in bulk and from entities."""
+import asyncio
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import load  # noqa: E402
+
+
+def _plc_writes(sent):
+    """Return the command and house code/unit or bank of each PLC write."""
+    return [msg.message[2:7] for msg in sent
+            if msg.message[2:4] in ('pc', 'pf', 'pn', 'ps')]
+
+
+def _lights_bulk(hass, **data):
+    """Call elkm1.lights_bulk and return the result it reports."""
+    events = []
+    hass.bus.async_listen('elkm1_lights_bulk_done', events.append)
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'lights_bulk', data, blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    return events[0].data
+
+
+def test_whole_house_code_gets_one_command(hass, setup_elk):
+    """All 16 units off is one house-wide command, then a status request."""
+    elk, sent = setup_elk()
+    elk.lights[17].status = 1
+    elk.lights[18].status = 1
+    result = _lights_bulk(hass, lights=['a1-a16', 'b1-b3'], state='off')
+    assert _plc_writes(sent) == ['pcA01', 'pfB02', 'pfB03', 'ps000']
+    assert sent[0].message[7:9] == '01'
+    assert (result['lights'], result['messages'], result['house_commands'],
+            result['skipped']) == (19, 4, 1, 1)
+
+
+def test_dimming_is_sent_per_unit(hass, setup_elk):
+    """Dim levels have no house-wide command; lights already there are skipped."""
+    elk, sent = setup_elk()
+    elk.lights[1].status = 51
+    result = _lights_bulk(hass, lights=['a1-a16'], state='on', brightness=128)
+    assert len(_plc_writes(sent)) == 15
+    assert {msg.message[2:4] + msg.message[9:11] for msg in sent} == {'pc51'}
+    assert 'A02' not in [msg.message[4:7] for msg in sent]
+    assert (result['messages'], result['house_commands'],
+            result['skipped']) == (15, 0, 1)
+
+
+def _light(hass, elk):
+    """Return the entity for light A1."""
+    light = load('light.elkm1')
+    device = light.ElkLightDevice(elk.lights[0], elk, hass, None)
+    device.hass = hass
+    return device
+
+
+def test_slider_drag_writes_first_and_last_level(hass, setup_elk):
+    """Levels asked for within the debounce window collapse into one write."""
+    elk, sent = setup_elk(light_debounce=0.05)
+    device = _light(hass, elk)
+    for brightness in (50, 100, 150, 200):
+        hass.loop.run_until_complete(
+            device.async_turn_on(brightness=brightness))
+    assert [msg.message[9:11] for msg in sent] == ['20']
+    hass.loop.run_until_complete(asyncio.sleep(0.1))
+    assert [msg.message[9:11] for msg in sent] == ['20', '79']
+
+
+def test_turn_off_drops_pending_level(hass, setup_elk):
+    """Turning off during the window is not undone by the trailing write."""
+    elk, sent = setup_elk(light_debounce=0.05)
+    device = _light(hass, elk)
+    hass.loop.run_until_complete(device.async_turn_on(brightness=50))
+    hass.loop.run_until_complete(device.async_turn_on(brightness=200))
+    hass.loop.run_until_complete(device.async_turn_off())
+    hass.loop.run_until_complete(asyncio.sleep(0.1))
+    assert [msg.message[2:4] for msg in sent] == ['pc', 'pf']
@@ -0,0 +1,42 @@
+"""Tests for panel-timed outputs."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+import voluptuous as vol  # noqa: E402
+
+from conftest import load  # noqa: E402
+
+
+def test_outputs_on_sends_one_timed_message_each(hass, setup_elk):
+    """Every output given gets one cn message carrying the duration."""
+    elk, sent = setup_elk()
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'outputs_on',
+        {'outputs': ['5', '10-12'], 'duration': '00:01:30'}, blocking=True))
+    assert [msg.message for msg in sent] == [
+        '0Ecn{:03d}0009000'.format(output) for output in (5, 10, 11, 12)]
+
+
+@pytest.mark.parametrize('duration', [0, 65536, '-00:00:05'])
+def test_outputs_on_rejects_durations_the_panel_cannot_time(component,
+                                                            duration):
+    """Durations must fit the panel's 1 to 65535 seconds."""
+    with pytest.raises(vol.Invalid):
+        component.SERVICE_SCHEMA_OUTPUTS_ON(
+            {'outputs': ['1'], 'duration': duration})
+
+
+def test_switch_computes_state_in_the_callback(hass, setup_elk):
+    """An output change sets the state then writes it, with no refresh job."""
+    elk, _ = setup_elk()
+    switch = load('switch.elkm1')
+    device = switch.ElkOutputDevice(elk.outputs[0], elk, hass, None)
+    device.hass = hass
+    written = []
+    device.async_schedule_update_ha_state = \
+        lambda force_refresh=False: written.append((device.state,
+                                                    force_refresh))
+    elk.outputs[0].setattr('output_on', True)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert written == [('on', False)]
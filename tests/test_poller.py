@@ -0,0 +1,71 @@
+"""Tests for the adaptive temperature poll scheduler."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed, load  # noqa: E402
+
+THERMOSTAT_DATA = '1' + '0' + '0' + '72' + '68' + '75' + '40'
+
+
+def _polls(sent):
+    """Return the poll requests sent, lw or the thermostat number."""
+    return [msg.message[2:4] if msg.message[2:4] == 'lw'
+            else int(msg.message[4:6])
+            for msg in sent if msg.message[2:4] in ('lw', 'tr')]
+
+
+def test_polls_stay_within_budget(hass, setup_elk, clock):
+    """Due polls beyond the per minute budget wait for the budget to refill."""
+    elk, sent = setup_elk(poll_budget=2)
+    poller = hass.data['elkm1']['poller']
+    elk._conn = object()
+    for thermostat in elk.thermostats[:3]:
+        thermostat.name = 'Thermostat {}'.format(thermostat.index + 1)
+    poller.async_tick()
+    assert _polls(sent) == []
+
+    clock[0] += 120
+    poller.async_tick()
+    assert len(_polls(sent)) == 2
+    poller.async_tick()
+    assert len(_polls(sent)) == 2
+
+    # Half a minute refills one of the two messages
+    clock[0] += 30
+    poller.async_tick()
+    assert len(_polls(sent)) == 3
+    clock[0] += 60
+    poller.async_tick()
+    assert sorted(_polls(sent)[:4], key=str) == [1, 2, 3, 'lw']
+    elk._conn = None
+
+
+def test_changing_readings_are_polled_sooner(hass, setup_elk, clock):
+    """A changed reading halves the interval, a stable one doubles it."""
+    elk, _ = setup_elk()
+    poller = hass.data['elkm1']['poller']
+    feed(elk, 'TR01' + '0' + THERMOSTAT_DATA[1:])
+    feed(elk, 'TR01' + '0' + THERMOSTAT_DATA[1:])
+    assert poller._targets[('thermostat', 0)]['interval'] == 240
+    feed(elk, 'TR01' + '0' + '0' + '0' + '73' + THERMOSTAT_DATA[5:])
+    assert poller._targets[('thermostat', 0)]['interval'] == 120
+    # Heating, so never more than POLL_ACTIVE_MAX_INTERVAL apart
+    for _ in range(6):
+        feed(elk, 'TR01' + THERMOSTAT_DATA)
+    assert poller._targets[('thermostat', 0)]['interval'] == 300
+
+
+def test_thermostat_shows_staleness(hass, setup_elk, clock):
+    """Thermostats show when their reading was reported and how long ago."""
+    elk, _ = setup_elk()
+    climate = load('climate.elkm1')
+    device = climate.ElkClimateDevice(elk.thermostats[0], elk, hass, None)
+    device.hass = hass
+    assert device.device_state_attributes['Staleness'] is None
+    reported = clock[0]
+    feed(elk, 'TR01' + THERMOSTAT_DATA)
+    clock[0] += 42
+    attributes = device.device_state_attributes
+    assert attributes['Last Reported'] == reported
+    assert attributes['Staleness'] == 42
@@ -0,0 +1,45 @@
+"""Tests for profiling the integration on demand."""
+import pstats
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed  # noqa: E402
+
+
+def test_profile_service_writes_report(hass, setup_elk):
+    """Lines decoded during the run are in the pstats file and report."""
+    elk, _ = setup_elk()
+    events = []
+    hass.bus.async_listen('elkm1_profile_done', events.append)
+    for delay, status in ((0.1, 9), (0.2, 2)):
+        hass.loop.call_later(delay, feed, elk, 'ZC001' + str(status))
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'profile', {'duration': 1, 'file': 'profile'},
+        blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    result = events[0].data
+    path = hass.config.path('profile')
+    assert (result['pstats'], result['report']) == (
+        path + '.pstats', path + '.txt')
+    assert result['threads'] == 1
+    # Two lines decoded, and the queue flushed after each
+    assert result['calls'] == 4
+    functions = {function for _, _, function
+                 in pstats.Stats(result['pstats']).stats}
+    assert '_zc_decode' in functions
+    with open(result['report']) as report_file:
+        assert '_zc_decode' in report_file.read()
+
+
+def test_nothing_is_profiled_outside_a_run(hass, setup_elk):
+    """Calls before start and after stop are not profiled."""
+    elk, _ = setup_elk()
+    profiler = hass.data['elkm1']['profiler']
+    feed(elk, 'ZC0019')
+    profiler.start()
+    profiler.stop()
+    feed(elk, 'ZC0012')
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert profiler.write(hass.config.path('profile')) is None
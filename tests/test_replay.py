@@ -0,0 +1,73 @@
+"""Tests for replaying a traffic capture."""
+import asyncio
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed, frame, load  # noqa: E402
+
+# User 1 entering a code on keypad 1
+CODE_ENTRY = 'IC' + '000000000000' + '001' + '01'
+
+
+def _entities(hass, elk):
+    """Return a zone 1 sensor and a thermostat 1 entity."""
+    sensor = load('sensor.elkm1')
+    climate = load('climate.elkm1')
+    added = []
+    assert hass.loop.run_until_complete(sensor.async_setup_platform(
+        hass, {}, lambda devices, update: added.extend(devices), []))
+    thermostat = climate.ElkClimateDevice(elk.thermostats[0], elk, hass, None)
+    thermostat.hass = hass
+    thermostat.entity_id = 'climate.elkm1_thermostat_001'
+    return added, thermostat
+
+
+def _live(hass, elk, body):
+    """Feed a message and let entities see it before the next one."""
+    feed(elk, body)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+
+
+def _recorded(hass):
+    """Return the audit log and the on-time and runtime counters."""
+    audit = hass.data['elkm1']['audit']
+    hass.loop.run_until_complete(asyncio.sleep(0.01))
+    hass.loop.run_until_complete(audit.async_flush())
+    with open(audit._path) as audit_file:
+        lines = audit_file.read()
+    return (lines,
+            hass.data['elkm1']['on_time']._data_to_save()['counts'],
+            hass.data['elkm1']['hvac_runtime']._data_to_save()['counts'])
+
+
+def test_replay_records_no_access_or_accounting(hass, component, setup_elk):
+    """Replayed code entries and changes leave the logs and totals alone."""
+    component.AUDIT_SETTLE_DELAY = 0
+    elk, _ = setup_elk(audit={}, zone={'enabled': True, 'include': ['1']})
+    _entities(hass, elk)
+    # Live traffic, recorded: a violation, a code entry, heat then cool
+    for body in ('ZC0019', 'ZC0010', 'ZC0019', CODE_ENTRY,
+                 'TR01' + '1' + '0' + '0' + '72' + '68' + '75' + '40',
+                 'TR01' + '2' + '0' + '0' + '72' + '68' + '75' + '40'):
+        _live(hass, elk, body)
+    before = _recorded(hass)
+    assert before[0].count('\n') == 1
+    assert sum(before[1]['zone_1']['VIOLATED']) == 1
+    assert sum(before[2]['thermostat_1_mode']['COOL']) == 1
+
+    # Paced, so entities see each replayed change
+    hass.loop.run_until_complete(component._async_replay(hass, elk, [
+        (10, frame(body)) for body in (
+            'ZC0010', 'ZC0019', CODE_ENTRY,
+            'TR01' + '1' + '0' + '0' + '72' + '68' + '75' + '40')], 1000))
+    assert elk.thermostats[0].mode == 1
+    assert _recorded(hass) == before
+
+    # Recording carries on once the replay is over
+    _live(hass, elk, 'ZC0010')
+    _live(hass, elk, CODE_ENTRY)
+    after = _recorded(hass)
+    assert after[0].count('\n') == 2
+    assert after[1]['zone_1'] != before[1]['zone_1']
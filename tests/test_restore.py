@@ -0,0 +1,78 @@
+"""Tests for showing restored state until the panel confirms it."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from homeassistant.core import State  # noqa: E402
+from homeassistant.helpers.restore_state import DATA_RESTORE_CACHE  # noqa: E402
+
+from conftest import feed, load  # noqa: E402
+
+
+def _restore(hass, *states):
+    """Have these states restored, as if the recorder had them."""
+    hass.data[DATA_RESTORE_CACHE] = {state.entity_id: state
+                                     for state in states}
+
+
+def _add(hass, device):
+    """Run what Home Assistant does when adding the entity."""
+    device.hass = hass
+    hass.loop.run_until_complete(device.async_added_to_hass())
+    return device
+
+
+def test_output_is_stale_until_output_status(hass, setup_elk):
+    """A restored output shows its last state until CS arrives."""
+    elk, _ = setup_elk()
+    switch = load('switch.elkm1')
+    device = switch.ElkOutputDevice(elk.outputs[0], elk, hass, None)
+    _restore(hass, State(device.entity_id, 'on'))
+    _add(hass, device)
+    assert device.state == 'on'
+    assert device.device_state_attributes['stale'] is True
+
+    feed(elk, 'ZS' + '0' * 208)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert device.device_state_attributes.get('stale') is True
+
+    feed(elk, 'CS' + '0' * 208)
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert 'stale' not in device.device_state_attributes
+    assert device.state == 'off'
+
+
+def test_thermostat_is_stale_until_its_own_data(hass, setup_elk):
+    """A restored thermostat ignores data for other thermostats."""
+    elk, _ = setup_elk()
+    climate = load('climate.elkm1')
+    device = climate.ElkClimateDevice(elk.thermostats[0], elk, hass, None)
+    _restore(hass, State(device.entity_id, 'cool',
+                         {'current_temperature': 70}))
+    _add(hass, device)
+    assert device.device_state_attributes['stale'] is True
+    assert device.current_operation == 'cool'
+
+    feed(elk, 'TR02' + '1' + '0' + '0' + '72' + '68' + '75' + '40')
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert device.device_state_attributes['stale'] is True
+    assert device.current_temperature == 70
+
+    feed(elk, 'TR01' + '1' + '0' + '0' + '72' + '68' + '75' + '40')
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert 'stale' not in device.device_state_attributes
+    assert device.current_operation == 'heat'
+    assert device.current_temperature == 72
+
+
+def test_synced_entity_is_not_restored(hass, setup_elk):
+    """An entity added after its sync message shows panel state at once."""
+    elk, _ = setup_elk()
+    feed(elk, 'CS' + '1' + '0' * 207)
+    switch = load('switch.elkm1')
+    device = switch.ElkOutputDevice(elk.outputs[0], elk, hass, None)
+    _restore(hass, State(device.entity_id, 'off'))
+    _add(hass, device)
+    hass.loop.run_until_complete(device.async_update())
+    assert 'stale' not in device.device_state_attributes
+    assert device.state == 'on'
@@ -0,0 +1,99 @@
+"""Tests for rules run on panel messages."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed, frame  # noqa: E402
+
+RULES = [
+    {'zone': 1, 'attribute': 'logical_status', 'value': 'violated',
+     'outputs': 5, 'duration': 30},
+    {'area': 1, 'attribute': 'armed_status', 'value': 'armed_away',
+     'lights': 'a1-a2', 'state': 'off'},
+    {'output': 1, 'attribute': 'output_on', 'value': True, 'tasks': 1},
+    ]
+
+
+def _rule_writes(sent):
+    """Return the commands sent by rules."""
+    return [msg.message[2:4] for msg in sent
+            if msg.message[2:4] in ('cn', 'pf', 'tn')]
+
+
+def _sync(elk):
+    """Feed the status the panel sends on connecting, all set off."""
+    feed(elk, 'ZS' + '9' + '0' * 207)
+    feed(elk, 'AS' + '1' + '0' * 7 + '4' + '0' * 7 + '0' * 8)
+    feed(elk, 'CS' + '1' + '0' * 207)
+
+
+def test_sync_does_not_fire_rules(hass, setup_elk):
+    """Status from the startup and reconnect syncs fires nothing."""
+    elk, sent = setup_elk(rules=RULES)
+    _sync(elk)
+    assert _rule_writes(sent) == []
+    feed(elk, 'ZS' + '0' * 208)
+    feed(elk, 'CS' + '0' * 208)
+    elk._connected(None, None)
+    _sync(elk)
+    assert _rule_writes(sent) == []
+
+
+def test_live_changes_fire_rules(hass, setup_elk):
+    """Zone, area and output changes after the sync fire their rules."""
+    elk, sent = setup_elk(rules=RULES)
+    feed(elk, 'ZS' + '0' * 208)
+    feed(elk, 'AS' + '0' * 24)
+    feed(elk, 'CS' + '0' * 208)
+    feed(elk, 'ZC' + '001' + '9')
+    feed(elk, 'AS' + '1' + '0' * 7 + '4' + '0' * 7 + '0' * 8)
+    feed(elk, 'CC' + '001' + '1')
+    assert _rule_writes(sent) == ['cn', 'pf', 'pf', 'tn']
+
+
+def test_replay_does_not_fire_rules(hass, component, setup_elk):
+    """Changes decoded from a replayed capture fire nothing."""
+    elk, sent = setup_elk(rules=RULES)
+    _sync(elk)
+    feed(elk, 'ZC0010')
+    hass.loop.run_until_complete(component._async_replay(
+        hass, elk, [(0, frame('ZC0019'))], None))
+    assert elk.zones[0].logical_status == 2
+    assert hass.data['elkm1']['rules'].fired == 0
+    assert _rule_writes(sent) == []
+
+
+@pytest.mark.parametrize('rule,key,value', [
+    ({'area': 1, 'attribute': 'armed_status', 'value': 1}, ('Area', 0,
+     'armed_status'), '1'),
+    ({'area': 1, 'attribute': 'alarm_state', 'value': 'fire_alarm'},
+     ('Area', 0, 'alarm_state'), '3'),
+    ({'zone': 2, 'attribute': 'logical_status', 'value': '2'},
+     ('Zone', 1, 'logical_status'), 2),
+    ({'output': 1, 'attribute': 'output_on', 'value': 'on'},
+     ('Output', 0, 'output_on'), True),
+    ({'zone': 1, 'attribute': 'bypassed'}, ('Zone', 0, 'bypassed'), None),
+    ])
+def test_values_take_the_attributes_type(component, rule, key, value):
+    """Values by name or number compare equal to what the element holds."""
+    assert component.ElkRuleEngine._compile_trigger(rule) == (key, value)
+
+
+@pytest.mark.parametrize('rule', [
+    {'area': 1, 'attribute': 'armed_status', 'value': 42},
+    {'area': 1, 'attribute': 'armed_status', 'value': 'armed_sideways'},
+    {'zone': 1, 'attribute': 'logical_status', 'value': True},
+    {'output': 1, 'attribute': 'output_on', 'value': 'maybe'},
+    ])
+def test_values_the_attribute_cannot_take_are_rejected(component, rule):
+    """A rule that could never fire is not compiled."""
+    assert component.ElkRuleEngine._compile_trigger(rule) is None
+
+
+def test_numeric_armed_status_fires(hass, setup_elk):
+    """value: 1 for armed_status fires on the panel's '1'."""
+    elk, sent = setup_elk(rules=[
+        {'area': 1, 'attribute': 'armed_status', 'value': 1, 'tasks': 1}])
+    feed(elk, 'AS' + '0' * 24)
+    feed(elk, 'AS' + '1' + '0' * 7 + '4' + '0' * 7 + '0' * 8)
+    assert _rule_writes(sent) == ['tn']
@@ -0,0 +1,88 @@
+"""Tests for the Elk sensor platform."""
+import types
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+from conftest import feed, load  # noqa: E402
+
+
+def _setup_platform(hass):
+    """Set up the sensor platform, returning the entities it adds."""
+    sensor = load('sensor.elkm1')
+    added = []
+    assert hass.loop.run_until_complete(sensor.async_setup_platform(
+        hass, {}, lambda devices, update: added.extend(devices), []))
+    return added
+
+
+def test_history_resolves_entity_id(hass, setup_elk):
+    """elkm1.history finds a zone by its lowercase entity_id."""
+    setup_elk(zone={'enabled': True, 'include': ['1']})
+    entity_ids = [device.entity_id for device in _setup_platform(hass)]
+    assert 'sensor.elkm1_zone_001' in entity_ids
+    events = []
+    hass.bus.async_listen('elkm1_history', events.append)
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'history', {'entity_id': 'sensor.elkm1_zone_001'},
+        blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    assert list(events[0].data) == ['sensor.elkm1_zone_001']
+
+
+def _flush(hass):
+    """Let queued element updates reach the entities."""
+    hass.loop.run_until_complete(hass.async_block_till_done())
+
+
+def _countdown(hass, elk):
+    """Return the sensor module and the countdown of area 1."""
+    sensor = load('sensor.elkm1')
+    device = sensor.ElkAreaTimerSensor(elk.areas[0], elk, hass, None)
+    device.hass = hass
+    device.async_schedule_update_ha_state = lambda: None
+    return sensor, device
+
+
+def test_countdown_follows_entry_exit_timer(hass, setup_elk, monkeypatch):
+    """The countdown runs down from the reported timer until disarmed."""
+    elk, _ = setup_elk()
+    sensor, device = _countdown(hass, elk)
+    assert (device.state, device.device_state_attributes['Timer']) == (0, None)
+
+    # Exit delay of 30s, armed away
+    feed(elk, 'EE1' + '0' + '030' + '000' + '1')
+    _flush(hass)
+    now = [elk.areas[0].timer_timestamp]
+    monkeypatch.setattr(sensor, 'time', types.SimpleNamespace(
+        time=lambda: now[0]))
+    assert (device.state, device.device_state_attributes['Timer']) == (
+        30, 'Exit')
+    assert device._tick_handle is not None
+    now[0] += 10.5
+    assert device.state == 20
+    device._tick()
+    assert device._tick_handle is not None
+
+    # Disarming stops it before it runs out
+    feed(elk, 'AS' + '0' * 8 + '1' * 8 + '0' * 8)
+    _flush(hass)
+    assert (device.state, device.device_state_attributes['Timer']) == (0, None)
+    assert device._tick_handle is None
+
+
+def test_countdown_stops_when_run_out(hass, setup_elk, monkeypatch):
+    """No tick is scheduled once the time left reaches zero."""
+    elk, _ = setup_elk()
+    sensor, device = _countdown(hass, elk)
+    feed(elk, 'EE1' + '1' + '005' + '000' + '1')
+    _flush(hass)
+    assert device.device_state_attributes['Timer'] == 'Entry'
+    now = [elk.areas[0].timer_timestamp + 6]
+    monkeypatch.setattr(sensor, 'time', types.SimpleNamespace(
+        time=lambda: now[0]))
+    device._tick()
+    assert device.state == 0
+    assert device._tick_handle is None
+    assert device.device_state_attributes['Timer'] is None
@@ -0,0 +1,56 @@
+"""Tests for writing counters and settings in one batch."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+import voluptuous as vol  # noqa: E402
+
+from conftest import answer  # noqa: E402
+
+
+def _set_values(hass, values, timeout=0.1):
+    """Call elkm1.set_values and return the results it reports."""
+    events = []
+    hass.bus.async_listen('elkm1_set_values_done', events.append)
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'set_values', {'values': values, 'timeout': timeout},
+        blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    return events[0].data['results']
+
+
+def test_each_write_gets_its_outcome(hass, setup_elk):
+    """Acked, read back different, unanswered and unknown writes."""
+    elk, sent = setup_elk()
+    answer(hass, elk, sent, {
+        'cx01': 'CV01' + '00005',
+        'cr03': 'CR03' + '00011' + '0',
+        })
+    results = _set_values(hass, [
+        {'kind': 'counter', 'index': 1, 'value': 5},
+        {'kind': 'setting', 'index': 3, 'value': 10},
+        {'kind': 'counter', 'index': 2, 'value': 7},
+        {'kind': 'counter', 'index': 65, 'value': 1},
+        ])
+    assert [(result['index'], result['success'], result.get('actual'),
+             result.get('error')) for result in results] == [
+                 (65, False, None, 'unknown'),
+                 (1, True, 5, None),
+                 (3, False, 11, None),
+                 (2, False, None, 'timeout')]
+    # Every write went out before waiting on any
+    assert [msg.message[2:6] for msg in sent] == [
+        'cx01', 'cw03', 'cr03', 'cx02']
+    assert elk.counters[0].value == 5
+
+
+@pytest.mark.parametrize('values', [
+    [{'kind': 'counter', 'index': 1, 'value': 5},
+     {'kind': 'counter', 'index': 1, 'value': 6}],
+    [{'kind': 'counter', 'index': 1, 'value': 65536}],
+    [{'kind': 'setting', 'index': 0, 'value': 1}],
+    ])
+def test_bad_batches_are_rejected(component, values):
+    """Duplicates and values or indexes out of range fail validation."""
+    with pytest.raises(vol.Invalid):
+        component.SERVICE_SCHEMA_SET_VALUES({'values': values})
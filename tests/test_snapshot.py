@@ -0,0 +1,58 @@
+"""Tests for writing every panel element to a file."""
+import json
+import types
+
+import pytest
+
+pytest.importorskip('homeassistant')
+
+
+def _snapshot(hass, **data):
+    """Call elkm1.snapshot and return the result it reports."""
+    events = []
+    hass.bus.async_listen('elkm1_snapshot_done', events.append)
+    hass.loop.run_until_complete(hass.services.async_call(
+        'elkm1', 'snapshot', data, blocking=True))
+    hass.loop.run_until_complete(hass.async_block_till_done())
+    return events[0].data
+
+
+def test_json_groups_elements_by_type(hass, setup_elk):
+    """One document, every element of every type with its values."""
+    elk, _ = setup_elk()
+    elk.zones[2].name = 'Front Door'
+    result = _snapshot(hass)
+    with open(hass.config.path('elkm1_snapshot.json')) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    elements = snapshot['elements']
+    assert list(elements) == elk.element_list
+    assert len(elements['zones']) == 208
+    assert elements['zones'][2]['name'] == 'Front Door'
+    assert elements['zones'][2]['index'] == 2
+    assert len(elements['panel']) == 1
+    assert result['elements'] == sum(
+        len(records) for records in elements.values())
+
+
+def test_jsonl_writes_a_line_per_element(hass, setup_elk):
+    """One JSON line per element, carrying its type and the time taken."""
+    elk, _ = setup_elk()
+    result = _snapshot(hass, file='snapshot.jsonl', format='jsonl')
+    with open(hass.config.path('snapshot.jsonl')) as snapshot_file:
+        records = [json.loads(line) for line in snapshot_file]
+    assert len(records) == result['elements']
+    assert [record['type'] for record in records
+            if record['index'] == 0][:2] == elk.element_list[:2]
+    assert len({record['taken_at'] for record in records}) == 1
+
+
+def test_panel_reading_is_held_back_while_writing(hass, setup_elk):
+    """Reading from the panel is paused for the walk, then resumed."""
+    elk, _ = setup_elk()
+    calls = []
+    elk._conn = types.SimpleNamespace(_transport=types.SimpleNamespace(
+        pause_reading=lambda: calls.append('pause'),
+        resume_reading=lambda: calls.append('resume')))
+    _snapshot(hass)
+    elk._conn = None
+    assert calls == ['pause', 'resume']
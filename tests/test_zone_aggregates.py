@@ -0,0 +1,54 @@
+"""Tests for the per area groups of violated, bypassed and open zones."""
+import pytest
+
+pytest.importorskip('homeassistant')
+
+VIOLATED, BYPASSED = 2, 3
+NORMAL, OPEN = 0, 1
+
+
+@pytest.fixture
+def aggregates(component):
+    """Return aggregates recording which areas' listeners were called."""
+    aggregates = component.ElkZoneAggregates()
+    aggregates.notified = []
+    for area in (0, 1, 2):
+        aggregates.async_add_listener(
+            area, lambda area=area: aggregates.notified.append(area))
+    return aggregates
+
+
+def test_status_change_moves_zone_between_groups(aggregates):
+    """A zone leaves the groups of its old status for those of its new one."""
+    aggregates.update(5, 1, VIOLATED, OPEN)
+    assert aggregates.members(1, 'violated') == [5]
+    assert aggregates.members(1, 'open') == [5]
+    assert aggregates.members(0, 'violated') == [5]
+
+    aggregates.update(5, 1, BYPASSED, NORMAL)
+    assert aggregates.members(1, 'violated') == []
+    assert aggregates.members(1, 'open') == []
+    assert aggregates.members(1, 'bypassed') == [5]
+    assert aggregates.members(0, 'bypassed') == [5]
+    assert sorted(aggregates.notified) == [0, 0, 1, 1]
+
+
+def test_area_change_moves_zone_between_areas(aggregates):
+    """A zone moved to another area is in that area's groups only."""
+    aggregates.update(5, 1, VIOLATED, NORMAL)
+    aggregates.update(6, 1, VIOLATED, NORMAL)
+    del aggregates.notified[:]
+    aggregates.update(5, 2, VIOLATED, NORMAL)
+    assert aggregates.members(1, 'violated') == [6]
+    assert aggregates.members(2, 'violated') == [5]
+    assert aggregates.members(0, 'violated') == [5, 6]
+    # Both areas and the panel wide groups changed
+    assert sorted(aggregates.notified) == [0, 1, 2]
+
+
+def test_unchanged_zone_notifies_no_one(aggregates):
+    """A report of the status a zone already has changes nothing."""
+    aggregates.update(5, 1, VIOLATED, OPEN)
+    del aggregates.notified[:]
+    aggregates.update(5, 1, VIOLATED, OPEN)
+    assert aggregates.notified == []